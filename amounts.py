@@ -0,0 +1,45 @@
+# Parse a BRL amount like "R$ 1.234.567,89" without the locale module, by
+# dropping the currency symbol and the thousands separators and turning the
+# decimal comma into a point. Negative amounts may have the sign before or
+# after the currency symbol, or be in parentheses. Blank amounts are None,
+# and malformed ones raise ValueError like locale.atof.
+def parse_brl_amount(text):
+    if text is None:
+        return None
+
+    value = text.replace('R$', '').replace('.', '').replace(',', '.')
+    try:
+        return float(value)
+    except ValueError:
+        return parse_unusual_brl_amount(value)
+
+# Parse the amounts that float() does not take once the separators are
+# replaced: blanks, "- 1.00" from "-R$ 1,00", and "(1.00)"
+def parse_unusual_brl_amount(value):
+    value = ''.join(value.split())
+    if value == '' or value == '-':
+        return None
+
+    if value[0] == '(' and value[-1] == ')':
+        return -float(value[1:-1])
+
+    return float(value)
+
+# Parse a column of BRL amounts in one call. The common case is inlined,
+# which makes it several times faster than locale.atof per value.
+def parse_brl_amounts(texts):
+    amounts = []
+    append = amounts.append
+
+    for text in texts:
+        if text is None:
+            append(None)
+            continue
+
+        value = text.replace('R$', '').replace('.', '').replace(',', '.')
+        try:
+            append(float(value))
+        except ValueError:
+            append(parse_unusual_brl_amount(value))
+
+    return amounts
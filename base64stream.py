@@ -0,0 +1,52 @@
+import binascii
+import string
+
+# Bytes of the base64 alphabet, including the padding
+BASE64_ALPHABET = (string.ascii_letters + string.digits + '+/=').encode('ascii')
+
+# Bytes that are not part of base64, discarded like base64.b64decode does
+NON_BASE64_BYTES = bytes(sorted(set(range(256)) - set(BASE64_ALPHABET)))
+
+# Incremental base64 decoder. The chunks are decoded as they arrive and the
+# result is appended to a bytearray or written to a file, so only the
+# decoded document is kept in memory instead of the encoded text and its
+# intermediate copies.
+class Base64StreamDecoder:
+    def __init__(self, output=None):
+        self.output = bytearray() if output is None else output
+        self._pending = b''
+
+    def _write(self, data):
+        if isinstance(self.output, bytearray):
+            self.output += data
+        else:
+            self.output.write(data)
+
+    # Decode a chunk of the base64 content, keeping the incomplete quantum
+    # of 4 characters for the next chunk
+    def feed(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii')
+
+        data = self._pending + chunk.translate(None, NON_BASE64_BYTES)
+        size = len(data) - len(data) % 4
+        self._pending = data[size:]
+
+        if size > 0:
+            self._write(binascii.a2b_base64(data[:size]))
+
+    # Decode the remaining content and return the output
+    def close(self):
+        if self._pending:
+            # A truncated last quantum is invalid, as in base64.b64decode
+            raise binascii.Error('Incorrect padding')
+
+        return self.output
+
+# Decode an iterable of base64 chunks into a bytearray or a file
+def decode_base64_chunks(chunks, output=None):
+    decoder = Base64StreamDecoder(output)
+    for chunk in chunks:
+        decoder.feed(chunk)
+
+    return decoder.close()
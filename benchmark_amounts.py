@@ -0,0 +1,73 @@
+import argparse
+import locale
+import random
+import time
+from amounts import parse_brl_amounts
+
+# Generate report values formatted like the CVM reports, e.g. "R$ 1.234.567,89"
+def generate_values(count, seed=42):
+    rng = random.Random(seed)
+    values = []
+    for _ in range(count):
+        cents = rng.choice((0, rng.randint(1, 99_999), rng.randint(1, 10 ** 13)))
+        if rng.random() < 0.05:
+            cents = -cents
+
+        integer = f"{abs(cents) // 100:,}".replace(',', '.')
+        values.append(f"R$ {'-' if cents < 0 else ''}{integer},{abs(cents) % 100:02d}")
+
+    return values
+
+# Convert the values like the loader did: pt_BR locale and locale.atof
+# after slicing off the currency symbol
+def parse_with_locale(values):
+    locale.setlocale(locale.LC_NUMERIC, 'pt_BR.UTF8')
+    locale.setlocale(locale.LC_MONETARY, 'pt_BR.UTF8')
+    currency_symbol = locale.localeconv()['currency_symbol']
+
+    return [locale.atof(value[len(currency_symbol) + 1:]) for value in values]
+
+# The same conversion as locale.atof with the pt_BR separators, for the
+# hosts without the pt_BR locale
+def parse_with_replace(values):
+    return [float(value[3:].replace('.', '').replace(',', '.')) for value in values]
+
+# Best time of the conversion of the values over the passes
+def time_parser(parse, values, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = parse(values)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return result, best
+
+parser = argparse.ArgumentParser(description='Check and benchmark the BRL amount parser against the locale path')
+parser.add_argument('--count', type=int, default=200_000, help='number of values')
+parser.add_argument('--repeat', type=int, default=5, help='number of passes, the best one is reported')
+args = parser.parse_args()
+
+values = generate_values(args.count)
+
+try:
+    reference_name = 'locale'
+    parse_with_locale(values[:1])
+    reference = parse_with_locale
+except locale.Error:
+    reference_name = 'replace'
+    reference = parse_with_replace
+    print("The pt_BR.UTF8 locale is not available, comparing with the equivalent string replaces")
+
+expected, reference_time = time_parser(reference, values, args.repeat)
+parsed, parsed_time = time_parser(parse_brl_amounts, values, args.repeat)
+
+mismatches = sum(1 for a, b in zip(expected, parsed) if a != b)
+
+print(f"{'parser':<10} {'values/sec':>12}")
+print(f"{reference_name:<10} {args.count / reference_time:>12,.0f}")
+print(f"{'brl':<10} {args.count / parsed_time:>12,.0f}")
+print(f"{mismatches} mismatches out of {args.count} values")
+
+if mismatches:
+    raise SystemExit(1)
@@ -0,0 +1,213 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import psycopg2
+from mockserver import MockServer, SyntheticFixtures, CorpusFixtures
+from schema import apply_migrations
+
+# Folder of the loaders and scrapers
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stages of the benchmark: (name, script, counter of the documents done,
+# counter of the rows written). The loaders run in the order of a real
+# load, each one in a process of its own.
+LOADER_STAGES = (
+    ('load_fdic', 'load_fdic.py', None, 'fdic_inserted'),
+    ('load_fdic_details', 'load_fdic_detaisl.py', 'fdic_details_done', 'fdic_details_done'),
+    ('load_fdic_reports_id', 'load_fdic_reports_id.py', 'fdic_reports_done', 'reports_inserted'),
+    ('load_fdic_reports', 'load_fdic_report.py', 'report_data_done', 'report_data_rows')
+)
+# The four loaders as the single streaming ingest of ingest.py
+PIPELINE_STAGES = (
+    ('ingest', 'ingest.py', 'report_data_done', 'report_data_rows'),
+)
+SCRAPER_STAGES = (
+    ('get_fdic_details', os.path.join('get-html', 'get_fdic_details.py'), 'items_done', None),
+    ('get_fdic_reports_id', os.path.join('get-html', 'get_fdic_reports_id.py'), 'items_done', None),
+    ('get_fdic_reports_data', os.path.join('get-html', 'get_fdic_reports_data.py'), 'items_done', None)
+)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# PostgreSQL server created in a temporary folder for a single benchmark
+# run, with durability turned off as its data is thrown away. Needs the
+# PostgreSQL server binaries (initdb, pg_ctl) and a non-root user.
+class ThrowawayPostgres:
+    def __init__(self, bin_dir=None):
+        self.bin_dir = bin_dir
+        self.folder = None
+        self.port = None
+
+    def command(self, name):
+        return os.path.join(self.bin_dir, name) if self.bin_dir else name
+
+    def start(self):
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            raise RuntimeError('PostgreSQL does not run as root, use --use-env-db with an existing database')
+
+        self.folder = tempfile.mkdtemp(prefix='precatorios-pg-')
+        self.port = free_port()
+        data = os.path.join(self.folder, 'data')
+
+        subprocess.run([self.command('initdb'), '-D', data, '-U', 'bench', '--auth=trust', '-E', 'UTF8'],
+                       check=True, stdout=subprocess.DEVNULL)
+        options = (f"-p {self.port} -k {self.folder} -c listen_addresses=127.0.0.1 "
+                   "-c fsync=off -c synchronous_commit=off -c full_page_writes=off")
+        subprocess.run([self.command('pg_ctl'), '-D', data, '-o', options, '-l', os.path.join(self.folder, 'log'),
+                        '-w', 'start'], check=True, stdout=subprocess.DEVNULL)
+
+        conn = psycopg2.connect(host='127.0.0.1', port=self.port, user='bench', database='postgres')
+        conn.autocommit = True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("CREATE DATABASE bench")
+            cursor.close()
+        finally:
+            conn.close()
+
+        return self
+
+    def stop(self):
+        subprocess.run([self.command('pg_ctl'), '-D', os.path.join(self.folder, 'data'), '-m', 'immediate', 'stop'],
+                       stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def environment(self):
+        return {'DB_HOST': '127.0.0.1', 'DB_PORT': str(self.port), 'DB_NAME': 'bench', 'DB_USER': 'bench', 'DB_PASSWORD': ''}
+
+# Run a stage script in a process of its own from the work folder. Returns
+# the wall time, the exit status and the peak RSS (MB) of the process.
+def run_stage(script, work_dir, env, log_path):
+    with open(log_path, 'wb') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(PROJECT_DIR, script)], cwd=work_dir, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+
+        # wait4 gives the resource usage of this process alone
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+
+    return elapsed, os.waitstatus_to_exitcode(status), usage.ru_maxrss / 1024
+
+# Read the metrics summary written by the stage
+def read_stage_metrics(metrics_dir):
+    paths = sorted(glob.glob(os.path.join(metrics_dir, '*.json')))
+    if not paths:
+        return {}
+
+    with open(paths[-1], encoding='utf-8') as file:
+        return json.load(file)
+
+# Write the listing page where load_fdic.py and the scrapers read it
+def write_listing(work_dir, listing):
+    os.makedirs(os.path.join(work_dir, 'html'), exist_ok=True)
+    with open(os.path.join(work_dir, 'html', 'CVM-DadosCadastrais.htm'), 'wb') as file:
+        file.write(listing)
+
+def format_latency(value):
+    return format_optional(value * 1000 if value is not None else None, '.1f')
+
+def format_optional(value, format_spec=''):
+    return format(value, format_spec) if value is not None else '-'
+
+def print_results(results):
+    print(f"\n{'stage':<22} {'status':>6} {'secs':>8} {'docs':>8} {'docs/s':>9} {'rows':>9} {'rows/s':>10} {'RSS MB':>8}")
+    for result in results:
+        print(f"{result['stage']:<22} {result['exit_code']:>6} {result['seconds']:>8.2f} "
+              f"{format_optional(result['docs']):>8} {format_optional(result['docs_per_sec'], '.1f'):>9} "
+              f"{format_optional(result['rows']):>9} {format_optional(result['rows_per_sec'], '.1f'):>10} "
+              f"{result['peak_rss_mb']:>8.1f}")
+
+    print(f"\n{'stage':<22} {'latency':<10} {'count':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for result in results:
+        for name, latency in sorted(result['latency'].items()):
+            print(f"{result['stage']:<22} {name:<10} {latency['count']:>8} {format_latency(latency['p50']):>8} "
+                  f"{format_latency(latency['p99']):>8} {format_latency(latency['max']):>8}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the loaders and scrapers end to end against a local stand-in of the CVM and fnet sites')
+    parser.add_argument('--funds', type=int, default=100, help='number of synthetic funds')
+    parser.add_argument('--reports-per-fund', type=int, default=24, help='number of synthetic reports of each fund')
+    parser.add_argument('--corpus', action='store_true', help='serve the recorded pages of the corpus (CORPUS_DIR) instead of synthetic ones')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.01, help='random seconds added on top of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of the requests failing with a 503')
+    parser.add_argument('--scrapers', action='store_true', help='also run the get-html scrapers')
+    parser.add_argument('--pipeline', action='store_true', help='run the streaming ingest instead of the loaders one after another')
+    parser.add_argument('--pg-bin', help='folder of the PostgreSQL server binaries')
+    parser.add_argument('--use-env-db', action='store_true', help='load into the database of the DB_* variables instead of a throwaway one')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    fixtures = CorpusFixtures() if args.corpus else SyntheticFixtures(args.funds, args.reports_per_fund, args.seed)
+    work_dir = tempfile.mkdtemp(prefix='precatorios-bench-')
+    write_listing(work_dir, fixtures.listing())
+
+    server = MockServer(fixtures, args.latency, args.jitter, args.error_rate, args.seed).start()
+    database = None if args.use_env_db else ThrowawayPostgres(args.pg_bin).start()
+
+    try:
+        env = dict(os.environ)
+        env.update(server.environment())
+        env['DATA_SOURCE'] = 'http'
+        env['CORPUS_DIR'] = os.path.join(work_dir, 'html')
+        if database is not None:
+            env.update(database.environment())
+
+        # Create the schema of the loaders
+        conn = psycopg2.connect(host=env.get('DB_HOST'), port=env.get('DB_PORT'), database=env.get('DB_NAME'),
+                                user=env.get('DB_USER'), password=env.get('DB_PASSWORD'))
+        try:
+            apply_migrations(conn)
+        finally:
+            conn.close()
+
+        stages = (PIPELINE_STAGES if args.pipeline else LOADER_STAGES) + (SCRAPER_STAGES if args.scrapers else ())
+        results = []
+        for name, script, docs_counter, rows_counter in stages:
+            metrics_dir = os.path.join(work_dir, 'metrics', name)
+            env['METRICS_DIR'] = metrics_dir
+
+            print(f"Running {name}...")
+            elapsed, exit_code, peak_rss = run_stage(script, work_dir, env, os.path.join(work_dir, f'{name}.log'))
+            summary = read_stage_metrics(metrics_dir)
+            counters = summary.get('counters', {})
+
+            docs = counters.get(docs_counter, 0) if docs_counter else None
+            rows = counters.get(rows_counter, 0) if rows_counter else None
+            results.append({'stage': name,
+                            'exit_code': exit_code,
+                            'seconds': round(elapsed, 3),
+                            'docs': docs,
+                            'docs_per_sec': round(docs / elapsed, 3) if docs is not None else None,
+                            'rows': rows,
+                            'rows_per_sec': round(rows / elapsed, 3) if rows is not None else None,
+                            'peak_rss_mb': round(peak_rss, 1),
+                            'latency': summary.get('latency', {}),
+                            'counters': counters})
+
+        print_results(results)
+        print(f"\nServer requests: {server.requests}")
+        print(f"Logs and metrics of the stages in {work_dir}")
+
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as file:
+                json.dump({'arguments': vars(args), 'server_requests': server.requests, 'stages': results}, file, indent=2)
+
+        if any(result['exit_code'] != 0 for result in results):
+            raise SystemExit(1)
+    finally:
+        server.stop()
+        if database is not None:
+            database.stop()
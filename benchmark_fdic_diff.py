@@ -0,0 +1,60 @@
+import argparse
+import time
+from dbconnect import connect_db
+from bulkload import FDIC_DIFF_STRATEGIES
+
+# Build a synthetic CVM listing where a share of the CNPJs is already loaded
+def generate_cnpjs(size):
+    return [str(cnpj).zfill(14) for cnpj in range(1, size + 1)]
+
+# Measure a diff strategy. The writes go to a temporary copy of fdic, which
+# shadows the real table inside this session.
+def benchmark_diff(conn, method, cnpjs, loaded_share):
+    try:
+        cursor = conn.cursor()
+        cursor.execute("CREATE TEMP TABLE fdic (LIKE public.fdic INCLUDING DEFAULTS)")
+        loaded = cnpjs[:int(len(cnpjs) * loaded_share)]
+        FDIC_DIFF_STRATEGIES['server'](conn, loaded)
+        conn.commit()
+
+        start = time.perf_counter()
+        inserted = len(FDIC_DIFF_STRATEGIES[method](conn, cnpjs))
+        conn.commit()
+        elapsed = time.perf_counter() - start
+
+        cursor.execute("DROP TABLE pg_temp.fdic")
+        conn.commit()
+    finally:
+        cursor.close()
+
+    return inserted, elapsed
+
+# Measure the original list membership scan, without touching the database
+def benchmark_list_scan(cnpjs, loaded_share):
+    cnpj_list = [(cnpj,) for cnpj in cnpjs[:int(len(cnpjs) * loaded_share)]]
+
+    start = time.perf_counter()
+    new_cnpjs = [cnpj for cnpj in cnpjs if (cnpj,) not in cnpj_list]
+    return len(new_cnpjs), time.perf_counter() - start
+
+parser = argparse.ArgumentParser(description='Benchmark the new FDIC CNPJ diff strategies')
+parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000])
+parser.add_argument('--loaded-share', type=float, default=0.95)
+parser.add_argument('--list-scan', action='store_true', help='also time the original list membership scan')
+args = parser.parse_args()
+
+conn = connect_db()
+
+try:
+    print(f"{'size':>8} {'method':<8} {'inserted':>10} {'seconds':>10}")
+    for size in args.sizes:
+        cnpjs = generate_cnpjs(size)
+        if args.list_scan:
+            inserted, elapsed = benchmark_list_scan(cnpjs, args.loaded_share)
+            print(f"{size:>8} {'list':<8} {inserted:>10} {elapsed:>10.3f}")
+
+        for method in FDIC_DIFF_STRATEGIES:
+            inserted, elapsed = benchmark_diff(conn, method, cnpjs, args.loaded_share)
+            print(f"{size:>8} {method:<8} {inserted:>10} {elapsed:>10.3f}")
+finally:
+    conn.close()
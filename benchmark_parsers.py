@@ -0,0 +1,115 @@
+import argparse
+import glob
+import json
+import os
+import time
+from htmlparse import PARSERS, is_backend_available
+from load_fdic import extract_fdic_data
+from load_fdic_detaisl import parse_fdic_details
+from load_fdic_report import parse_fdic_report
+
+# Load the pages of a folder of the get-html corpus as (id, content) pairs
+def load_pages(folder, limit):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(folder, '*.html')))[:limit]:
+        with open(path, 'rb') as file:
+            pages.append((os.path.basename(path)[:-len('.html')], file.read()))
+
+    return pages
+
+# Extract the records of every page with the backend, keeping the failures
+# as records too, so the backends must also fail on the same pages
+def extract_records(extract, pages, backend):
+    records = []
+    for page_id, content in pages:
+        try:
+            records.append(extract(page_id, content, backend))
+        except Exception as e:
+            records.append(('error', type(e).__name__))
+
+    return records
+
+# Extractors of each kind of page, called as extract(page_id, content, backend)
+EXTRACTORS = {
+    'listing': lambda page_id, content, backend: extract_fdic_data(content, backend),
+    'details': lambda page_id, content, backend: parse_fdic_details(content, backend),
+    'report': lambda page_id, content, backend: parse_fdic_report(page_id, content, backend)
+}
+
+# Folder of the checked in pages of each kind (<kind>.html) with the
+# records expected from them (<kind>.json)
+FIXTURES_DIR = os.path.join('fixtures', 'parsers')
+
+# Load the fixture page of the kind with its id and expected records. A
+# missing fixture fails the check instead of skipping it.
+def load_fixture(kind):
+    page_path = os.path.join(FIXTURES_DIR, kind + '.html')
+    expected_path = os.path.join(FIXTURES_DIR, kind + '.json')
+    for path in (page_path, expected_path):
+        if not os.path.exists(path):
+            raise SystemExit(f"Missing parser fixture {path}")
+
+    with open(page_path, 'rb') as file:
+        content = file.read()
+
+    with open(expected_path, encoding='utf-8') as file:
+        expected = json.load(file)
+
+    return expected['id'], content, expected['records']
+
+# Records as read back from JSON, e.g. the dates as ISO strings, to compare
+# them with the expected records of the fixtures
+def as_json(records):
+    return json.loads(json.dumps(records, default=str))
+
+parser = argparse.ArgumentParser(description='Check and benchmark the HTML parser backends')
+parser.add_argument('--limit', type=int, default=500, help='maximum number of pages of each kind')
+parser.add_argument('--repeat', type=int, default=1, help='number of passes over the pages')
+args = parser.parse_args()
+
+with open(os.path.join('html', 'CVM-DadosCadastrais.htm'), 'rb') as file:
+    listing = [('CVM-DadosCadastrais', file.read())]
+
+pages_by_kind = {
+    'listing': listing,
+    'details': load_pages(os.path.join('html', 'fdic-details'), args.limit),
+    'report': load_pages(os.path.join('html', 'fdic-reports-data'), args.limit)
+}
+
+backends = [backend for backend in PARSERS if is_backend_available(backend)]
+failed = False
+
+# Every backend must extract the expected records of the fixtures
+print(f"{'kind':<8} {'backend':<11} {'fixture':>7}")
+for kind in EXTRACTORS:
+    page_id, content, expected = load_fixture(kind)
+
+    for backend in backends:
+        identical = as_json(extract_records(EXTRACTORS[kind], [(page_id, content)], backend)) == [expected]
+        failed = failed or not identical
+        print(f"{kind:<8} {backend:<11} {'ok' if identical else 'DIFF':>7}")
+
+print()
+print(f"{'kind':<8} {'backend':<11} {'pages':>6} {'pages/sec':>10} {'golden':>7}")
+for kind, pages in pages_by_kind.items():
+    if len(pages) == 0:
+        print(f"{kind:<8} no pages in the corpus, only checked against the fixture")
+        continue
+
+    # The BeautifulSoup records are the golden output of every backend
+    golden = extract_records(EXTRACTORS[kind], pages, 'bs4')
+
+    for backend in backends:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            records = extract_records(EXTRACTORS[kind], pages, backend)
+        elapsed = time.perf_counter() - start
+
+        identical = records == golden
+        failed = failed or not identical
+        print(f"{kind:<8} {backend:<11} {len(pages):>6} {len(pages) * args.repeat / elapsed:>10.1f} {'ok' if identical else 'DIFF':>7}")
+
+# Fail when a backend does not extract the expected records of the fixtures
+# or the same records as BeautifulSoup
+if failed:
+    raise SystemExit(1)
@@ -0,0 +1,84 @@
+import argparse
+import time
+from dbconnect import connect_db
+from bulkload import REPORT_DATA_WRITERS
+
+# Build synthetic report data shaped like the rows extracted from the
+# reports, as one list of rows per report
+def generate_report_data(reports, rows_per_report, first_id=1):
+    report_data = []
+    for report_id in range(first_id, first_id + reports):
+        report_data.append([{'report_id': report_id,
+                             'type': 'asset' if row % 2 == 0 else 'segment',
+                             'category': 'Categoria ' + str(row % 7),
+                             'name': 'Ativo ' + str(row),
+                             'value': round(1234567.89 * (row + 1), 2)}
+                            for row in range(rows_per_report)])
+
+    return report_data
+
+# Insert the report data with one INSERT statement per row, the original
+# writer of the loader kept as the baseline of the benchmark. It neither
+# skips the reports already loaded nor sets the reference date, so it is
+# not one of the REPORT_DATA_WRITERS.
+def insert_report_data_rows(conn, report_data):
+    try:
+        cursor = conn.cursor()
+
+        insert_sql = """
+            INSERT INTO fdic_report_data (id, type, category, name, value)
+            VALUES (%s, %s, %s, %s, %s)
+        """
+
+        for data in report_data:
+            cursor.execute(
+                insert_sql, (data['report_id'], data['type'], data['category'], data['name'], data['value'],))
+
+        return len(report_data)
+
+    finally:
+        cursor.close()
+
+# Writers of the benchmark, the writers of the loaders and the baseline
+BENCHMARK_WRITERS = dict(REPORT_DATA_WRITERS, rows=insert_report_data_rows)
+
+# Measure the rows/sec of a writer. Like the loaders, the writer is called
+# and committed once per report. The writes go to a temporary copy of
+# fdic_report_data, which shadows the real table inside this session.
+def benchmark_writer(conn, method, report_data):
+    try:
+        cursor = conn.cursor()
+        cursor.execute("CREATE TEMP TABLE fdic_report_data (LIKE public.fdic_report_data INCLUDING DEFAULTS)")
+        conn.commit()
+
+        start = time.perf_counter()
+        for report_rows in report_data:
+            BENCHMARK_WRITERS[method](conn, report_rows)
+            conn.commit()
+        elapsed = time.perf_counter() - start
+
+        cursor.execute("DROP TABLE pg_temp.fdic_report_data")
+        conn.commit()
+    finally:
+        cursor.close()
+
+    return elapsed
+
+parser = argparse.ArgumentParser(description='Benchmark the fdic_report_data writers')
+parser.add_argument('--reports', type=int, default=1000)
+parser.add_argument('--rows-per-report', type=int, default=20)
+parser.add_argument('--methods', nargs='+', default=list(BENCHMARK_WRITERS.keys()),
+                    choices=list(BENCHMARK_WRITERS.keys()))
+args = parser.parse_args()
+
+report_data = generate_report_data(args.reports, args.rows_per_report)
+rows = args.reports * args.rows_per_report
+conn = connect_db()
+
+try:
+    print(f"{'method':<8} {'rows':>10} {'seconds':>10} {'rows/sec':>12}")
+    for method in args.methods:
+        elapsed = benchmark_writer(conn, method, report_data)
+        print(f"{method:<8} {rows:>10} {elapsed:>10.3f} {rows / elapsed:>12.0f}")
+finally:
+    conn.close()
@@ -0,0 +1,157 @@
+import mmap
+import os
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Size after which a new segment file is started
+SEGMENT_SIZE = 1 << 30
+
+# Codec byte prefixed to each compressed document
+CODEC_ZSTD = b'z'
+CODEC_DEFLATE = b'd'
+
+def compress(data, codec):
+    if codec == CODEC_ZSTD:
+        return CODEC_ZSTD + zstandard.ZstdCompressor(level=3).compress(data)
+
+    return CODEC_DEFLATE + zlib.compress(data, 6)
+
+def decompress(record):
+    codec, data = record[:1], record[1:]
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('The zstandard package is required to read zstd documents')
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    return zlib.decompress(data)
+
+# Store of documents packed into large append-only segment files. Each
+# document is compressed on its own with zstd (or deflate when zstandard is
+# not installed) and appended to the current segment. The index maps each
+# key to (segment, offset, length); it is kept in memory for O(1) existence
+# checks and persisted to an append-only index file. Documents are read
+# through memory maps of the segments. Only one process may write a store;
+# a readonly store opens no file for writing and never repairs the index, so
+# it can read a store while its writer appends to it.
+class BlobStore:
+    def __init__(self, path, segment_size=SEGMENT_SIZE, readonly=False):
+        self.path = path
+        self.segment_size = segment_size
+        self.readonly = readonly
+        self.codec = CODEC_ZSTD if zstandard is not None else CODEC_DEFLATE
+        self.index = {}
+        self._maps = {}
+        self._lock = threading.Lock()
+        self._segment_file = None
+        self._index_file = None
+
+        if not readonly:
+            os.makedirs(path, exist_ok=True)
+        self._load_index()
+
+        # Append to the last segment, it is rotated when full
+        self._segment = max((entry[0] for entry in self.index.values()), default=0)
+        if not readonly:
+            self._segment_file = open(self._segment_path(self._segment), 'ab')
+            self._index_file = open(os.path.join(path, 'index'), 'a', encoding='utf-8')
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f'segment-{segment:05d}')
+
+    # Load the index file, ignoring a last entry torn by a crash or still
+    # being written. The writer truncates it, so its next entry starts on a
+    # line of its own.
+    def _load_index(self):
+        index_path = os.path.join(self.path, 'index')
+        if not os.path.exists(index_path):
+            return
+
+        with open(index_path, 'rb' if self.readonly else 'rb+') as file:
+            content = file.read()
+            complete = content.rfind(b'\n') + 1
+            if complete < len(content) and not self.readonly:
+                file.truncate(complete)
+
+        for line in content[:complete].decode('utf-8').splitlines():
+            fields = line.split('\t')
+            if len(fields) == 4:
+                self.index[fields[0]] = (int(fields[1]), int(fields[2]), int(fields[3]))
+
+    def __contains__(self, key):
+        return str(key) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return list(self.index.keys())
+
+    # Append the document of the key. A later document of the same key
+    # replaces the previous one.
+    def put(self, key, data):
+        if self.readonly:
+            raise RuntimeError(f'The blob store {self.path} is open read-only')
+
+        record = compress(bytes(data), self.codec)
+
+        with self._lock:
+            # Start a new segment when the current one is full
+            offset = self._segment_file.tell()
+            if offset > 0 and offset + len(record) > self.segment_size:
+                self._segment_file.close()
+                self._segment += 1
+                self._segment_file = open(self._segment_path(self._segment), 'ab')
+                offset = 0
+
+            # The document is written before its index entry, so the index
+            # never points to missing data
+            self._segment_file.write(record)
+            self._segment_file.flush()
+            self._index_file.write(f'{key}\t{self._segment}\t{offset}\t{len(record)}\n')
+            self._index_file.flush()
+
+            self.index[str(key)] = (self._segment, offset, len(record))
+
+    # Get the memory map of the segment covering at least size bytes. Must
+    # be called with the lock held, as the map it replaces is closed.
+    def _map(self, segment, size):
+        segment_map = self._maps.get(segment)
+        if segment_map is None or len(segment_map) < size:
+            # The segment grew since it was mapped, map it again
+            if segment_map is not None:
+                segment_map.close()
+            with open(self._segment_path(segment), 'rb') as file:
+                segment_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = segment_map
+
+        return segment_map
+
+    # Read the document of the key, raising KeyError when it is not stored
+    def get(self, key):
+        segment, offset, length = self.index[str(key)]
+
+        # Copy the record under the lock, so its map is not closed meanwhile
+        with self._lock:
+            record = self._map(segment, offset + length)[offset:offset + length]
+
+        return decompress(record)
+
+    def close(self):
+        with self._lock:
+            for segment_map in self._maps.values():
+                segment_map.close()
+            self._maps.clear()
+            if self._segment_file is not None:
+                self._segment_file.close()
+                self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
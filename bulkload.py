@@ -0,0 +1,240 @@
+import io
+import os
+from psycopg2.extras import execute_values
+
+# Columns of the fdic_report_data table written by the loaders
+REPORT_DATA_COLUMNS = ('id', 'type', 'category', 'name', 'value')
+
+# Escape a value to the PostgreSQL COPY text format
+def copy_text_value(value):
+    if value is None:
+        return '\\N'
+
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+# Read-only file object that renders the rows in the COPY text format on
+# demand, so the rows are streamed to the server without being buffered
+class CopyRowStream(io.TextIOBase):
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        # Render rows until the requested size is available or the rows end
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += '\t'.join(copy_text_value(value) for value in row) + '\n'
+
+        if size < 0:
+            size = len(self._buffer)
+
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+# Stream the rows into the table with COPY FROM STDIN
+def copy_rows(cursor, table, columns, rows):
+    copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT text)"
+    cursor.copy_expert(copy_sql, CopyRowStream(rows), size=65536)
+
+# Convert the extracted report data into tuples in the table column order
+def report_data_tuples(report_data):
+    for data in report_data:
+        yield (data['report_id'], data['type'], data['category'], data['name'], data['value'])
+
+# Create the session staging table used to merge the report data. The rows
+# are discarded at the end of each transaction.
+def create_report_data_stage(cursor):
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS fdic_report_data_stage (
+            id bigint,
+            type varchar,
+            category varchar,
+            name varchar,
+            value numeric
+        ) ON COMMIT DELETE ROWS
+    """)
+
+# Insert the report data with COPY through the staging table. Reports that
+# already have data in fdic_report_data are skipped, so re-runs are idempotent.
+def copy_report_data(conn, report_data):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        create_report_data_stage(cursor)
+        copy_rows(cursor, 'fdic_report_data_stage', REPORT_DATA_COLUMNS, report_data_tuples(report_data))
+
+        # Merge the staged rows of the reports not loaded yet, routed to
+        # the partition of the report reference month. The loaded reports
+        # are only looked up in the partition of their month, or in the
+        # default partition for the reports without a reference date.
+        cursor.execute("""
+            INSERT INTO fdic_report_data (id, type, category, name, value, ref_date)
+            SELECT s.id, s.type, s.category, s.name, s.value, r.ref_date
+              FROM fdic_report_data_stage s
+                LEFT OUTER JOIN fdic_report r
+                  ON (r.id = s.id)
+             WHERE NOT EXISTS (SELECT 1 FROM fdic_report_data rd
+                                WHERE rd.id = s.id
+                                  AND rd.ref_date = r.ref_date)
+               AND (r.ref_date IS NOT NULL
+                    OR NOT EXISTS (SELECT 1 FROM fdic_report_data rd
+                                    WHERE rd.id = s.id
+                                      AND rd.ref_date IS NULL))
+        """)
+        # The staged rows are discarded by the commit of the caller. Rows left
+        # by an earlier call in the same transaction are skipped as loaded.
+        return cursor.rowcount
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+# Insert rows of report data given as a VALUES list, with the reference
+# month of the report as the partition key of fdic_report_data
+REPORT_DATA_INSERT_SQL = """
+    INSERT INTO fdic_report_data (id, type, category, name, value, ref_date)
+    SELECT v.id, v.type, v.category, v.name, v.value,
+           (SELECT r.ref_date FROM fdic_report r WHERE r.id = v.id)
+      FROM (%s) AS v (id, type, category, name, value)
+"""
+REPORT_DATA_VALUES_TEMPLATE = '(%s::bigint, %s, %s, %s, %s::numeric)'
+
+# Ids of the given reports that already have report data, looked up in the
+# partition of the month of each report, or in the default partition for
+# the reports without a reference date
+LOADED_REPORT_IDS_SQL = """
+    SELECT rd.id
+      FROM fdic_report r
+        JOIN fdic_report_data rd
+          ON (rd.id = r.id AND rd.ref_date = r.ref_date)
+     WHERE r.id = ANY(%(report_ids)s)
+    UNION
+    SELECT rd.id
+      FROM fdic_report_data rd
+     WHERE rd.ref_date IS NULL
+       AND rd.id = ANY(%(report_ids)s)
+"""
+
+# Insert the report data with batched multi-row INSERT statements. Used
+# where COPY is not available, e.g. through a connection pooler.
+def execute_values_report_data(conn, report_data, page_size=1000):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        insert_sql = REPORT_DATA_INSERT_SQL % 'VALUES %s'
+
+        # Skip the reports already loaded. They are checked once before the
+        # insert, as a report can be split across several pages of rows.
+        rows = list(report_data_tuples(report_data))
+        report_ids = list({row[0] for row in rows})
+        cursor.execute(LOADED_REPORT_IDS_SQL, {'report_ids': report_ids})
+        loaded_ids = {row[0] for row in cursor.fetchall()}
+        rows = [row for row in rows if row[0] not in loaded_ids]
+
+        execute_values(cursor, insert_sql, rows, template=REPORT_DATA_VALUES_TEMPLATE, page_size=page_size)
+
+        return len(rows)
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+# Writers of the report data, selected by the REPORT_DATA_WRITER variable
+REPORT_DATA_WRITERS = {
+    'copy': copy_report_data,
+    'values': execute_values_report_data
+}
+
+# Write the report data with the configured writer, without committing
+def write_report_data(conn, report_data, method=None):
+    if method is None:
+        method = os.getenv("REPORT_DATA_WRITER", "copy")
+
+    return REPORT_DATA_WRITERS[method](conn, report_data)
+
+# Keep the new CNPJs in memory, checking them against a hash set of the
+# CNPJs already in the database. Duplicates of the listing are dropped.
+def filter_new_fdic_cnpjs(cnpjs, existing_cnpjs):
+    seen = set(existing_cnpjs)
+    new_cnpjs = []
+    for cnpj in cnpjs:
+        if cnpj not in seen:
+            seen.add(cnpj)
+            new_cnpjs.append(cnpj)
+
+    return new_cnpjs
+
+# Insert the CNPJs not in the fdic table, diffing them in memory.
+# Returns the inserted CNPJs.
+def insert_new_fdic_cnpjs_memory(conn, cnpjs):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT cnpj FROM fdic")
+        new_cnpjs = filter_new_fdic_cnpjs(cnpjs, (row[0] for row in cursor))
+
+        execute_values(cursor, "INSERT INTO fdic (cnpj) VALUES %s", [(cnpj,) for cnpj in new_cnpjs], page_size=1000)
+
+        return new_cnpjs
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+# Insert the CNPJs not in the fdic table, diffing them in the server with
+# an anti-join against the CNPJs copied to a staging table.
+# Returns the inserted CNPJs.
+def insert_new_fdic_cnpjs_server(conn, cnpjs):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS fdic_cnpj_stage (cnpj varchar) ON COMMIT DROP")
+        copy_rows(cursor, 'fdic_cnpj_stage', ('cnpj',), ((cnpj,) for cnpj in cnpjs))
+
+        cursor.execute("""
+            INSERT INTO fdic (cnpj)
+            SELECT DISTINCT s.cnpj
+              FROM fdic_cnpj_stage s
+             WHERE NOT EXISTS (SELECT 1 FROM fdic f WHERE f.cnpj = s.cnpj)
+            RETURNING cnpj
+        """)
+        inserted = [row[0] for row in cursor.fetchall()]
+
+        # Empty the staging table for the next load in the same transaction
+        cursor.execute("TRUNCATE fdic_cnpj_stage")
+
+        return inserted
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+# Strategies to diff the new CNPJs, selected by the FDIC_DIFF variable
+FDIC_DIFF_STRATEGIES = {
+    'server': insert_new_fdic_cnpjs_server,
+    'memory': insert_new_fdic_cnpjs_memory
+}
+
+# Insert the new CNPJs with the configured strategy, without committing.
+# Returns the inserted CNPJs.
+def insert_new_fdic_cnpjs(conn, cnpjs, method=None):
+    if method is None:
+        method = os.getenv("FDIC_DIFF", "server")
+
+    return FDIC_DIFF_STRATEGIES[method](conn, cnpjs)
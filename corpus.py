@@ -0,0 +1,193 @@
+from dotenv import load_dotenv
+from datetime import datetime
+import json
+import os
+import threading
+from blobstore import BlobStore
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Folder of the documents saved by the get-html scrapers
+CORPUS_DIR = os.getenv("CORPUS_DIR", "html")
+
+# Sources of the loaders: the live sites or the documents saved by get-html
+SOURCES = ('http', 'corpus')
+
+# Kinds of documents of the corpus and the extension of their files
+DOCUMENT_KINDS = {
+    'fdic-details': '.html',
+    'fdic-reports': '.json',
+    'fdic-reports-data': '.html'
+}
+
+# Get the source of the loaders set by DATA_SOURCE
+def get_source():
+    source = os.getenv("DATA_SOURCE", "http")
+    if source not in SOURCES:
+        raise ValueError('Unknown DATA_SOURCE: ' + source)
+
+    return source
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+
+# Corpus with one file per document: html/<kind>/<id>.<ext>
+class FileCorpus:
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, kind, id):
+        return os.path.join(self.folder, kind, f'{id}{DOCUMENT_KINDS[kind]}')
+
+    def exists(self, kind, id):
+        return os.path.exists(self.path(kind, id))
+
+    def read(self, kind, id):
+        return read_file(self.path(kind, id))
+
+    def write(self, kind, id, content):
+        write_file(self.path(kind, id), content)
+
+    def list_ids(self, kind):
+        folder = os.path.join(self.folder, kind)
+        if not os.path.isdir(folder):
+            return []
+
+        extension = DOCUMENT_KINDS[kind]
+        return [entry.name[:-len(extension)] for entry in os.scandir(folder) if entry.name.endswith(extension)]
+
+    def close(self):
+        pass
+
+# Corpus packed into one blob store per kind: html/<kind>.store. The stores
+# are opened read-only, so the loaders reading the corpus never change it,
+# and a store is only opened for writing on its first write.
+class StoreCorpus:
+    def __init__(self, folder):
+        self.folder = folder
+        self._stores = {}
+        self._retired = []
+        self._lock = threading.Lock()
+
+    def store(self, kind, write=False):
+        with self._lock:
+            store = self._stores.get(kind)
+            if store is None or (write and store.readonly):
+                # The read-only store may still be read by other threads,
+                # it is closed with the corpus
+                if store is not None:
+                    self._retired.append(store)
+                store = self._stores[kind] = BlobStore(os.path.join(self.folder, f'{kind}.store'), readonly=not write)
+
+            return store
+
+    def exists(self, kind, id):
+        return id in self.store(kind)
+
+    def read(self, kind, id):
+        try:
+            return self.store(kind).get(id)
+        except KeyError:
+            raise FileNotFoundError(f'{kind} document not found: {id}')
+
+    def write(self, kind, id, content):
+        self.store(kind, write=True).put(id, content)
+
+    def list_ids(self, kind):
+        return self.store(kind).keys()
+
+    def close(self):
+        with self._lock:
+            for store in list(self._stores.values()) + self._retired:
+                store.close()
+            self._stores.clear()
+            self._retired.clear()
+
+# Layouts of the corpus, selected by the CORPUS_FORMAT variable
+CORPUS_FORMATS = {
+    'files': FileCorpus,
+    'store': StoreCorpus
+}
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+# Get the corpus of the layout set by CORPUS_FORMAT, one file per document by default
+def get_corpus():
+    global _corpus
+
+    with _corpus_lock:
+        if _corpus is None:
+            _corpus = CORPUS_FORMATS[os.getenv("CORPUS_FORMAT", "files")](CORPUS_DIR)
+
+        return _corpus
+
+# Check if the FDIC details page of the CNPJ is saved
+def has_fdic_details(cnpj):
+    return get_corpus().exists('fdic-details', cnpj)
+
+# Check if the metadata of the report is saved
+def has_fdic_report(report_id):
+    return get_corpus().exists('fdic-reports', report_id)
+
+# Check if the decoded document of the report is saved
+def has_fdic_report_data(report_id):
+    return get_corpus().exists('fdic-reports-data', report_id)
+
+# Save the FDIC details page of the CNPJ
+def save_fdic_details(cnpj, html_content):
+    get_corpus().write('fdic-details', cnpj, html_content)
+
+# Save the metadata of the report as JSON
+def save_fdic_report(report):
+    get_corpus().write('fdic-reports', report['report_id'], json.dumps(report, default=str).encode('utf-8'))
+
+# Save the decoded document of the report
+def save_fdic_report_data(report_id, html_content):
+    get_corpus().write('fdic-reports-data', report_id, html_content)
+
+# Read the saved FDIC details page of the CNPJ
+def read_fdic_details(cnpj):
+    return get_corpus().read('fdic-details', cnpj)
+
+# Read the saved document of the report
+def read_fdic_report_data(report_id):
+    return get_corpus().read('fdic-reports-data', report_id)
+
+# Read the saved metadata of the report, restoring its dates
+def read_fdic_report(report_id):
+    report = json.loads(get_corpus().read('fdic-reports', report_id))
+    report['reference_date'] = datetime.fromisoformat(report['reference_date'])
+    report['delivery_date'] = datetime.fromisoformat(report['delivery_date'])
+
+    return report
+
+# List the ids of the reports with saved metadata
+def list_fdic_report_ids():
+    return get_corpus().list_ids('fdic-reports')
+
+# Group the saved report metadata by the CNPJ of the FDIC
+def read_fdic_reports_by_cnpj():
+    reports_by_cnpj = {}
+    for report_id in list_fdic_report_ids():
+        report = read_fdic_report(report_id)
+        reports_by_cnpj.setdefault(report['fdic_cnpj'], []).append(report)
+
+    return reports_by_cnpj
+
+# Read read(item) for every item from the corpus. Yields the same
+# (item, result, error) tuples as fetchengine.stream_fetch, so the loaders
+# process the saved documents like the fetched ones.
+def stream_corpus(items, read):
+    for item in items:
+        try:
+            yield item, read(item), None
+        except Exception as e:
+            yield item, None, e
@@ -1,54 +1,131 @@
 from dotenv import load_dotenv
+from contextlib import contextmanager
+import itertools
 import os
+import threading
 import psycopg2
+import psycopg2.pool
 
 # Load environment variables from .env file
 load_dotenv()
 
-def connect_db():
-    # Access environment variables
-    db_host = os.getenv("DB_HOST")
-    db_port = os.getenv("DB_PORT")
-    db_name = os.getenv("DB_NAME")
-    db_user = os.getenv("DB_USER")
-    db_password = os.getenv("DB_PASSWORD")
+# Read the database connection parameters from the environment
+def get_db_params():
+    return {
+        'host': os.getenv("DB_HOST"),
+        'port': os.getenv("DB_PORT"),
+        'database': os.getenv("DB_NAME"),
+        'user': os.getenv("DB_USER"),
+        'password': os.getenv("DB_PASSWORD")
+    }
 
+def connect_db():
     # Connect to the PostgreSQL database
-    return psycopg2.connect(host=db_host, port=db_port,
-                            database=db_name, user=db_user, password=db_password)
+    return psycopg2.connect(**get_db_params())
+
+# Check if a pooled connection is still usable before handing it to a worker
+def is_connection_alive(conn):
+    if conn.closed:
+        return False
 
-# Get all FDIC CNPJs from the database
-def get_all_fdic_cnpj_from_db(conn):
     try:
-        # Create a cursor object to execute SQL queries
         cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        finally:
+            cursor.close()
 
-        # Select all CNPJs from the fdic table
-        cursor.execute("SELECT cnpj FROM fdic")
+        # Leave the connection idle, outside of any transaction
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
 
-        # Fetch all rows from the result
-        cnpjs = cursor.fetchall()
+# Thread-safe pool of PostgreSQL connections shared by the loader workers.
+# Each worker checks out its own connection, so every fund or report is
+# written in its own transaction and the workers do not serialize on a
+# single connection.
+class ConnectionPool:
+    def __init__(self, size=20, min_size=1, health_check=True):
+        self.size = size
+        self.health_check = health_check
+        self._pool = psycopg2.pool.ThreadedConnectionPool(min(min_size, size), size, **get_db_params())
 
-    finally:
-        # Close the cursor
-        cursor.close()
+        # ThreadedConnectionPool raises an error when it is exhausted, so the
+        # semaphore makes the workers wait for a free connection instead
+        self._semaphore = threading.BoundedSemaphore(size)
 
-    return cnpjs
+    # Get a healthy connection from the pool. After a server restart all the
+    # idle connections are broken, so they are discarded one after another
+    # until one passes the check or a new one is opened, at most size + 1
+    # times.
+    def _getconn(self):
+        for _ in range(self.size + 1):
+            conn = self._pool.getconn()
+            if not self.health_check or is_connection_alive(conn):
+                return conn
 
-# Get all FDIC CNPJs from the database
-def get_fdic_cnpj_not_filled_from_db(conn):
-    try:
-        # Create a cursor object to execute SQL queries
-        cursor = conn.cursor()
+            self._pool.putconn(conn, close=True)
 
-        # Select all CNPJs from the fdic table
-        cursor.execute("SELECT cnpj FROM fdic WHERE name IS NULL")
+        raise psycopg2.OperationalError(f"No healthy database connection after {self.size + 1} attempts")
 
-        # Fetch all rows from the result
-        cnpjs = cursor.fetchall()
+    # Check out a connection for the duration of a unit of work. The
+    # transaction is rolled back if the unit of work fails.
+    @contextmanager
+    def connection(self):
+        self._semaphore.acquire()
+        try:
+            conn = self._getconn()
+            try:
+                yield conn
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                # Discard the connection if it was broken during the work
+                self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._semaphore.release()
+
+    # Close all the connections of the pool
+    def close(self):
+        if not self._pool.closed:
+            self._pool.closeall()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# Unique names of the server-side cursors of a process
+_cursor_names = itertools.count()
+
+# Stream the rows of a query with a named server-side cursor, fetching
+# fetch_size rows per round trip (see DB_FETCH_SIZE). The rows are yielded
+# as they arrive, so the first ones can be worked on before the query is
+# fully read. The connection must stay checked out until the generator is
+# exhausted or closed.
+def stream_query(conn, query, params=None, fetch_size=None):
+    if fetch_size is None:
+        fetch_size = int(os.getenv("DB_FETCH_SIZE", "2000"))
+
+    # Create a server-side cursor object to execute SQL queries
+    cursor = conn.cursor(name=f"stream_{next(_cursor_names)}")
+    cursor.itersize = fetch_size
+
+    try:
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row
 
     finally:
         # Close the cursor
         cursor.close()
 
-    return cnpjs
\ No newline at end of file
+# Get all FDIC CNPJs from the database, streamed from the server
+def get_all_fdic_cnpj_from_db(conn, fetch_size=None):
+    # Select all CNPJs from the fdic table
+    return stream_query(conn, "SELECT cnpj FROM fdic", fetch_size=fetch_size)
@@ -0,0 +1,76 @@
+import threading
+from psycopg2.extras import execute_values
+
+# Process-wide cache of the keys of a dimension table. The keys are loaded
+# once at startup, so looking up a known administrator or director needs no
+# round trip, and the missing ones are inserted in a single statement that
+# ignores the rows inserted meanwhile by another worker.
+class DimensionCache:
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+        self.key = columns[0]
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    # Load the keys already in the table
+    def preload(self, conn):
+        try:
+            # Create a cursor object to execute SQL queries
+            cursor = conn.cursor()
+
+            cursor.execute(f"SELECT {self.key} FROM {self.table}")
+            keys = {row[0] for row in cursor.fetchall()}
+
+        finally:
+            # Close the cursor
+            cursor.close()
+
+        with self._lock:
+            self._keys |= keys
+
+        return len(keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    # Insert the rows whose key is not cached yet, the first row of a key
+    # wins. The rows are inserted in key order, so two workers inserting the
+    # same keys lock them in the same order and cannot deadlock. Returns the
+    # keys inserted, to be cached with add() once the transaction is committed.
+    def upsert(self, conn, rows):
+        missing = {}
+        for row in rows:
+            if row[0] is not None and row[0] not in self._keys:
+                missing.setdefault(row[0], row)
+
+        if not missing:
+            return []
+
+        try:
+            # Create a cursor object to execute SQL queries
+            cursor = conn.cursor()
+
+            execute_values(cursor, f"""
+                INSERT INTO {self.table} ({', '.join(self.columns)})
+                VALUES %s
+                ON CONFLICT ({self.key}) DO NOTHING
+            """, [missing[key] for key in sorted(missing)])
+
+        finally:
+            # Close the cursor
+            cursor.close()
+
+        return sorted(missing)
+
+    # Cache keys known to be in the table
+    def add(self, keys):
+        with self._lock:
+            self._keys.update(keys)
+
+FDIC_ADMINS = DimensionCache('fdic_admin', ('cnpj', 'name'))
+FDIC_DIRECTORS = DimensionCache('fdic_director', ('cpf', 'name', 'phone', 'email', 'address'))
+
+# Load the administrators and directors already in the database
+def preload_fdic_dimensions(conn):
+    return FDIC_ADMINS.preload(conn) + FDIC_DIRECTORS.preload(conn)
@@ -0,0 +1,269 @@
+from dotenv import load_dotenv
+import argparse
+import datetime
+import json
+import os
+import time
+import pyarrow as pa
+import pyarrow.dataset
+import pyarrow.parquet as pq
+from dbconnect import connect_db, stream_query
+from worklog import FDIC_REPORT_DATA_STAGE
+from metrics import METRICS, add_profile_argument, instrumented_run
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Columns of the exported report data. The repeated strings are dictionary
+# encoded, so each distinct fund, category or name is stored once per
+# column chunk and read back as Arrow dictionary arrays. The values were
+# parsed as floats, so they are exported as doubles.
+REPORT_DATA_SCHEMA = pa.schema([
+    ('report_id', pa.int64()),
+    ('cnpj', pa.dictionary(pa.int32(), pa.string())),
+    ('ref_date', pa.date32()),
+    ('type', pa.dictionary(pa.int32(), pa.string())),
+    ('category', pa.dictionary(pa.int32(), pa.string())),
+    ('name', pa.dictionary(pa.int32(), pa.string())),
+    ('value', pa.float64())
+])
+
+# Report data of a month joined to the fund of the report. The month is
+# the reference date of the report, like in the month lists below. The
+# report data is written to the partition of that month, or to the default
+# partition when the reference date was not known yet, so the range on
+# rd.ref_date only scans those two partitions. The rows are sorted by fund
+# so the row groups compress and filter well.
+MONTH_REPORT_DATA_SQL = """
+SELECT rd.id, r.cnpj, r.ref_date, rd.type, rd.category, rd.name, rd.value::float8
+  FROM fdic_report_data rd
+    JOIN fdic_report r
+      ON (r.id = rd.id)
+ WHERE r.ref_date >= %(start)s
+   AND r.ref_date < %(end)s
+   AND ((rd.ref_date >= %(start)s AND rd.ref_date < %(end)s) OR rd.ref_date IS NULL)
+ ORDER BY r.cnpj, rd.id"""
+
+# Report data of the reports without a reference date, exported as the
+# unknown month. Their rows are all in the default partition.
+UNKNOWN_MONTH_REPORT_DATA_SQL = """
+SELECT rd.id, r.cnpj, r.ref_date, rd.type, rd.category, rd.name, rd.value::float8
+  FROM fdic_report_data rd
+    JOIN fdic_report r
+      ON (r.id = rd.id)
+ WHERE r.ref_date IS NULL
+   AND rd.ref_date IS NULL
+ ORDER BY r.cnpj, rd.id"""
+
+# Months of the reports, NULL (the unknown month) for the reports without a
+# reference date
+REPORT_MONTHS_SQL = """
+SELECT DISTINCT date_trunc('month', ref_date)::date
+  FROM fdic_report
+ ORDER BY 1 NULLS LAST"""
+
+# Months of the reports whose data was loaded since the given time
+CHANGED_MONTHS_SQL = """
+SELECT DISTINCT date_trunc('month', r.ref_date)::date
+  FROM work_ledger w
+    JOIN fdic_report r
+      ON (r.id = w.item::bigint)
+ WHERE w.stage = %s
+   AND w.status = 'done'
+   AND w.updated_at >= %s"""
+
+# Partition of the report data without a reference date
+UNKNOWN_MONTH = 'unknown'
+
+# Name of the export manifest, skipped by the Parquet readers like the
+# other files starting with an underscore
+MANIFEST_NAME = '_manifest.json'
+
+# Key of the month, the unknown month is None
+def month_key(month):
+    return month.strftime('%Y-%m') if month is not None else UNKNOWN_MONTH
+
+def next_month(month):
+    return (month.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+# Folder of the month, in the key=value layout read by pyarrow, DuckDB,
+# Spark and polars as the ref_month partition column
+def month_folder(folder, month):
+    return os.path.join(folder, f"ref_month={month_key(month)}")
+
+# Read the manifest of the exported months, empty on the first export
+def read_manifest(folder):
+    path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'exported_until': None, 'months': {}}
+
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+# Replace the manifest at once, so an interrupted export keeps the last one
+def write_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST_NAME)
+    with open(path + '.tmp', mode='w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+# Build a record batch of the rows, dictionary encoding the string columns
+def report_data_batch(rows):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(REPORT_DATA_SCHEMA, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, field.type))
+
+    return pa.RecordBatch.from_arrays(arrays, schema=REPORT_DATA_SCHEMA)
+
+# Write the report data of the month to <folder>/ref_month=<yyyy-mm>/data.parquet,
+# or to ref_month=unknown for the unknown month, streaming the rows from the
+# server in row groups of row_group_size rows. The file is written under a
+# hidden name and renamed once complete, so the readers never see a partial
+# month. Returns the number of rows written.
+def export_month(conn, folder, month, row_group_size=100000, compression='zstd'):
+    target = month_folder(folder, month)
+    os.makedirs(target, exist_ok=True)
+    path = os.path.join(target, 'data.parquet')
+    temp_path = os.path.join(target, '.data.parquet.tmp')
+
+    if month is None:
+        query, params = UNKNOWN_MONTH_REPORT_DATA_SQL, None
+    else:
+        query, params = MONTH_REPORT_DATA_SQL, {'start': month, 'end': next_month(month)}
+
+    rows_written = 0
+    writer = pq.ParquetWriter(temp_path, REPORT_DATA_SCHEMA, compression=compression, use_dictionary=True)
+    try:
+        rows = []
+        for row in stream_query(conn, query, params):
+            rows.append(row)
+            if len(rows) >= row_group_size:
+                writer.write_batch(report_data_batch(rows), row_group_size=row_group_size)
+                rows_written += len(rows)
+                rows = []
+
+        if rows:
+            writer.write_batch(report_data_batch(rows), row_group_size=row_group_size)
+            rows_written += len(rows)
+    finally:
+        writer.close()
+
+    if rows_written == 0:
+        # No data left for the month, drop the file of a previous export too
+        os.remove(temp_path)
+        if os.path.exists(path):
+            os.remove(path)
+        if not os.listdir(target):
+            os.rmdir(target)
+        return 0
+
+    os.replace(temp_path, path)
+    return rows_written
+
+# Get the months to export: the months not exported yet and the ones whose
+# report data was loaded since the previous export, or every month when full
+def get_months_to_export(conn, manifest, full=False):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute(REPORT_MONTHS_SQL)
+        months = [row[0] for row in cursor.fetchall()]
+        if full or manifest['exported_until'] is None:
+            return months
+
+        cursor.execute(CHANGED_MONTHS_SQL, (FDIC_REPORT_DATA_STAGE, manifest['exported_until']))
+        changed = {row[0] for row in cursor.fetchall()}
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+    return [month for month in months if month_key(month) not in manifest['months'] or month in changed]
+
+# Get the time of the database server, the start of the next incremental export
+def get_server_time(conn):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT now()::timestamp")
+        server_time = cursor.fetchone()[0]
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+    return server_time
+
+# Export the report data, month by month, to the folder. Only the new and
+# changed months are written unless full is set. Returns the exported
+# months with their number of rows.
+def export_report_data(conn, folder, full=False, row_group_size=100000, compression='zstd'):
+    os.makedirs(folder, exist_ok=True)
+    manifest = read_manifest(folder)
+
+    # Taken before reading, so the data loaded during the export is
+    # exported again by the next one
+    started_at = get_server_time(conn)
+    months = get_months_to_export(conn, manifest, full)
+    conn.rollback()
+
+    exported = {}
+    for month in months:
+        with METRICS.timer('export_month'):
+            rows = export_month(conn, folder, month, row_group_size, compression)
+
+        # End the read transaction of the month
+        conn.rollback()
+        if rows == 0:
+            if manifest['months'].pop(month_key(month), None) is not None:
+                write_manifest(folder, manifest)
+            continue
+
+        exported[month_key(month)] = rows
+        manifest['months'][month_key(month)] = {'rows': rows, 'exported_at': started_at.isoformat()}
+        write_manifest(folder, manifest)
+
+        METRICS.count('export_months')
+        METRICS.count('export_rows', rows)
+        print(f"Exported {rows} rows of {month_key(month)}")
+
+    manifest['exported_until'] = started_at.isoformat()
+    write_manifest(folder, manifest)
+
+    return exported
+
+# Open the exported report data as a pyarrow dataset, with ref_month as a
+# partition column, e.g. to filter and aggregate it with pyarrow.compute,
+# DuckDB or polars
+def open_report_data(folder):
+    return pyarrow.dataset.dataset(folder, format='parquet', partitioning='hive')
+
+if __name__ == '__main__':
+    # Command line options, see --help
+    parser = argparse.ArgumentParser(description='Export the FDIC report data to Parquet files partitioned by reference month')
+    parser.add_argument('--output', default=os.getenv("EXPORT_DIR", "export/fdic_report_data"), help='folder of the export')
+    parser.add_argument('--full', action='store_true', help='export every month again')
+    parser.add_argument('--row-group-size', type=int, default=100000, help='rows of each Parquet row group')
+    parser.add_argument('--compression', default='zstd', help='Parquet compression codec')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    # Record the metrics of the run, see METRICS_DIR and METRICS_PORT
+    with instrumented_run('export_parquet', args.profile):
+        start = time.perf_counter()
+        conn = connect_db()
+
+        try:
+            exported = export_report_data(conn, args.output, args.full, args.row_group_size, args.compression)
+        finally:
+            # Close the database connection
+            conn.close()
+
+        print(f"Exported {sum(exported.values())} rows of {len(exported)} months to {args.output} "
+              f"in {time.perf_counter() - start:.3f}s")
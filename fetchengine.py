@@ -0,0 +1,361 @@
+from dotenv import load_dotenv
+from urllib.parse import urlsplit
+from datetime import datetime
+from functools import lru_cache
+import asyncio
+import json
+import os
+import queue
+import re
+import threading
+import time
+import aiohttp
+from base64stream import Base64StreamDecoder
+from ratecontrol import AdaptiveLimiter, RetryBudget, backoff_delay, parse_retry_after
+from metrics import METRICS
+from httpclient import RETRY_STATUS_CODES, fdic_details_url, fdic_reports_url, fdic_report_document_url
+
+# Decode the JSON pages with orjson when it is installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Asynchronous HTTP client with a bounded number of in-flight requests in
+# total and per host. One event loop thread keeps hundreds of requests in
+# flight, instead of one thread per request. The limit of each host starts
+# at per_host and adapts between 1 and max_per_host to the latency and the
+# errors of the host. An engine can be shared by several stream_fetch calls,
+# also at the same time from several threads: each event loop gets an HTTP
+# session of its own, while the host limits and the retry budget are shared.
+class FetchEngine:
+    def __init__(self, concurrency=None, per_host=None, timeout=None, retries=None, backoff_factor=None, max_per_host=None):
+        if concurrency is None:
+            concurrency = int(os.getenv("FETCH_CONCURRENCY", "200"))
+        if per_host is None:
+            per_host = int(os.getenv("FETCH_CONCURRENCY_PER_HOST", "20"))
+        if max_per_host is None:
+            max_per_host = int(os.getenv("FETCH_MAX_PER_HOST", "64"))
+        if timeout is None:
+            timeout = float(os.getenv("HTTP_TIMEOUT", "30"))
+        if retries is None:
+            retries = int(os.getenv("HTTP_RETRIES", "3"))
+        if backoff_factor is None:
+            backoff_factor = float(os.getenv("HTTP_BACKOFF", "0.5"))
+
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.max_per_host = max(per_host, max_per_host)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.retry_budget = RetryBudget(float(os.getenv("HTTP_RETRY_BUDGET", "0.1")))
+        self._sessions = {}
+        self._host_limiters = {}
+        self._lock = threading.Lock()
+
+    # Open the HTTP session of the running event loop, must be called from the loop
+    async def open(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.max_per_host, ttl_dns_cache=300)
+        session = aiohttp.ClientSession(connector=connector,
+                                        timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                        headers={'Accept-Encoding': 'gzip, deflate'})
+        with self._lock:
+            self._sessions[asyncio.get_running_loop()] = session
+
+    # Close the HTTP session of the running event loop and its connections
+    async def close(self):
+        with self._lock:
+            session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    # HTTP session of the running event loop
+    @property
+    def session(self):
+        return self._sessions[asyncio.get_running_loop()]
+
+    # Get the adaptive limiter of the in-flight requests to the URL host
+    def host_limiter(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limiters:
+                self._host_limiters[host] = AdaptiveLimiter(self.per_host, max_limit=self.max_per_host)
+
+            return self._host_limiters[host]
+
+    # Record the current limit of each host and the retries denied by the
+    # budget as gauges of the metrics
+    def record_limits(self):
+        with self._lock:
+            host_limiters = list(self._host_limiters.items())
+        for host, limiter in host_limiters:
+            METRICS.gauge('fetch_limit_' + re.sub(r'\W', '_', host), int(limiter.limit))
+        METRICS.gauge('fetch_retries_denied', self.retry_budget.denied)
+
+    # Send a GET request and return the response body. Overloaded responses
+    # and connection errors are retried with jittered exponential backoff,
+    # while the shared retry budget allows it. With a decoder factory, the
+    # body is streamed into a new decoder on each attempt and the decoder
+    # output is returned instead.
+    async def get(self, url, verify=True, decoder=None):
+        kwargs = {} if verify else {'ssl': False}
+        limiter = self.host_limiter(url)
+        attempt = 0
+
+        while True:
+            await limiter.acquire()
+            start = time.monotonic()
+            overloaded = False
+            retry_after = None
+
+            try:
+                self.retry_budget.record_request()
+                METRICS.count('fetch_requests')
+                async with self.session.get(url, **kwargs) as response:
+                    if response.status in RETRY_STATUS_CODES:
+                        overloaded = True
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        if attempt >= self.retries or not self.retry_budget.try_spend():
+                            response.raise_for_status()
+                    else:
+                        response.raise_for_status()
+                        if decoder is None:
+                            body = await response.read()
+                            METRICS.count('fetch_bytes', len(body))
+                            return body
+
+                        # Time the decoding apart from the whole transfer
+                        stream_decoder = decoder()
+                        decode_time = 0.0
+                        async for chunk in response.content.iter_chunked(65536):
+                            METRICS.count('fetch_bytes', len(chunk))
+                            decode_start = time.perf_counter()
+                            stream_decoder.feed(chunk)
+                            decode_time += time.perf_counter() - decode_start
+                        METRICS.observe('decode', decode_time)
+                        return stream_decoder.close()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                overloaded = True
+                if attempt >= self.retries or not self.retry_budget.try_spend():
+                    METRICS.count('fetch_errors')
+                    raise
+            except aiohttp.ClientResponseError:
+                METRICS.count('fetch_errors')
+                raise
+            finally:
+                latency = time.monotonic() - start
+                METRICS.observe('fetch', latency)
+                await limiter.release(latency, overloaded)
+
+            # Wait before retrying, out of the host limit
+            METRICS.count('fetch_retries')
+            await asyncio.sleep(backoff_delay(attempt, self.backoff_factor, retry_after=retry_after))
+            attempt += 1
+
+# Fetch the FDIC details page of the given CNPJ
+async def fetch_fdic_details(engine, cnpj):
+    return await engine.get(fdic_details_url(cnpj))
+
+# Parse a report delivery date in the dd/mm/yyyy hh:mm format. The fields
+# are sliced directly, strptime is only used for unexpected formats.
+def parse_delivery_date(value):
+    if len(value) == 16 and value[2] == '/' and value[5] == '/' and value[10] == ' ' and value[13] == ':':
+        try:
+            return datetime(int(value[6:10]), int(value[3:5]), int(value[0:2]), int(value[11:13]), int(value[14:16]))
+        except ValueError:
+            pass
+
+    return datetime.strptime(value, '%d/%m/%Y %H:%M')
+
+# Parse a report reference date in the mm/yyyy format. The reports of a
+# fund share a few hundred reference months, so the dates are cached.
+@lru_cache(maxsize=4096)
+def parse_reference_date(value):
+    if len(value) == 7 and value[2] == '/':
+        try:
+            return datetime(int(value[3:7]), int(value[0:2]), 1)
+        except ValueError:
+            pass
+
+    return datetime.strptime(value, '%m/%Y')
+
+# Check if a page of the report search API reaches the reports already
+# known, given the watermark (delivery date, report id) of the FDIC. The
+# reports are sorted by delivery date, the most recent first.
+def reached_watermark(reports_list, watermark):
+    if watermark is None or len(reports_list) == 0:
+        return False
+
+    delivery_date, report_id = watermark
+    if any(report['id'] == report_id for report in reports_list):
+        return True
+
+    return parse_delivery_date(reports_list[-1]['dataEntrega']) < delivery_date
+
+# Fetch a page of the FDIC reports of the given CNPJ from the report search API
+async def fetch_fdic_reports_page(engine, cnpj, report_start):
+    return json_loads(await engine.get(fdic_reports_url(cnpj, report_start), verify=False))
+
+# Check that the pages hold all the reports counted by the search, so the
+# watermark of the FDIC is not moved past reports that were not fetched
+def check_reports_total(cnpj, pages, total_reports):
+    report_ids = {report['id'] for page in pages for report in page['data']}
+    if len(report_ids) < total_reports:
+        raise RuntimeError(f"Got {len(report_ids)} of the {total_reports} reports of the FDIC {cnpj}")
+
+# Fetch the pages of the FDIC reports of the given CNPJ from the report search
+# API. With watermarks, a dict of CNPJ to the watermark of the FDIC, the
+# pagination stops at the first page reaching the reports already known.
+# Without a watermark, the first page gives the number of reports and the
+# page size of the server, and the remaining pages are fetched concurrently,
+# within the per host limit. Fails when reports are missing from the pages.
+async def fetch_fdic_reports(engine, cnpj, watermarks=None):
+    watermark = watermarks.get(cnpj) if watermarks is not None else None
+
+    fdic_reports = await fetch_fdic_reports_page(engine, cnpj, 0)
+    pages = [fdic_reports]
+    reports_counter = len(fdic_reports['data'])
+    total_reports = fdic_reports['recordsTotal']
+
+    if reports_counter >= total_reports or reports_counter == 0:
+        return pages
+
+    if watermark is None:
+        # Fan out the requests of the remaining pages, stepping by the size
+        # of the first page as the server may return less than requested
+        report_starts = list(range(reports_counter, total_reports, reports_counter))
+        pages += await asyncio.gather(*(fetch_fdic_reports_page(engine, cnpj, report_start)
+                                        for report_start in report_starts))
+
+        # Fetch one at a time the reports a short page left before the next page
+        report_ends = report_starts[1:] + [total_reports]
+        for report_start, report_end, page in zip(report_starts, report_ends, pages[1:]):
+            report_start += len(page['data'])
+            while report_start < report_end:
+                page = await fetch_fdic_reports_page(engine, cnpj, report_start)
+                if len(page['data']) == 0:
+                    break
+
+                # Keep the reports of the gap only, the next page has the others
+                page['data'] = page['data'][:report_end - report_start]
+                pages.append(page)
+                report_start += len(page['data'])
+
+        check_reports_total(cnpj, pages, total_reports)
+        return pages
+
+    # The pages are fetched one at a time until the watermark is reached
+    while not reached_watermark(fdic_reports['data'], watermark):
+        fdic_reports = await fetch_fdic_reports_page(engine, cnpj, reports_counter)
+        pages.append(fdic_reports)
+        reports_counter += len(fdic_reports['data'])
+
+        # Check if there are more reports to fetch
+        if reports_counter >= fdic_reports['recordsTotal']:
+            break
+        if len(fdic_reports['data']) == 0:
+            raise RuntimeError(f"Got {reports_counter} of the {fdic_reports['recordsTotal']} reports of the FDIC {cnpj}")
+
+    return pages
+
+# Fetch the document of the given report, decoding the base64 content as it arrives
+async def fetch_fdic_report_document(engine, report_id):
+    return await engine.get(fdic_report_document_url(report_id), verify=False, decoder=Base64StreamDecoder)
+
+# Run fetch(engine, item) for every item on an event loop in a background
+# thread. Yields (item, result, error) tuples as the fetches complete. The
+# items are consumed lazily, at most window of them are in flight and at
+# most max_pending results wait for the consumer, so memory stays bounded
+# whatever the number of items. With blocking_items the items are taken in
+# an executor thread, so waiting for the next one (e.g. from a queue fed by
+# another stage) does not hold up the requests in flight.
+def stream_fetch(items, fetch, engine=None, max_pending=None, window=None, blocking_items=False):
+    if engine is None:
+        engine = FetchEngine()
+    if window is None:
+        window = engine.concurrency
+    if max_pending is None:
+        max_pending = engine.concurrency
+
+    results = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    done = object()
+    failure = []
+
+    # Hand a result to the consumer, waiting while the queue is full
+    async def put(result):
+        while not stop.is_set():
+            try:
+                results.put_nowait(result)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.005)
+
+    async def run_item(item):
+        try:
+            result = (item, await fetch(engine, item), None)
+        except Exception as e:
+            result = (item, None, e)
+        await put(result)
+
+    async def next_item(iterator):
+        if blocking_items:
+            return await asyncio.get_running_loop().run_in_executor(None, next, iterator, done)
+        return next(iterator, done)
+
+    async def produce():
+        await engine.open()
+        try:
+            pending = set()
+            iterator = iter(items)
+            while not stop.is_set():
+                item = await next_item(iterator)
+                if item is done:
+                    break
+
+                # Keep at most window items in flight
+                if len(pending) >= window:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.add(asyncio.ensure_future(run_item(item)))
+
+                METRICS.gauge('fetch_in_flight', len(pending))
+                METRICS.gauge('fetch_results_queue', results.qsize())
+                engine.record_limits()
+
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            await engine.close()
+
+    def run():
+        try:
+            asyncio.run(produce())
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            while not stop.is_set():
+                try:
+                    results.put(done, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            result = results.get()
+            if result is done:
+                break
+            yield result
+    finally:
+        stop.set()
+        thread.join()
+
+    if failure:
+        raise failure[0]
@@ -1,13 +1,15 @@
+import os
+
 
 def get_all_fdic_cnpj():
-    from bs4 import BeautifulSoup
+    from htmlparse import parse_html
 
     # load the HTML content from the file
-    with open('html\CVM-DadosCadastrais.htm', 'r') as file:
+    with open(os.path.join('html', 'CVM-DadosCadastrais.htm'), 'r') as file:
         html_content = file.read()
 
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(html_content, 'html.parser')
+    # Parse the HTML content with the configured parser backend
+    soup = parse_html(html_content)
     
     # Find all the rows containing FDIC data
     fdic_rows = soup.find_all('a', class_='MenuItemP')
@@ -1,11 +1,19 @@
-import concurrent.futures
-import requests
+import os
+import sys
+
+# Make the modules of the project folder importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fetchengine import FetchEngine, fetch_fdic_details
+from scheduler import run_scheduler
+from metrics import instrumented_run
+from htmlparse import parse_html
+from corpus import has_fdic_details, save_fdic_details
 
 def extract_fdic_data(html_content):
-    from bs4 import BeautifulSoup
 
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(html_content, 'html.parser')
+    # Parse the HTML content with the configured parser backend
+    soup = parse_html(html_content)
     
     # Find all the rows containing FDIC data
     fdic_rows = soup.find_all('a', class_='MenuItemP')
@@ -33,33 +41,8 @@ def extract_fdic_data(html_content):
     
     return fdic_list
 
-# Given a CNPJ, extract the FDIC details from the HTML page content
-def get_fdic_details(cnpj, timeout=30):
-    # Check if the detail file already exists
-    import os
-
-    if os.path.exists(f'html\\fdic-details\\{cnpj}.html'):
-        return cnpj
-
-    fdic_detail_page = 'https://cvmweb.cvm.gov.br/swb/sistemas/scw/cPublica/CConsolFdo/ResultBuscaDocsFdoFIDC.aspx?Fisic_Juridic=PJ&Tipo_Partic=87&Cpfcgc_Partic=' + cnpj
-    response = requests.get(fdic_detail_page, timeout=timeout)
-
-    # Check if the request was successful
-    if response.status_code != 200:
-        # Throw an exception if the request was not successful
-        raise Exception('Failed to fetch FDIC details for CNPJ: ' + cnpj)
-    
-    # Store the html content to a file in the html\fdic-details\<cnpj>.html folder
-    with open(f'html\\fdic-details\\{cnpj}.html', 'w') as file:
-        file.write(response.text)
-        file.flush()
-        file.close()
-    
-    return cnpj
-    
-
 # load the HTML content from the file
-with open('html\CVM-DadosCadastrais.htm', 'r') as file:
+with open(os.path.join('html', 'CVM-DadosCadastrais.htm'), 'r') as file:
     html_content = file.read()
 
 # Extract FDIC data from HTML content
@@ -68,23 +51,17 @@ fdic_data = extract_fdic_data(html_content)
 timeout = 30
 batch_size = 20
 
-while len(fdic_data) > 0:
-    # Pop the first 10 CNPJs from the list and extract FDIC details
-    cnpjs_batch = []
-    while len(cnpjs_batch) < batch_size and len(fdic_data) > 0:
-        cnpjs_batch.append(fdic_data.pop(0)['cnpj'])
-    
-    # Create a thread pool with a maximum of 5 worker threads
-    with concurrent.futures.ThreadPoolExecutor(max_workers=batch_size) as executor:
-        # Submit each URL to the thread pool for execution
-        futures = {executor.submit(get_fdic_details, cnpj, timeout): cnpj for cnpj in cnpjs_batch}
+# Fetch the pages asynchronously, with at most batch_size requests in flight
+engine = FetchEngine(per_host=batch_size, timeout=timeout)
+
+# Only fetch the CNPJs whose details were not saved yet
+cnpjs = [fdic['cnpj'] for fdic in fdic_data if not has_fdic_details(fdic['cnpj'])]
+
+def report_failure(cnpj, error):
+    print(f"Failed to extract FDIC details for CNPJ: {cnpj}")
+    print(error)
 
-        # Wait for all tasks to complete and collect the results
-        results = {}
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                cnpj = futures[future]
-                print(f"Extracted FDIC details for CNPJ: {cnpj}")
-            except Exception as e:
-                print(f"Failed to extract FDIC details for CNPJ: {cnpj[0]}")
-                print(e)
+# Save each page as soon as it arrives
+with instrumented_run('get_fdic_details'):
+    run_scheduler(iter(cnpjs), fetch_fdic_details, save_fdic_details, report_failure,
+                  label='FDIC details', engine=engine, total=len(cnpjs))
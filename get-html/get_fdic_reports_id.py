@@ -1,44 +1,27 @@
-import concurrent.futures
-from get_all_fdic_cnpj import get_all_fdic_cnpj
-
-# Given a CNPJ, extract the FDIC reports ID's from the REST API request
-def get_fdic_reports(cnpj):
-    import requests
-    import json
-    from datetime import datetime
-
-    # Define the URL for the FDIC reports API
-    report_start = 0
-    reports_counter = 0
-    has_more_reports = True
-    reports = []
-
-    while has_more_reports:
-        fdic_reports_api = 'https://fnet.bmfbovespa.com.br/fnet/publico/pesquisarGerenciadorDocumentosDados?d=2&l=200&o[0][dataEntrega]=desc&idCategoriaDocumento=6&idTipoDocumento=40&idEspecieDocumento=0&cnpjFundo=' + cnpj + '&s=' + str(
-            report_start)
+import os
+import sys
 
-        # Send a GET request to the API
-        response = requests.get(fdic_reports_api)
+# Make the modules of the project folder importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-        # Check if the request was successful
-        if response.status_code != 200:
-            # Throw an exception if the request was not successful
-            raise Exception('Failed to fetch FDIC reports for CNPJ: ' + cnpj)
+from get_all_fdic_cnpj import get_all_fdic_cnpj
+from fetchengine import FetchEngine, fetch_fdic_reports, parse_delivery_date, parse_reference_date
+from corpus import has_fdic_report, save_fdic_report
+from scheduler import run_scheduler
+from metrics import instrumented_run
 
-        # Parse the JSON content
-        fdic_reports = json.loads(response.content)
-        reports_list = fdic_reports['data']
+# Given a CNPJ, extract the FDIC reports ID's from the JSON pages of the REST API
+def get_fdic_reports(cnpj, pages):
+    reports = []
 
+    for fdic_reports in pages:
         # Extract the report ID's from the JSON content
-        for report in reports_list:
-            reports_counter += 1
+        for report in fdic_reports['data']:
             report_id = report['id']
             report_category = report['categoriaDocumento']
             report_type = report['tipoDocumento']
-            report_ref_date = datetime.strptime(
-                report['dataReferencia'], '%m/%Y')
-            report_delivery_date = datetime.strptime(
-                report['dataEntrega'], '%d/%m/%Y %H:%M')
+            report_ref_date = parse_reference_date(report['dataReferencia'])
+            report_delivery_date = parse_delivery_date(report['dataEntrega'])
             report_status = report['status']
             report_desc_status = report['descricaoStatus']
             report_analyzed = report['analisado'] == 'S'
@@ -55,59 +38,35 @@ def get_fdic_reports(cnpj):
                             'analyzed': report_analyzed,
                             'status_doc': report_status_doc})
 
-        # Check if there are more reports to fetch
-        total_reports = fdic_reports['recordsTotal']
-        if reports_counter >= total_reports:
-            has_more_reports = False
-        else:
-            has_more_reports = True
-            report_start += len(reports_list)
-
     return reports
 
-# Function to store the extracted FDIC reports JSON object to file in the html\fdic-reports\<cnpj>.json folder
+# Function to store the extracted FDIC reports JSON objects in the corpus
 def save_reports(reports):
-    import json
-    import os
-
     if len(reports) == 0:
         return
 
     # For each report, save the JSON object to a file
     for report in reports:
         # Check if the report file already exists
-        if not os.path.exists(f'html\\fdic-reports\\{report["report_id"]}.json'):
-            # Save the report JSON object to a file
-            with open(f'html\\fdic-reports\\{report["report_id"]}.json', 'w') as file:
-                json.dump(report, file, default=str)
-                file.flush()
-                file.close()
+        if not has_fdic_report(report["report_id"]):
+            # Save the report JSON object to the corpus
+            save_fdic_report(report)
 
 # Get all FDIC CNPJs from the base HTML file
 cnpjs = get_all_fdic_cnpj()
 batch_size = 20
 
-while len(cnpjs) > 0:
-    # Pop the first n'th CNPJs from the list and extract FDIC details
-    cnpjs_batch = []
-    while len(cnpjs_batch) < batch_size and len(cnpjs) > 0:
-        cnpjs_batch.append(cnpjs.pop(0)['cnpj'])
-    
-    # Create a thread pool with a maximum of `batch_size` worker threads
-    with concurrent.futures.ThreadPoolExecutor(max_workers=batch_size) as executor:
-        # Submit each URL to the thread pool for execution
-        futures = {executor.submit(get_fdic_reports, cnpj): cnpj for cnpj in cnpjs_batch}
+# Fetch the report pages asynchronously, with at most batch_size requests in flight
+engine = FetchEngine(per_host=batch_size)
+
+# Extract and save the reports of each CNPJ as soon as its pages arrive
+def save_fdic_reports(cnpj, pages):
+    save_reports(get_fdic_reports(cnpj, pages))
 
-        # Wait for all tasks to complete and collect the results
-        results = {}
-        for future in concurrent.futures.as_completed(futures):
-            cnpj = futures[future]
-            try:
-                results[cnpj] = future.result()
-            except Exception as e:
-                print(f"Failed to extract FDIC details for CNPJ: {cnpj[0]}")
-                print(e)
+def report_failure(cnpj, error):
+    print(f"Failed to extract FDIC reports for CNPJ: {cnpj}")
+    print(error)
 
-        for cnpj, fdic_report in results.items():
-            print("Extracted reports for CNPJ: " + cnpj[0] + " - " + str(len(fdic_report)) + " reports")
-            save_reports(fdic_report)
+with instrumented_run('get_fdic_reports_id'):
+    run_scheduler((fdic['cnpj'] for fdic in cnpjs), fetch_fdic_reports, save_fdic_reports, report_failure,
+                  label='FDIC report lists', engine=engine, total=len(cnpjs))
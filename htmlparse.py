@@ -0,0 +1,181 @@
+from dotenv import load_dotenv
+import os
+import re
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Parser backends in order of preference when HTML_PARSER is not set. lxml
+# must be set explicitly, it drops elements of the malformed CVM listing.
+PARSER_BACKENDS = ('selectolax', 'bs4')
+
+# Charset declared in the head of the HTML page
+CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+# Decode the HTML bytes with the declared charset, falling back to UTF-8
+# and Windows-1252 like BeautifulSoup does
+def decode_html(content):
+    if isinstance(content, str):
+        return content
+
+    content = bytes(content)
+    match = CHARSET_PATTERN.search(content[:4096])
+    encodings = ([match.group(1).decode('ascii')] if match else []) + ['utf-8', 'windows-1252']
+
+    for encoding in encodings:
+        try:
+            return content.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            pass
+
+    return content.decode('windows-1252', errors='replace')
+
+# Element of a document parsed with lxml. Exposes the subset of the
+# BeautifulSoup API used by the extractors: find, find_all, text, get and [].
+class LxmlNode:
+    __slots__ = ('element',)
+
+    def __init__(self, element):
+        self.element = element
+
+    @staticmethod
+    def _xpath(tag, id=None, class_=None):
+        path = './/' + tag
+        if id is True:
+            path += '[@id]'
+        elif id is not None:
+            path += f'[@id="{id}"]'
+        if class_ is not None:
+            path += f'[contains(concat(" ", normalize-space(@class), " "), " {class_} ")]'
+        return path
+
+    def find(self, tag, id=None, class_=None):
+        elements = self.element.xpath(self._xpath(tag, id, class_))
+        return LxmlNode(elements[0]) if elements else None
+
+    def find_all(self, tag, id=None, class_=None):
+        return [LxmlNode(element) for element in self.element.xpath(self._xpath(tag, id, class_))]
+
+    @property
+    def text(self):
+        return self.element.text_content()
+
+    def get(self, attr, default=None):
+        return self.element.get(attr, default)
+
+    def __getitem__(self, attr):
+        value = self.element.get(attr)
+        if value is None:
+            raise KeyError(attr)
+        return value
+
+# Element of a document parsed with selectolax, with the same API as LxmlNode
+class SelectolaxNode:
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+    @staticmethod
+    def _selector(tag, id=None, class_=None):
+        selector = tag
+        if id is True:
+            selector += '[id]'
+        elif id is not None:
+            selector += '#' + id
+        if class_ is not None:
+            selector += '.' + class_
+        return selector
+
+    def find(self, tag, id=None, class_=None):
+        node = self.node.css_first(self._selector(tag, id, class_))
+        return SelectolaxNode(node) if node is not None else None
+
+    def find_all(self, tag, id=None, class_=None):
+        return [SelectolaxNode(node) for node in self.node.css(self._selector(tag, id, class_))]
+
+    @property
+    def text(self):
+        return self.node.text(deep=True, separator='')
+
+    def get(self, attr, default=None):
+        value = self.node.attributes.get(attr)
+        return default if value is None else value
+
+    def __getitem__(self, attr):
+        value = self.node.attributes.get(attr)
+        if value is None:
+            raise KeyError(attr)
+        return value
+
+def parse_with_selectolax(content):
+    from selectolax.lexbor import LexborHTMLParser
+    return SelectolaxNode(LexborHTMLParser(decode_html(content)).root)
+
+def parse_with_lxml(content):
+    import lxml.html
+    parser = lxml.html.HTMLParser(huge_tree=True)
+    return LxmlNode(lxml.html.document_fromstring(decode_html(content), parser=parser))
+
+def parse_with_bs4(content):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(content, 'html.parser')
+
+PARSERS = {
+    'selectolax': parse_with_selectolax,
+    'lxml': parse_with_lxml,
+    'bs4': parse_with_bs4
+}
+
+# Check if the parser backend is installed
+def is_backend_available(backend):
+    module = {'selectolax': 'selectolax.lexbor', 'lxml': 'lxml.html', 'bs4': 'bs4'}[backend]
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+_default_backend = None
+
+# Get the parser backend set by HTML_PARSER, or the fastest one installed.
+# BeautifulSoup with html.parser is the fallback.
+def get_backend():
+    global _default_backend
+
+    if _default_backend is None:
+        _default_backend = os.getenv("HTML_PARSER")
+
+    if not _default_backend:
+        _default_backend = next((backend for backend in PARSER_BACKENDS if is_backend_available(backend)), 'bs4')
+
+    return _default_backend
+
+# Parse the HTML content with the given backend, or the default one
+def parse_html(content, backend=None):
+    if backend is None:
+        backend = get_backend()
+
+    return PARSERS[backend](content)
+
+# Parse the HTML content in one pass and index the tag elements with one of
+# the given ids. Returns a dict of id to element, keeping the first element
+# of each id like find does. BeautifulSoup only builds the wanted elements.
+def index_by_id(content, tag, ids, backend=None):
+    if backend is None:
+        backend = get_backend()
+
+    ids = set(ids)
+    if backend == 'bs4':
+        from bs4 import BeautifulSoup, SoupStrainer
+        soup = BeautifulSoup(content, 'html.parser', parse_only=SoupStrainer(tag, id=ids))
+    else:
+        soup = parse_html(content, backend)
+
+    index = {}
+    for element in soup.find_all(tag, id=True):
+        element_id = element.get('id')
+        if element_id in ids and element_id not in index:
+            index[element_id] = element
+
+    return index
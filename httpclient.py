@@ -0,0 +1,33 @@
+from dotenv import load_dotenv
+import os
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Hosts of the CVM and fnet sites. They can be pointed to a local stand-in
+# server, e.g. the one of benchmark_e2e.py, with CVM_BASE_URL and FNET_BASE_URL.
+CVM_BASE_URL = os.getenv("CVM_BASE_URL", "https://cvmweb.cvm.gov.br").rstrip('/')
+FNET_BASE_URL = os.getenv("FNET_BASE_URL", "https://fnet.bmfbovespa.com.br").rstrip('/')
+
+# Remote endpoints of the FDIC fund details, the report search API and the report documents
+FDIC_DETAILS_PAGE = CVM_BASE_URL + '/swb/sistemas/scw/cPublica/CConsolFdo/ResultBuscaDocsFdoFIDC.aspx?Fisic_Juridic=PJ&Tipo_Partic=87&Cpfcgc_Partic='
+FDIC_REPORTS_API = FNET_BASE_URL + '/fnet/publico/pesquisarGerenciadorDocumentosDados?d=2&l=200&o[0][dataEntrega]=desc&idCategoriaDocumento=6&idTipoDocumento=40&idEspecieDocumento=0'
+FDIC_REPORT_DOCUMENT = FNET_BASE_URL + '/fnet/publico/exibirDocumento?cvm=true&id='
+
+# Number of reports returned by each page of the report search API
+FDIC_REPORTS_PAGE_SIZE = 200
+
+# URL of the FDIC details page of the given CNPJ
+def fdic_details_url(cnpj):
+    return FDIC_DETAILS_PAGE + cnpj
+
+# URL of the page of the FDIC reports of the given CNPJ starting at report_start
+def fdic_reports_url(cnpj, report_start):
+    return FDIC_REPORTS_API + '&cnpjFundo=' + cnpj + '&s=' + str(report_start)
+
+# URL of the base64 encoded document of the given report
+def fdic_report_document_url(report_id):
+    return FDIC_REPORT_DOCUMENT + str(report_id)
+
+# Status codes worth retrying, the servers return them when overloaded
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
@@ -0,0 +1,369 @@
+from dotenv import load_dotenv
+import argparse
+import functools
+import os
+import queue
+import threading
+import time
+from dbconnect import ConnectionPool, stream_query
+from bulkload import insert_new_fdic_cnpjs
+from schema import check_schema, create_report_data_partitions
+from dimensions import preload_fdic_dimensions
+from worklog import (FDIC_DETAILS_STAGE, FDIC_REPORT_DATA_STAGE, bootstrap_work, enqueue_work,
+                     claim_work, release_stale_claims, complete_work, fail_work)
+from fetchengine import FetchEngine, fetch_fdic_details, fetch_fdic_reports, fetch_fdic_report_document, stream_fetch
+from corpus import get_source, read_fdic_details, read_fdic_reports_by_cnpj, read_fdic_report_data, stream_corpus
+from stages import get_parse_workers, run_stage
+from metrics import METRICS, add_profile_argument, instrumented_run
+from load_fdic import extract_fdic_data
+from load_fdic_detaisl import parse_fdic_detail_page, update_fdic_details_in_db
+from load_fdic_reports_id import (parse_fdic_reports, parse_corpus_reports, insert_reports,
+                                  get_watermarks_from_db, update_watermark)
+from load_fdic_report import FDIC_REPORTS_NOT_FILLED_SQL, parse_fdic_report, insert_report_data
+
+# Load environment variables from .env file
+load_dotenv()
+
+# CVM listing saved by hand, see README
+LISTING_PATH = 'html/CVM-DadosCadastrais.htm'
+
+# FDICs whose reports are discovered when no listing is loaded, the ones
+# without details yet first
+FDIC_DISCOVERY_SQL = "SELECT cnpj FROM fdic ORDER BY name IS NULL DESC"
+
+# Queue of the items flowing from a stage to the next one. The consumer
+# iterates over it until all the producers closed it, and a full channel
+# blocks the producers, so a slow stage slows down the ones feeding it. A
+# failed consumer aborts the channel, dropping the items put after that.
+class Channel:
+    def __init__(self, name, maxsize=0, producers=1):
+        self.name = name
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._producers = producers
+        self._lock = threading.Lock()
+        self._aborted = threading.Event()
+        self._closed = object()
+
+    def put(self, item):
+        while not self._aborted.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                METRICS.gauge(f'{self.name}_queue', self._queue.qsize())
+                return
+            except queue.Full:
+                pass
+
+    # Called once by each producer when it has no more items
+    def close(self):
+        with self._lock:
+            self._producers -= 1
+            if self._producers > 0:
+                return
+
+        while not self._aborted.is_set():
+            try:
+                self._queue.put(self._closed, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def abort(self):
+        self._aborted.set()
+
+    def __iter__(self):
+        while not self._aborted.is_set():
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is self._closed:
+                return
+            yield item
+
+# Put the items in the channel, waiting while it is full
+def put_all(channel, items):
+    for item in items:
+        channel.put(item)
+
+# Yield the fetched items of the channel. When the stage stops reading
+# before the end, e.g. on a failure, the channel is aborted before the
+# fetches are closed, so the fetch thread waiting for the next item of the
+# channel lets go and can be joined.
+def abort_on_exit(channel, fetched):
+    try:
+        for result in fetched:
+            yield result
+    finally:
+        channel.abort()
+        fetched.close()
+
+# The four loaders as a single streaming ingest. The stages run at the same
+# time, linked by channels:
+#
+#   listing --> details
+#           \-> report discovery --> report data
+#
+# The new FDICs of the listing go to the details stage as soon as they are
+# inserted, and all the FDICs of the listing, the new ones first, go to the
+# report discovery. Each report found goes to the report data stage as soon
+# as it is stored, so a refresh takes about as long as its slowest stage.
+# The details and report data stages also work on the backlog claimed from
+# the work ledger. Each stage keeps the work ledger and the watermarks like
+# its loader, so the pipeline and the loaders can be run in turns.
+class IngestPipeline:
+    def __init__(self, db_pool, workers=20, parse_workers=0, full_sweep=False, listing_path=LISTING_PATH,
+                 queue_size=None, timeout=30):
+        if queue_size is None:
+            queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", "1000"))
+
+        self.db_pool = db_pool
+        self.workers = workers
+        self.parse_workers = parse_workers
+        self.full_sweep = full_sweep
+        self.listing_path = listing_path
+        self.timeout = timeout
+        self.corpus = get_source() == 'corpus'
+        self.watermarks = None
+        self.failures = []
+
+        # The fetching stages share one engine, so the limit of each host
+        # and the retry budget cover all the requests of the pipeline
+        self.engine = None if self.corpus else FetchEngine(per_host=workers, timeout=timeout)
+
+        # Channels between the stages. The details and the report data are
+        # fed by their claimed backlog and by the previous stage.
+        self.details = Channel('details', queue_size, producers=2)
+        self.reports = Channel('reports', queue_size)
+        self.report_data = Channel('report_data', queue_size, producers=2)
+
+    # Check the schema, fill the work ledger on the first run and
+    # cache the dimensions and watermarks
+    def prepare(self):
+        with self.db_pool.connection() as conn:
+            check_schema(conn)
+            create_report_data_partitions(conn)
+            bootstrap_work(conn, FDIC_DETAILS_STAGE, "SELECT cnpj FROM fdic WHERE name IS NULL")
+            bootstrap_work(conn, FDIC_REPORT_DATA_STAGE, FDIC_REPORTS_NOT_FILLED_SQL)
+            release_stale_claims(conn, FDIC_DETAILS_STAGE)
+            release_stale_claims(conn, FDIC_REPORT_DATA_STAGE)
+            preload_fdic_dimensions(conn)
+            self.watermarks = None if self.full_sweep or self.corpus else get_watermarks_from_db(conn)
+
+    # Fetch the items of a channel, or read them from the corpus, see DATA_SOURCE
+    def fetch(self, channel, fetch, read):
+        if self.corpus:
+            return stream_corpus(channel, read)
+
+        return abort_on_exit(channel, stream_fetch(channel, fetch, self.engine, blocking_items=True))
+
+    # Insert the new FDICs of the listing, then hand them to the details
+    # stage and all the FDICs of the listing to the report discovery. Without
+    # a listing the reports of the FDICs already loaded are discovered.
+    def load_listing(self):
+        if self.listing_path is None:
+            self.feed(self.reports, lambda reader: (row[0] for row in stream_query(reader, FDIC_DISCOVERY_SQL)))
+            return
+
+        with open(self.listing_path, mode='r', encoding='utf-8') as file:
+            html_content = file.read()
+
+        with METRICS.timer('listing_parse'):
+            cnpjs = list(dict.fromkeys(fdic['cnpj'] for fdic in extract_fdic_data(html_content)))
+
+        # The details of the new FDICs are queued as claimed, so the details
+        # backlog does not claim them too
+        with self.db_pool.connection() as conn:
+            with METRICS.timer('listing_write'):
+                new_cnpjs = insert_new_fdic_cnpjs(conn, cnpjs)
+                queued = enqueue_work(conn, FDIC_DETAILS_STAGE, new_cnpjs, claim=True)
+                conn.commit()
+
+        METRICS.count('fdic_inserted', len(new_cnpjs))
+        print(f"Inserted {len(new_cnpjs)} new FDICs of the {len(cnpjs)} in the CVM listing")
+
+        # Feed the report discovery from a thread of its own, so it starts
+        # right away instead of after all but the last queue_size details
+        new = set(new_cnpjs)
+        reports_feeder = threading.Thread(target=put_all, name='listing_reports', daemon=True,
+                                          args=(self.reports, new_cnpjs + [cnpj for cnpj in cnpjs if cnpj not in new]))
+        reports_feeder.start()
+        try:
+            put_all(self.details, queued)
+        finally:
+            reports_feeder.join()
+
+    # Stream the rows of the query into the channel from a connection of its own
+    def feed(self, channel, query):
+        with self.db_pool.connection() as reader:
+            for item in query(reader):
+                channel.put(item)
+
+    # Claim the FDICs left without details by the previous runs
+    def feed_details_backlog(self):
+        self.feed(self.details, lambda reader: claim_work(reader, FDIC_DETAILS_STAGE))
+
+    # Claim the reports left by the previous runs. The reports found by the
+    # discovery are queued as claimed, so they are not claimed again here.
+    def feed_report_data_backlog(self):
+        self.feed(self.report_data, lambda reader: claim_work(reader, FDIC_REPORT_DATA_STAGE))
+
+    def store_details(self, cnpj, fdic_details):
+        with self.db_pool.connection() as conn:
+            with METRICS.timer('details_write'):
+                update_fdic_details_in_db(conn, cnpj, fdic_details)
+            complete_work(conn, FDIC_DETAILS_STAGE, cnpj)
+
+        METRICS.count('fdic_details_done')
+
+    def details_failed(self, cnpj, error):
+        METRICS.count('fdic_details_failed')
+        self.record_failure(FDIC_DETAILS_STAGE, cnpj, error)
+
+    def load_details(self):
+        fetched = self.fetch(self.details, fetch_fdic_details, read_fdic_details)
+        run_stage(fetched, parse_fdic_detail_page, self.store_details, self.details_failed,
+                  self.parse_workers, self.workers, parse_metric='details_parse')
+
+    # Store the reports of a FDIC and queue the data of the new ones
+    def store_reports(self, cnpj, fdic_reports):
+        with self.db_pool.connection() as conn:
+            with METRICS.timer('reports_write'):
+                counts = insert_reports(conn, fdic_reports, claim=True)
+
+            # The watermark only moves once all the reports are stored
+            if not self.corpus:
+                update_watermark(conn, cnpj, fdic_reports)
+
+        for report_id in counts['ids']:
+            self.report_data.put(str(report_id))
+
+        METRICS.count('fdic_reports_done')
+        METRICS.count('reports_inserted', counts['inserted'])
+        METRICS.count('reports_skipped', counts['skipped'])
+
+    def reports_failed(self, cnpj, error):
+        METRICS.count('fdic_reports_failed')
+        print(f"Failed to extract FDIC report for CNPJ: {cnpj}")
+        print(error)
+
+    def discover_reports(self):
+        if self.corpus:
+            # Read the reports saved by get-html instead of fetching them
+            reports_by_cnpj = read_fdic_reports_by_cnpj()
+            fetched = stream_corpus((cnpj for cnpj in self.reports if cnpj in reports_by_cnpj), reports_by_cnpj.get)
+            parse = parse_corpus_reports
+        else:
+            fetch = functools.partial(fetch_fdic_reports, watermarks=self.watermarks)
+            fetched = self.fetch(self.reports, fetch, None)
+            parse = parse_fdic_reports
+
+        run_stage(fetched, parse, self.store_reports, self.reports_failed, 0, self.workers,
+                  parse_metric='reports_parse')
+
+    def store_report_data(self, report_id, fdic_report_data):
+        with self.db_pool.connection() as conn:
+            with METRICS.timer('report_data_write'):
+                insert_report_data(conn, fdic_report_data)
+            complete_work(conn, FDIC_REPORT_DATA_STAGE, report_id)
+
+        METRICS.count('report_data_done')
+
+    def report_data_failed(self, report_id, error):
+        METRICS.count('report_data_failed')
+        self.record_failure(FDIC_REPORT_DATA_STAGE, report_id, error)
+
+    def load_report_data(self):
+        fetched = self.fetch(self.report_data, fetch_fdic_report_document, read_fdic_report_data)
+        run_stage(fetched, parse_fdic_report, self.store_report_data, self.report_data_failed,
+                  self.parse_workers, self.workers, parse_metric='report_data_parse')
+
+    # Print the failure of an item and record it in the work ledger, to
+    # retry it later or quarantine it
+    def record_failure(self, stage, item, error):
+        print(f"Failed to load {stage} of {item}")
+        print(error)
+
+        try:
+            with self.db_pool.connection() as conn:
+                fail_work(conn, stage, item, error)
+        except Exception as e:
+            print(f"Failed to record the failure of {stage} of {item}")
+            print(e)
+
+    # Run a stage in a thread of its own. When it fails, the channels it
+    # reads are aborted so the stages feeding it do not wait for it, and the
+    # channels it writes are always closed so the next stages finish.
+    def start_stage(self, name, target, inputs=(), outputs=()):
+        def run():
+            start = time.perf_counter()
+            try:
+                target()
+            except Exception as e:
+                self.failures.append((name, e))
+                print(f"Stage {name} failed")
+                print(e)
+                for channel in inputs:
+                    channel.abort()
+            finally:
+                for channel in outputs:
+                    channel.close()
+                METRICS.observe(f'stage_{name}', time.perf_counter() - start)
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    # Run all the stages until the work runs out. Returns the failed stages
+    # with their errors.
+    def run(self):
+        self.prepare()
+
+        threads = [
+            self.start_stage('listing', self.load_listing, outputs=(self.details, self.reports)),
+            self.start_stage('details_backlog', self.feed_details_backlog, outputs=(self.details,)),
+            self.start_stage('report_data_backlog', self.feed_report_data_backlog, outputs=(self.report_data,)),
+            self.start_stage('details', self.load_details, inputs=(self.details,)),
+            self.start_stage('reports', self.discover_reports, inputs=(self.reports,), outputs=(self.report_data,)),
+            self.start_stage('report_data', self.load_report_data, inputs=(self.report_data,))
+        ]
+        for thread in threads:
+            thread.join()
+
+        # The data of the reports of new months went to the default
+        # partition, move it to partitions of its own
+        with self.db_pool.connection() as conn:
+            create_report_data_partitions(conn)
+
+        return self.failures
+
+if __name__ == '__main__':
+    # Command line options, see --help
+    parser = argparse.ArgumentParser(description='Load the new FDICs, their details, reports and report data in one streaming run')
+    parser.add_argument('--listing', default=LISTING_PATH, help='CVM listing page with the FDICs')
+    parser.add_argument('--skip-listing', action='store_true', help='only work on the FDICs already loaded')
+    parser.add_argument('--workers', type=int, default=20, help='worker threads of each stage')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    # Incremental discovery stops at the reports already known, set
+    # REPORT_DISCOVERY=full to page through all the reports of every FDIC
+    full_sweep = os.getenv("REPORT_DISCOVERY", "incremental") == "full"
+
+    # One connection per worker thread of the three stages, one per work
+    # list being streamed and one for the listing
+    db_pool = ConnectionPool(size=3 * args.workers + 4)
+
+    # Record the metrics of the run, see METRICS_DIR and METRICS_PORT
+    with instrumented_run('ingest', args.profile):
+        try:
+            start = time.perf_counter()
+            pipeline = IngestPipeline(db_pool, args.workers, get_parse_workers(), full_sweep,
+                                      None if args.skip_listing else args.listing)
+            failures = pipeline.run()
+            print(f"Ingest finished in {time.perf_counter() - start:.3f}s")
+        finally:
+            # Close the database connections
+            db_pool.close()
+
+    if failures:
+        raise SystemExit(1)
@@ -1,11 +1,17 @@
-from dbconnect import connect_db, get_all_fdic_cnpj_from_db
+from dbconnect import ConnectionPool
+from bulkload import insert_new_fdic_cnpjs
+from schema import check_schema
+from worklog import FDIC_DETAILS_STAGE, seed_work
+from htmlparse import parse_html
+from metrics import METRICS, add_profile_argument, instrumented_run
+import argparse
+import time
 
-def extract_fdic_data(html_content):
-    from bs4 import BeautifulSoup
+def extract_fdic_data(html_content, backend=None):
     from urllib.parse import urlparse, parse_qs
 
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(html_content, 'html.parser')
+    # Parse the HTML content with the configured parser backend
+    soup = parse_html(html_content, backend)
     
     # Find all the rows containing FDIC data
     fdic_rows = soup.find_all('a', class_='MenuItemP')
@@ -32,35 +38,51 @@ def extract_fdic_data(html_content):
     
     return fdic_list
 
-# load the HTML content from the file
-with open('html/CVM-DadosCadastrais.htm', mode='r', encoding='utf-8') as file:
-    html_content = file.read()
+if __name__ == '__main__':
+    # Command line options, see --help
+    parser = argparse.ArgumentParser(description='Load the new FDICs of the CVM listing')
+    add_profile_argument(parser)
+    args = parser.parse_args()
 
-# Extract FDIC data from HTML content
-fdic_data = extract_fdic_data(html_content)
+    # Record the metrics of the run, see METRICS_DIR and METRICS_PORT
+    with instrumented_run('load_fdic', args.profile):
+        start = time.perf_counter()
 
-try:
-    # Connect to the PostgreSQL database
-    conn = connect_db()
+        # load the HTML content from the file
+        with open('html/CVM-DadosCadastrais.htm', mode='r', encoding='utf-8') as file:
+            html_content = file.read()
 
-    # Get all FDIC CNPJs from the database
-    cnpj_list = get_all_fdic_cnpj_from_db(conn)
+        # Extract FDIC data from HTML content
+        fdic_data = extract_fdic_data(html_content)
+        parse_time = time.perf_counter() - start
+        METRICS.observe('parse', parse_time)
 
-    # Filter out the CNPJs that are already present in the database.
-    # The FDIC load from html page are in the format: [{'cnpj': '00000000000191'}, {'cnpj': '00000000000272'}, ...]
-    # And the FDIC load from database are in the format: [('00000000000191',), ('00000000000272',), ...]
-    fdic_data = [fdic for fdic in fdic_data if (fdic['cnpj'],) not in cnpj_list]
+        # Create a single connection pool, the load runs in one transaction
+        db_pool = ConnectionPool(size=1)
 
-    # Create a cursor object to execute SQL queries
-    cursor = conn.cursor()
+        try:
+            with db_pool.connection() as conn:
+                check_schema(conn)
+                start = time.perf_counter()
 
-    # Insert data into the PostgreSQL table
-    insert_sql = "INSERT INTO fdic (cnpj) VALUES (%s)"
-    for fdic in fdic_data:
-        cursor.execute(insert_sql, (fdic['cnpj'],))
+                # Insert the CNPJs that are not present in the database yet. The
+                # diff is done with a hash set or by the server, see FDIC_DIFF.
+                inserted = len(insert_new_fdic_cnpjs(conn, [fdic['cnpj'] for fdic in fdic_data]))
 
-    # Commit the transaction
-    conn.commit()
-finally:
-    # Close the database connection
-    conn.close()
+                # Queue the details of the FDICs not filled yet, the ones already
+                # in the work ledger keep their state
+                seed_work(conn, FDIC_DETAILS_STAGE, "SELECT cnpj FROM fdic WHERE name IS NULL")
+
+                # Commit the transaction
+                with METRICS.timer('db_commit'):
+                    conn.commit()
+                load_time = time.perf_counter() - start
+                METRICS.observe('db_write', load_time)
+                METRICS.count('fdic_inserted', inserted)
+        finally:
+            # Close the database connections
+            db_pool.close()
+
+        # Print the timing report of the load
+        print(f"Parsed {len(fdic_data)} CNPJs from the CVM listing in {parse_time:.3f}s")
+        print(f"Inserted {inserted} new FDICs in {load_time:.3f}s")
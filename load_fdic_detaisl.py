@@ -1,131 +1,87 @@
 from psycopg2 import sql, extensions
-from dbconnect import connect_db, get_fdic_cnpj_not_filled_from_db
-import threading
-import requests
+from dbconnect import ConnectionPool
+from dimensions import FDIC_ADMINS, FDIC_DIRECTORS, preload_fdic_dimensions
+from schema import check_schema
+from worklog import FDIC_DETAILS_STAGE, bootstrap_work, claim_work, release_stale_claims, complete_work, fail_work
+import argparse
+from fetchengine import FetchEngine, fetch_fdic_details, stream_fetch
+from htmlparse import index_by_id
+from stages import get_parse_workers, run_stage
+from metrics import METRICS, add_profile_argument, instrumented_run
+from corpus import get_source, read_fdic_details, stream_corpus
+from datetime import datetime
+
+# Convert the start date of the FDIC, failing when it is missing
+def parse_start_date(value):
+    return datetime.strptime(value, '%d/%m/%Y')
+
+# Fields of the FDIC details page: (path in the details dict, id of the span
+# element, sub tag holding the value or None, converter of the text or None).
+# A new field only needs a new entry here.
+FDIC_DETAILS_FIELDS = (
+    (('name',), 'lbNmDenomSocial', None, None),
+    (('cnpj',), 'lbNrPfPj', None, None),
+    (('administrator', 'name'), 'lbNmDenomSocialAdm', None, None),
+    (('administrator', 'cnpj'), 'lbNrPfPjAdm', None, None),
+    (('administrator', 'director'), 'lbDirFdo', None, None),
+    (('administrator', 'dir_cpf'), 'lbNrPfPjDirFdo', None, None),
+    (('administrator', 'dir_phone'), 'lbTelDirFdo', None, None),
+    (('administrator', 'dir_email'), 'lbEmailDirFdo', 'a', None),
+    (('administrator', 'dir_address'), 'lbEndDirFdo', None, None),
+    (('manager', 'name'), 'lbNmGestFdo', None, None),
+    (('manager', 'cnpj'), 'lbNrPfPjGest', None, None),
+    (('manager', 'director'), 'lbNmDirGest', None, None),
+    (('manager', 'dir_cpf'), 'lbNrPfPjDirGest', None, None),
+    (('manager', 'dir_phone'), 'lbTelDirGest', None, None),
+    (('manager', 'dir_email'), 'lbEmailDirGest', 'a', None),
+    (('manager', 'dir_address'), 'lbEndDirGest', None, None),
+    (('start_date',), 'lbDtFunc', None, parse_start_date),
+    (('status',), 'lbSitDesc', None, None),
+    (('site',), 'lbInfAdc3', None, None)
+)
+
+# Ids of the span elements holding the FDIC details
+FDIC_DETAILS_IDS = [field[1] for field in FDIC_DETAILS_FIELDS]
 
 # Function to extract data in save mode when the tag is not found
-def extract_tag_data(tag, id, soup):
-    element = soup.find(tag, id=id)
-    if element is not None:
-        return element.text
-    else:
-        return None
-
-def extract_subtag_data(tag, subtag, id, soup):
-    element = soup.find(tag, id=id)
-    if element is not None:
-        subelement = element.find(subtag)
-        return subelement.text if subelement is not None else None
-    else:
-        return None
-
-# Given a CNPJ, extract the FDIC details from the HTML page content
-def extract_fdic_details(cnpj, timeout=30):
-    from bs4 import BeautifulSoup
-    from datetime import datetime
-
-    fdic_detail_page = 'https://cvmweb.cvm.gov.br/swb/sistemas/scw/cPublica/CConsolFdo/ResultBuscaDocsFdoFIDC.aspx?Fisic_Juridic=PJ&Tipo_Partic=87&Cpfcgc_Partic=' + cnpj
-    response = requests.get(fdic_detail_page, timeout=timeout)
-
-    # Check if the request was successful
-    if response.status_code != 200:
-        # Throw an exception if the request was not successful
-        raise Exception('Failed to fetch FDIC details for CNPJ: ' + cnpj)
-
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(response.content, 'html.parser')
-
-    fdic_name = extract_tag_data(tag='span', id='lbNmDenomSocial', soup=soup)
-    fdic_cnpj = extract_tag_data(tag='span', id='lbNrPfPj', soup=soup)
-    fdic_admin = extract_tag_data(tag='span', id='lbNmDenomSocialAdm', soup=soup)
-    fdic_admin_cnpj = extract_tag_data(tag='span', id='lbNrPfPjAdm', soup=soup)
-    fdic_director = extract_tag_data(tag='span', id='lbDirFdo', soup=soup)
-    fdic_director_document = extract_tag_data(tag='span', id='lbNrPfPjDirFdo', soup=soup)
-    fdic_director_phone = extract_tag_data(tag='span', id='lbTelDirFdo', soup=soup)
-    fdic_director_email = extract_subtag_data(tag='span', subtag='a', id='lbEmailDirFdo', soup=soup)
-    fdic_director_address = extract_tag_data(tag='span', id='lbEndDirFdo', soup=soup)
-    fdic_manager = extract_tag_data(tag='span', id='lbNmGestFdo', soup=soup)
-    fdic_manager_cnpj = extract_tag_data(tag='span', id='lbNrPfPjGest', soup=soup)
-    fdic_manager_director = extract_tag_data(tag='span', id='lbNmDirGest', soup=soup)
-    fdic_manager_dir_document = extract_tag_data(tag='span', id='lbNrPfPjDirGest', soup=soup)
-    fdic_manager_dir_phone = extract_tag_data(tag='span', id='lbTelDirGest', soup=soup)
-    fdic_manager_dir_email = extract_subtag_data(tag='span', subtag='a', id='lbEmailDirGest', soup=soup)
-    fdic_manager_dir_address = extract_tag_data(tag='span', id='lbEndDirGest', soup=soup)
-    fdic_dt_start = datetime.strptime(extract_tag_data(tag='span', id='lbDtFunc', soup=soup), '%d/%m/%Y')
-    fdic_status = extract_tag_data(tag='span', id='lbSitDesc', soup=soup)
-    fdic_site = extract_tag_data(tag='span', id='lbInfAdc3', soup=soup)
-
-    return {
-        'name': fdic_name,
-        'cnpj': fdic_cnpj,
-        'administrator': {
-            'name': fdic_admin,
-            'cnpj': fdic_admin_cnpj,
-            'director': fdic_director,
-            'dir_cpf': fdic_director_document,
-            'dir_phone': fdic_director_phone,
-            'dir_email': fdic_director_email,
-            'dir_address': fdic_director_address
-        },
-        'manager': {
-            'name': fdic_manager,
-            'cnpj': fdic_manager_cnpj,
-            'director': fdic_manager_director,
-            'dir_cpf': fdic_manager_dir_document,
-            'dir_phone': fdic_manager_dir_phone,
-            'dir_email': fdic_manager_dir_email,
-            'dir_address': fdic_manager_dir_address
-        },
-        'start_date': fdic_dt_start,
-        'status': fdic_status,
-        'site': fdic_site
-    }
-
-# Get the FDIC Administrator details from the database or, if not present, insert them
-def get_or_insert_fdic_administrator(conn, fdic_admin_details):
-    try:
-        # Create a cursor object to execute SQL queries
-        cursor = conn.cursor()
-
-        # Check if the administrator with the given CNPJ is already present in the database
-        cursor.execute("SELECT name FROM fdic_admin WHERE cnpj = %s",
-                       (fdic_admin_details['cnpj'],))
-        admin_name = cursor.fetchone()
+def extract_field_data(index, id, subtag):
+    element = index.get(id)
+    if element is not None and subtag is not None:
+        element = element.find(subtag)
 
-        # If the administrator is not present, insert the details into the database
-        if admin_name is None:
-            insert_sql = "INSERT INTO fdic_admin (cnpj, name) VALUES (%s, %s)"
-            cursor.execute(
-                insert_sql, (fdic_admin_details['cnpj'], fdic_admin_details['name'],))
+    return element.text if element is not None else None
 
-        return fdic_admin_details['cnpj']
+# Parse the FDIC details from the HTML page content
+def parse_fdic_details(html_content, backend=None):
+    # Index the span elements of the fields in a single pass over the page
+    index = index_by_id(html_content, 'span', FDIC_DETAILS_IDS, backend)
 
-    finally:
-        # Close the cursor
-        cursor.close()
+    fdic_details = {'administrator': {}, 'manager': {}}
+    for path, id, subtag, converter in FDIC_DETAILS_FIELDS:
+        value = extract_field_data(index, id, subtag)
+        if converter is not None:
+            value = converter(value)
 
-# Get the FDIC Director details from the database or, if not present, insert them
-def get_or_insert_fdic_director(conn, fdic_dir_details):
-    try:
-        # Create a cursor object to execute SQL queries
-        cursor = conn.cursor()
+        # Store the value in the nested dict of the field path
+        target = fdic_details
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = value
 
-        # Check if the director with the given CPF/CNPJ is already present in the database
-        cursor.execute("SELECT name FROM fdic_director WHERE cpf = %s",
-                       (fdic_dir_details['dir_cpf'],))
-        dir_name = cursor.fetchone()
+    return fdic_details
 
-        # If the director is not present, insert the details into the database
-        if dir_name is None and fdic_dir_details['dir_cpf'] is not None:
-            insert_sql = "INSERT INTO fdic_director (cpf, name, phone, email, address) VALUES (%s, %s, %s, %s, %s)"
-            cursor.execute(insert_sql, (fdic_dir_details['dir_cpf'], fdic_dir_details['director'],
-                           fdic_dir_details['dir_phone'], fdic_dir_details['dir_email'], fdic_dir_details['dir_address'],))
+# Insert the administrator and manager of the FDIC, and their directors,
+# that are not in the dimension caches. Returns the inserted keys of each
+# cache, to be cached once the transaction is committed.
+def upsert_fdic_dimensions(conn, fdic_details):
+    companies = (fdic_details['administrator'], fdic_details['manager'])
 
-        return fdic_dir_details['dir_cpf']
+    admins = FDIC_ADMINS.upsert(conn, [(company['cnpj'], company['name']) for company in companies])
+    directors = FDIC_DIRECTORS.upsert(conn, [(company['dir_cpf'], company['director'], company['dir_phone'],
+                                              company['dir_email'], company['dir_address'])
+                                             for company in companies])
 
-    finally:
-        # Close the cursor
-        cursor.close()
+    return ((FDIC_ADMINS, admins), (FDIC_DIRECTORS, directors))
 
 # Update FDIC details in the database
 def update_fdic_details_in_db(conn, cnpj, fdic_details):
@@ -133,16 +89,14 @@ def update_fdic_details_in_db(conn, cnpj, fdic_details):
         # Create a cursor object to execute SQL queries
         cursor = conn.cursor()
 
-        # Get the administrator and director CNPJs from the database
-        admin_cnpj = get_or_insert_fdic_administrator(
-            conn, fdic_details['administrator'])
-        admin_dir_cpf = get_or_insert_fdic_director(conn, fdic_details['administrator'])
+        # Insert the administrator, manager and directors not known yet
+        inserted = upsert_fdic_dimensions(conn, fdic_details)
+
+        admin_cnpj = fdic_details['administrator']['cnpj']
+        admin_dir_cpf = fdic_details['administrator']['dir_cpf']
+        manager_cnpj = fdic_details['manager']['cnpj']
+        manager_dir_cpf = fdic_details['manager']['dir_cpf']
 
-        # Get the manager and director CNPJs from the database
-        manager_cnpj = get_or_insert_fdic_administrator(
-            conn, fdic_details['manager'])
-        manager_dir_cpf = get_or_insert_fdic_director(conn, fdic_details['manager'])
-        
         # Update the FDIC details in the database
         update_sql = """
             UPDATE fdic
@@ -169,53 +123,95 @@ def update_fdic_details_in_db(conn, cnpj, fdic_details):
         ))
 
         # Commit the transaction
-        conn.commit()
+        with METRICS.timer('db_commit'):
+            conn.commit()
+
+        # Cache the new keys only once they are committed
+        for cache, keys in inserted:
+            cache.add(keys)
 
     finally:
         # Close the cursor
         cursor.close()
 
-def process_fdic_detail(cnpj):
-    try:
-        # Extract FDIC details for the given CNPJ
-        fdic_details = extract_fdic_details(cnpj, timeout)
-
-        # Update FDIC details in the database
-        update_fdic_details_in_db(conn, cnpj, fdic_details)
+# Parse the FDIC details page of the given CNPJ, used by the parser processes
+def parse_fdic_detail_page(cnpj, html_content):
+    return parse_fdic_details(html_content)
 
-    except Exception as e:
-        print(f"Failed to extract FDIC details for CNPJ: {cnpj}")
-        print(e)
-
-    finally:
-        # Release a permit from the semaphore
-        semaphore.release()
+# Update the parsed FDIC details in the database using a connection of its own
+def store_fdic_detail(cnpj, fdic_details):
+    with db_pool.connection() as conn:
+        with METRICS.timer('db_write'):
+            update_fdic_details_in_db(conn, cnpj, fdic_details)
 
-conn = connect_db()
-timeout = 30
-batch_size = 20
-# Create a semaphore with a maximum of batch_size permits
-semaphore = threading.Semaphore(batch_size)
+        # Skip the FDIC on the next runs
+        complete_work(conn, FDIC_DETAILS_STAGE, cnpj)
 
-# Create a list to store the threads
-threads = []
+    METRICS.count('fdic_details_done')
 
-cnpjs = get_fdic_cnpj_not_filled_from_db(conn)
+# Print the failure to fetch, parse or store the details of a FDIC and
+# record it in the work ledger, to retry it later or quarantine it
+def report_failure(cnpj, error):
+    METRICS.count('fdic_details_failed')
+    print(f"Failed to extract FDIC details for CNPJ: {cnpj}")
+    print(error)
 
-# Iterate over the CNPJs in the batch
-for cnpj in cnpjs:
-    # Acquire a permit from the semaphore
-    semaphore.acquire()
-
-    # Create a thread to execute the task
-    thread = threading.Thread(target=process_fdic_detail, args=(cnpj[0],))
-
-    # Start the thread
-    thread.start()
-
-    # Add the thread to the list
-    threads.append(thread)
+    try:
+        with db_pool.connection() as conn:
+            fail_work(conn, FDIC_DETAILS_STAGE, cnpj, error)
+    except Exception as e:
+        print(f"Failed to record the failure of CNPJ: {cnpj}")
+        print(e)
 
-# Wait for all threads to complete
-for thread in threads:
-    thread.join()
+if __name__ == '__main__':
+    # Command line options, see --help
+    parser = argparse.ArgumentParser(description='Load the details of the FDICs not filled yet')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    timeout = 30
+    batch_size = 20
+
+    # Number of parser processes of the pipelined mode, see PARSE_WORKERS
+    parse_workers = get_parse_workers()
+
+    # Create a connection pool with one connection per worker thread, and
+    # one more to stream the work list
+    db_pool = ConnectionPool(size=batch_size + 1)
+
+    # Fetch the pages asynchronously, with at most batch_size requests in flight
+    engine = FetchEngine(per_host=batch_size, timeout=timeout)
+
+    # Record the metrics of the run, see METRICS_DIR and METRICS_PORT
+    with instrumented_run('load_fdic_details', args.profile):
+        try:
+            # Claim the FDICs still to be filled from the work ledger. The
+            # ledger is filled from the FDICs without a name on the first run.
+            with db_pool.connection() as conn:
+                check_schema(conn)
+                bootstrap_work(conn, FDIC_DETAILS_STAGE, "SELECT cnpj FROM fdic WHERE name IS NULL")
+
+                # Give back the items claimed by the runs that died
+                release_stale_claims(conn, FDIC_DETAILS_STAGE)
+
+                # Cache the administrators and directors already loaded
+                preload_fdic_dimensions(conn)
+
+            # Stream the work list from the database with a connection of its
+            # own, while the workers store the results with the others
+            with db_pool.connection() as reader:
+                cnpjs = claim_work(reader, FDIC_DETAILS_STAGE)
+
+                if get_source() == 'corpus':
+                    # Read the pages saved by get-html instead of fetching them
+                    fetched = stream_corpus(cnpjs, read_fdic_details)
+                else:
+                    fetched = stream_fetch(cnpjs, fetch_fdic_details, engine)
+
+                # Parse the pages in parse_workers processes, or in the writer
+                # threads without them, and store them in batch_size threads
+                run_stage(fetched, parse_fdic_detail_page, store_fdic_detail, report_failure,
+                          parse_workers, write_workers=batch_size)
+        finally:
+            # Close the database connections
+            db_pool.close()
@@ -1,36 +1,22 @@
-import threading
+import argparse
 from psycopg2 import sql, extensions
-from dbconnect import connect_db
-import concurrent.futures
-import requests
-
-# Given a report id, extract the FDIC monthly report
-def extract_fdic_report(report_id):
-    from bs4 import BeautifulSoup
-    import base64
+from dbconnect import ConnectionPool
+from schema import check_schema, create_report_data_partitions
+from worklog import FDIC_REPORT_DATA_STAGE, bootstrap_work, claim_work, release_stale_claims, complete_work, fail_work
+from bulkload import write_report_data
+from htmlparse import parse_html
+from amounts import parse_brl_amounts
+from stages import get_parse_workers, run_stage
+from metrics import METRICS, add_profile_argument, instrumented_run
+from corpus import get_source, read_fdic_report_data, stream_corpus
+from fetchengine import FetchEngine, fetch_fdic_report_document, stream_fetch
+
+# Parse the FDIC monthly report from the decoded document content
+def parse_fdic_report(report_id, html_content, backend=None):
     import re
-    import locale
 
-    locale.setlocale(locale.LC_NUMERIC, 'pt_BR.UTF8')
-    locale.setlocale(locale.LC_MONETARY, 'pt_BR.UTF8')
-    conv = locale.localeconv()
-    currency_symbol = conv['currency_symbol']
-
-    fdic_report_api = 'https://fnet.bmfbovespa.com.br/fnet/publico/exibirDocumento?cvm=true&id=' + str(report_id)
-    response = requests.get(fdic_report_api, stream=True, verify=False)
-
-    response.raise_for_status()
-    # Check if the request was successful
-    if response.status_code != 200:
-        # Throw an exception if the request was not successful
-        raise Exception('Failed to fetch FDIC report: ' + report_id)
-
-    html_content = ''
-    for chunk in response.iter_content(chunk_size=8192, decode_unicode=True):
-        html_content += chunk
-
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(base64.b64decode(html_content), 'html.parser')
+    # Parse the HTML content with the configured parser backend
+    soup = parse_html(bytes(html_content), backend)
     tables = soup.find_all('table')
 
     # Remove the first table containing the report header
@@ -41,6 +27,9 @@ def extract_fdic_report(report_id):
 
     report_rows = []
 
+    # Text of the value of each report row, converted in one batch at the end
+    value_texts = []
+
     # Regex to extract the asset name from the cell content
     desc_report_patern = re.compile(r"((\d*\s*-\s*)|([a-z](\.\d*)*\){1}?\s*))(.*)")
     desc_group = 5
@@ -52,9 +41,8 @@ def extract_fdic_report(report_id):
         # if the first column has the style like "padding-left:20px", it's a first level asset
         if 'padding-left:20px' == cols[0].get('style'):
             asset = desc_report_patern.match(cols[0].text.strip()).group(desc_group)
-            value_str = cols[1].find('span', class_='dado-valores').text
-            value = locale.atof(value_str[len(currency_symbol) + 1:])
-            report_rows.append({'report_id': report_id, 'type': 'asset', 'category': 'asset', 'name': asset, 'value': value})
+            value_texts.append(cols[1].find('span', class_='dado-valores').text)
+            report_rows.append({'report_id': report_id, 'type': 'asset', 'category': 'asset', 'name': asset})
 
     # Extract from the portfolio by segment table the data
     segment_rows = tables.pop(0).find_all('tr')
@@ -69,98 +57,116 @@ def extract_fdic_report(report_id):
             category = desc_report_patern.match(cols[0].text.strip()).group(desc_group)
         elif 'padding-left:40px' == cols[0].get('style'):
             segment = desc_report_patern.match(cols[0].text.strip()).group(desc_group)
-            value_str = cols[1].find('span', class_='dado-valores').text
-            value = value = locale.atof(value_str[len(currency_symbol) + 1:])
-            report_rows.append({'report_id': report_id, 'type': 'segment', 'category': category, 'name': segment, 'value': value})
+            value_texts.append(cols[1].find('span', class_='dado-valores').text)
+            report_rows.append({'report_id': report_id, 'type': 'segment', 'category': category, 'name': segment})
 
-    return report_rows
+    # Convert the "R$ 1.234,56" values without the process-wide locale
+    for report_row, value in zip(report_rows, parse_brl_amounts(value_texts)):
+        report_row['value'] = value
 
-# Get all reports from the database where the data was not filled
-def get_fdic_reports_not_filled_from_db(conn):
-    try:
-        # Create a cursor object to execute SQL queries
-        cursor = conn.cursor()
+    return report_rows
 
-        # Select all reports from the fdic_report table
-        cursor.execute("""
+# Select all reports from the fdic_report table where the data was not filled.
+# The data of a report is only looked up in the partition of its month, or in
+# the default partition for the reports without a reference date.
+FDIC_REPORTS_NOT_FILLED_SQL = """
 SELECT r.id
   FROM fdic_report r
-    LEFT OUTER JOIN fdic_report_data rd
-	  ON (r.id = rd.id)
- WHERE rd.id IS NULL""")
-
-        # Fetch all rows from the result
-        reports = cursor.fetchall()
-
-    finally:
-        # Close the cursor
-        cursor.close()
-
-    return reports
+ WHERE NOT EXISTS (SELECT 1 FROM fdic_report_data rd
+                    WHERE rd.id = r.id
+                      AND rd.ref_date = r.ref_date)
+   AND (r.ref_date IS NOT NULL
+        OR NOT EXISTS (SELECT 1 FROM fdic_report_data rd
+                        WHERE rd.id = r.id
+                          AND rd.ref_date IS NULL))"""
 
 # Insert the FDIC report data in the database
 def insert_report_data(conn, report_data):
-    try:
-        # Create a cursor object to execute SQL queries
-        cursor = conn.cursor()
-
-        insert_sql = """
-            INSERT INTO fdic_report_data (id, type, category, name, value)
-            VALUES (%s, %s, %s, %s, %s)
-        """
-
-        # Insert the report data in the database
-        for data in report_data:
-            cursor.execute(
-                insert_sql, (data['report_id'], data['type'], data['category'], data['name'], data['value'],))
-        
-        # Commit the changes to the database
+    # Write the report data in bulk, see REPORT_DATA_WRITER
+    with METRICS.timer('db_write'):
+        write_report_data(conn, report_data)
+
+    # Commit the changes to the database
+    with METRICS.timer('db_commit'):
         conn.commit()
-    finally:
-        # Close the cursor
-        cursor.close()
 
-def process_fdic_report_data(report_id):
-    try:
-        # Extract the FDIC report data for the given report id
-        fdic_report_data = extract_fdic_report(report_id)
+    METRICS.count('report_data_rows', len(report_data))
 
-        # Insert the FDIC report data in the database
+# Insert the parsed FDIC report data in the database using a connection of its own
+def store_fdic_report_data(report_id, fdic_report_data):
+    with db_pool.connection() as conn:
         insert_report_data(conn, fdic_report_data)
 
-    except Exception as e:
-        print(f"Failed to extract FDIC report data for report_id: {report_id}")
-        print(e)
-
-    finally:
-        # Release the permit back to the semaphore
-        semaphore.release()
-
-conn = connect_db()
-
-report_ids = get_fdic_reports_not_filled_from_db(conn)
-batch_size = 20
-# Create a semaphore with a maximum of batch_size permits
-semaphore = threading.Semaphore(batch_size)
+        # Skip the report on the next runs
+        complete_work(conn, FDIC_REPORT_DATA_STAGE, report_id)
 
-# Create a list to store the threads
-threads = []
+    METRICS.count('report_data_done')
 
-# Iterate over the report ids in the batch
-for report_id in report_ids:
-    # Acquire a permit from the semaphore
-    semaphore.acquire()
+# Print the failure to fetch, parse or store the data of a report and
+# record it in the work ledger, to retry it later or quarantine it
+def report_failure(report_id, error):
+    METRICS.count('report_data_failed')
+    print(f"Failed to extract FDIC report data for report_id: {report_id}")
+    print(error)
 
-    # Create a thread to execute the task
-    thread = threading.Thread(target=process_fdic_report_data, args=(report_id[0],))
-
-    # Start the thread
-    thread.start()
-
-    # Add the thread to the list
-    threads.append(thread)
-
-# Wait for all threads to complete
-for thread in threads:
-    thread.join()
+    try:
+        with db_pool.connection() as conn:
+            fail_work(conn, FDIC_REPORT_DATA_STAGE, report_id, error)
+    except Exception as e:
+        print(f"Failed to record the failure of report_id: {report_id}")
+        print(e)
 
+if __name__ == '__main__':
+    # Command line options, see --help
+    parser = argparse.ArgumentParser(description='Load the data of the FDIC reports not filled yet')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    batch_size = 20
+
+    # Number of parser processes of the pipelined mode, see PARSE_WORKERS
+    parse_workers = get_parse_workers()
+
+    # Create a connection pool with one connection per worker thread, and
+    # one more to stream the work list
+    db_pool = ConnectionPool(size=batch_size + 1)
+
+    # Fetch the documents asynchronously, with at most batch_size requests in flight
+    engine = FetchEngine(per_host=batch_size)
+
+    # Record the metrics of the run, see METRICS_DIR and METRICS_PORT
+    with instrumented_run('load_fdic_reports', args.profile):
+        try:
+            # Claim the reports still to be filled from the work ledger. The
+            # ledger is filled with the anti-join of the reports on the first
+            # run, after that the new reports are queued as they are discovered.
+            with db_pool.connection() as conn:
+                check_schema(conn)
+
+                # Create the partitions of the new report months before the
+                # workers write to them
+                create_report_data_partitions(conn)
+
+                bootstrap_work(conn, FDIC_REPORT_DATA_STAGE, FDIC_REPORTS_NOT_FILLED_SQL)
+
+                # Give back the items claimed by the runs that died
+                release_stale_claims(conn, FDIC_REPORT_DATA_STAGE)
+
+            # Stream the work list from the database with a connection of its
+            # own, while the workers store the results with the others
+            with db_pool.connection() as reader:
+                report_ids = claim_work(reader, FDIC_REPORT_DATA_STAGE)
+
+                if get_source() == 'corpus':
+                    # Read the documents saved by get-html instead of fetching them
+                    fetched = stream_corpus(report_ids, read_fdic_report_data)
+                else:
+                    fetched = stream_fetch(report_ids, fetch_fdic_report_document, engine)
+
+                # Parse the documents in parse_workers processes, or in the
+                # writer threads without them, and store them in batch_size threads
+                run_stage(fetched, parse_fdic_report, store_fdic_report_data, report_failure,
+                          parse_workers, write_workers=batch_size)
+        finally:
+            # Close the database connections
+            db_pool.close()
@@ -1,46 +1,28 @@
-import threading
+import argparse
+import functools
+import os
 from psycopg2 import sql, extensions
-from dbconnect import connect_db, get_all_fdic_cnpj_from_db
-
-# Given a CNPJ, extract the FDIC reports ID's from the REST API request
-def extract_fdic_reports(cnpj):
-    import requests
-    import json
-    from datetime import datetime
-
-    # Define the URL for the FDIC reports API
-    report_start = 0
-    reports_counter = 0
-    has_more_reports = True
+from psycopg2.extras import execute_values
+from dbconnect import ConnectionPool, get_all_fdic_cnpj_from_db
+from worklog import FDIC_REPORT_DATA_STAGE, enqueue_work
+from schema import check_schema
+from fetchengine import FetchEngine, fetch_fdic_reports, stream_fetch, parse_delivery_date, parse_reference_date
+from corpus import get_source, read_fdic_reports_by_cnpj, stream_corpus
+from stages import run_stage
+from metrics import METRICS, add_profile_argument, instrumented_run
+
+# Extract the FDIC reports from the JSON pages of the reports API
+def parse_fdic_reports(cnpj, pages):
     reports = []
 
-    while has_more_reports:
-        # Load the FDIC reports () from the API
-        fdic_reports_api = 'https://fnet.bmfbovespa.com.br/fnet/publico/pesquisarGerenciadorDocumentosDados?d=2&l=200&o[0][dataEntrega]=desc&idCategoriaDocumento=6&idTipoDocumento=40&idEspecieDocumento=0&cnpjFundo=' + cnpj + '&s=' + str(
-            report_start)
-
-        # Send a GET request to the API
-        response = requests.get(fdic_reports_api, verify=False)
-
-        # Check if the request was successful
-        if response.status_code != 200:
-            # Throw an exception if the request was not successful
-            raise Exception('Failed to fetch FDIC reports for CNPJ: ' + cnpj)
-
-        # Parse the JSON content
-        fdic_reports = json.loads(response.content)
-        reports_list = fdic_reports['data']
-
+    for fdic_reports in pages:
         # Extract the report ID's from the JSON content
-        for report in reports_list:
-            reports_counter += 1
+        for report in fdic_reports['data']:
             report_id = report['id']
             report_category = report['categoriaDocumento']
             report_type = report['tipoDocumento']
-            report_ref_date = datetime.strptime(
-                report['dataReferencia'], '%m/%Y')
-            report_delivery_date = datetime.strptime(
-                report['dataEntrega'], '%d/%m/%Y %H:%M')
+            report_ref_date = parse_reference_date(report['dataReferencia'])
+            report_delivery_date = parse_delivery_date(report['dataEntrega'])
             report_status = report['status']
             report_desc_status = report['descricaoStatus']
             report_analyzed = report['analisado'] == 'S'
@@ -57,86 +39,165 @@ def extract_fdic_reports(cnpj):
                             'analyzed': report_analyzed,
                             'status_doc': report_status_doc})
 
-        # Check if there are more reports to fetch
-        total_reports = fdic_reports['recordsTotal']
-        if reports_counter >= total_reports:
-            has_more_reports = False
-        else:
-            has_more_reports = True
-            report_start += len(reports_list)
-
     return reports
 
-# Insert the FDIC reports in the database
-def insert_reports(conn, fdic_reports):
+# Insert the FDIC reports in the database in batches of batch_size reports,
+# one commit per batch. Returns the number of inserted and skipped reports,
+# and the ids of the inserted ones. With claim the data of the new reports
+# is queued as claimed, for a run loading it right away.
+def insert_reports(conn, fdic_reports, batch_size=1000, claim=False):
+    inserted_ids = []
+
     try:
         # Create a cursor object to execute SQL queries
         cursor = conn.cursor()
 
-        for report in fdic_reports:
-            # Check if the report already exists in the database
-            cursor.execute(
-                "SELECT * FROM fdic_report WHERE id = %s", (report['report_id'],))
+        # Reports already in the database are skipped by the primary key
+        insert_sql = """
+            INSERT INTO fdic_report (cnpj, id, category, type, ref_date, delivery_date, status, desc_status, analyzed, status_doc)
+            VALUES %s
+            ON CONFLICT (id) DO NOTHING
+            RETURNING id
+        """
 
-            # Fetch the first row from the result
-            row = cursor.fetchone()
+        for start in range(0, len(fdic_reports), batch_size):
+            rows = [(report['fdic_cnpj'], report['report_id'], report['category'], report['type'],
+                     report['reference_date'], report['delivery_date'], report['status'],
+                     report['desc_status'], report['analyzed'], report['status_doc'])
+                    for report in fdic_reports[start:start + batch_size]]
 
-            if row is None:
-                # Insert the report in the database
-                cursor.execute("INSERT INTO fdic_report (cnpj, id, category, type, ref_date, delivery_date, status, desc_status, analyzed, status_doc) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", (
-                    report['fdic_cnpj'], report['report_id'], report['category'], report['type'], report['reference_date'], report['delivery_date'], report['status'], report['desc_status'], report['analyzed'], report['status_doc']))
+            # Insert the batch and count the reports actually inserted
+            new_ids = execute_values(cursor, insert_sql, rows, page_size=batch_size, fetch=True)
 
-                # Commit the changes to the database
-                conn.commit()
+            # Queue the data of the new reports in the same transaction
+            enqueue_work(conn, FDIC_REPORT_DATA_STAGE, (row[0] for row in new_ids), claim=claim)
+
+            # Commit the changes to the database
+            conn.commit()
+            inserted_ids += [row[0] for row in new_ids]
 
     finally:
         # Close the cursor
         cursor.close()
 
-def process_fdic_report(cnpj):
-    try:
-        # Extract the FDIC reports for the given CNPJ
-        fdic_reports = extract_fdic_reports(cnpj)
+    return {'inserted': len(inserted_ids), 'skipped': len(fdic_reports) - len(inserted_ids), 'ids': inserted_ids}
 
-        # Insert the FDIC reports in the database
-        insert_reports(conn, fdic_reports)
+# Get the watermark (delivery date, report id) of the latest report of each FDIC
+def get_watermarks_from_db(conn):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
 
-    except Exception as e:
-        print(f"Failed to extract FDIC report for CNPJ: {cnpj}")
-        print(e)
+        cursor.execute("SELECT cnpj, delivery_date, report_id FROM fdic_report_watermark")
+        watermarks = {cnpj: (delivery_date, report_id) for cnpj, delivery_date, report_id in cursor.fetchall()}
 
     finally:
-        # Release a permit from the semaphore
-        semaphore.release()
-
+        # Close the cursor
+        cursor.close()
 
-# Connect to the database
-conn = connect_db()
+    return watermarks
 
-batch_size = 20
-# Create a semaphore with a maximum of batch_size permits
-semaphore = threading.Semaphore(batch_size)
+# Move the watermark of the FDIC to its latest report, if it is more recent
+def update_watermark(conn, cnpj, fdic_reports):
+    if len(fdic_reports) == 0:
+        return
 
-# Create a list to store the threads
-threads = []
+    latest = max(fdic_reports, key=lambda report: (report['delivery_date'], report['report_id']))
 
-# Get all FDIC CNPJs from the database
-cnpjs = get_all_fdic_cnpj_from_db(conn)
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
 
-# Iterate over the CNPJs in the batch
-for cnpj in cnpjs:
-    # Acquire a permit from the semaphore
-    semaphore.acquire()
+        cursor.execute("""
+            INSERT INTO fdic_report_watermark (cnpj, delivery_date, report_id)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (cnpj) DO UPDATE
+               SET delivery_date = EXCLUDED.delivery_date,
+                   report_id = EXCLUDED.report_id,
+                   updated_at = now()
+             WHERE fdic_report_watermark.delivery_date <= EXCLUDED.delivery_date
+        """, (cnpj, latest['delivery_date'], latest['report_id']))
 
-    # Create a thread to execute the task
-    thread = threading.Thread(target=process_fdic_report, args=(cnpj[0],))
+        # Commit the changes to the database
+        conn.commit()
 
-    # Start the thread
-    thread.start()
+    finally:
+        # Close the cursor
+        cursor.close()
 
-    # Add the thread to the list
-    threads.append(thread)
+# The reports saved by get-html are already extracted from the API pages
+def parse_corpus_reports(cnpj, reports):
+    return reports
 
-# Wait for all threads to complete
-for thread in threads:
-    thread.join()
+# Insert the parsed reports of a FDIC in the database using a connection of its own
+def store_fdic_reports(cnpj, fdic_reports, track_watermark=True):
+    with db_pool.connection() as conn:
+        with METRICS.timer('db_write'):
+            counts = insert_reports(conn, fdic_reports)
+
+        # The watermark only moves once all the reports are stored
+        if track_watermark:
+            update_watermark(conn, cnpj, fdic_reports)
+
+    print(f"Loaded reports for CNPJ: {cnpj} - {counts['inserted']} inserted, {counts['skipped']} skipped")
+    METRICS.count('fdic_reports_done')
+    METRICS.count('reports_inserted', counts['inserted'])
+    METRICS.count('reports_skipped', counts['skipped'])
+
+# Print the failure to fetch, parse or store the reports of a FDIC
+def report_failure(cnpj, error):
+    METRICS.count('fdic_reports_failed')
+    print(f"Failed to extract FDIC report for CNPJ: {cnpj}")
+    print(error)
+
+
+if __name__ == '__main__':
+    # Command line options, see --help
+    parser = argparse.ArgumentParser(description='Discover the reports of the FDICs')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    batch_size = 20
+
+    # Incremental discovery stops at the reports already known, set
+    # REPORT_DISCOVERY=full to page through all the reports of every FDIC
+    full_sweep = os.getenv("REPORT_DISCOVERY", "incremental") == "full"
+
+    # Create a connection pool with one connection per worker thread, and
+    # one more to stream the work list
+    db_pool = ConnectionPool(size=batch_size + 1)
+
+    # Fetch the report pages asynchronously, with at most batch_size requests in flight
+    engine = FetchEngine(per_host=batch_size)
+
+    # Record the metrics of the run, see METRICS_DIR and METRICS_PORT
+    with instrumented_run('load_fdic_reports_id', args.profile):
+        try:
+            # Check the schema and get the discovery watermarks
+            with db_pool.connection() as conn:
+                check_schema(conn)
+                watermarks = None if full_sweep else get_watermarks_from_db(conn)
+
+            # Stream the work list from the database with a connection of its
+            # own, while the workers store the results with the others
+            with db_pool.connection() as reader:
+                cnpjs = get_all_fdic_cnpj_from_db(reader)
+
+                if get_source() == 'corpus':
+                    # Read the reports saved by get-html instead of fetching them
+                    reports_by_cnpj = read_fdic_reports_by_cnpj()
+                    fetched = stream_corpus((cnpj[0] for cnpj in cnpjs if cnpj[0] in reports_by_cnpj), reports_by_cnpj.get)
+                    parse = parse_corpus_reports
+                    track_watermark = False
+                else:
+                    fetch = functools.partial(fetch_fdic_reports, watermarks=watermarks)
+                    fetched = stream_fetch((cnpj[0] for cnpj in cnpjs), fetch, engine)
+                    parse = parse_fdic_reports
+                    track_watermark = True
+
+                # Parse and store the reports in batch_size worker threads as the pages arrive
+                store = functools.partial(store_fdic_reports, track_watermark=track_watermark)
+                run_stage(fetched, parse, store, report_failure, write_workers=batch_size)
+        finally:
+            # Close the database connections
+            db_pool.close()
@@ -0,0 +1,235 @@
+from dotenv import load_dotenv
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Upper bounds in seconds of the latency histogram buckets, from 1ms to 2min
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Latency histogram with fixed buckets. Quantiles are estimated as the upper
+# bound of the bucket they fall in, which is enough to tell a 5ms stage from
+# a 500ms one without keeping every sample.
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, self.max), 6)
+
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'sum': round(self.sum, 6),
+                'mean': round(self.sum / self.count, 6) if self.count else None,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'max': round(self.max, 6)}
+
+# Thread-safe registry of the metrics of a run: counters (items, bytes,
+# retries), latency histograms of the stages, and gauges (queue depths)
+# with the highest value seen.
+class Metrics:
+    def __init__(self):
+        self.start = time.time()
+        self.counters = collections.Counter()
+        self.histograms = {}
+        self.gauges = {}
+        self.gauge_max = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+            self.gauge_max[name] = max(self.gauge_max.get(name, value), value)
+
+    # Time the block as one observation of the stage
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def summary(self):
+        with self._lock:
+            elapsed = time.time() - self.start
+            return {'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.start)),
+                    'elapsed': round(elapsed, 3),
+                    'counters': dict(self.counters),
+                    'rates': {name: round(value / elapsed, 3) for name, value in self.counters.items()} if elapsed > 0 else {},
+                    'latency': {name: histogram.summary() for name, histogram in self.histograms.items()},
+                    'gauges': {name: {'last': value, 'max': self.gauge_max[name]} for name, value in self.gauges.items()}}
+
+    # Render the metrics in the Prometheus text exposition format
+    def prometheus_text(self, prefix='precatorios'):
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{prefix}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                lines.append(f"{prefix}_{name} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+# Metrics of the running process, shared by all the stages
+METRICS = Metrics()
+
+# Serve the metrics in the Prometheus text format on the port of the host,
+# from a daemon thread. Only local clients can connect by default. Returns
+# the server, to be shut down at the end of the run.
+def start_metrics_server(port, metrics=METRICS, host='127.0.0.1'):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+# Sampling profiler of all the threads: the stack of every thread is taken
+# interval seconds apart, so the worker threads of the hot stage are
+# profiled too, unlike with cProfile. The samples are written as collapsed
+# stacks, the input format of the flame graph tools.
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, mode='w', encoding='utf-8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+# Add the --profile switch to the argument parser of a loader
+def add_profile_argument(parser):
+    parser.add_argument('--profile', nargs='?', const='sample', choices=('sample', 'cprofile'),
+                        help='profile the run: sample all the threads (default) or cProfile the main thread')
+
+# Instrument a loader run: serve the metrics on METRICS_PORT of METRICS_HOST
+# (default 127.0.0.1) when the port is set, profile the run when asked, and
+# write the JSON summary of the metrics to METRICS_DIR (default metrics) at
+# the end, even when the run fails.
+@contextmanager
+def instrumented_run(name, profile=None, metrics=METRICS):
+    folder = os.getenv("METRICS_DIR", "metrics")
+    port = os.getenv("METRICS_PORT")
+    host = os.getenv("METRICS_HOST", "127.0.0.1")
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    os.makedirs(folder, exist_ok=True)
+
+    server = start_metrics_server(int(port), metrics, host) if port else None
+
+    profiler = None
+    if profile == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == 'sample':
+        profiler = SamplingProfiler()
+        profiler.start()
+
+    try:
+        yield metrics
+    finally:
+        if profile == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(os.path.join(folder, f"{name}-{stamp}.prof"))
+        elif profile == 'sample':
+            profiler.stop()
+            profiler.write(os.path.join(folder, f"{name}-{stamp}.stacks"))
+
+        summary = metrics.summary()
+        summary['run'] = name
+        with open(os.path.join(folder, f"{name}-{stamp}.json"), mode='w', encoding='utf-8') as file:
+            json.dump(summary, file, indent=2)
+
+        if server is not None:
+            server.shutdown()
@@ -0,0 +1,33 @@
+import argparse
+import os
+from corpus import CORPUS_DIR, DOCUMENT_KINDS, FileCorpus, StoreCorpus
+
+# Copy the documents of the one file per document layout into the blob
+# stores. Documents already in the stores are skipped, so the migration can
+# be resumed. With --delete the files are removed once stored.
+parser = argparse.ArgumentParser(description='Migrate the get-html corpus to packed blob stores')
+parser.add_argument('--folder', default=CORPUS_DIR, help='folder of the corpus')
+parser.add_argument('--delete', action='store_true', help='delete the files once stored')
+args = parser.parse_args()
+
+files = FileCorpus(args.folder)
+stores = StoreCorpus(args.folder)
+
+try:
+    for kind in DOCUMENT_KINDS:
+        migrated = 0
+        skipped = 0
+
+        for id in files.list_ids(kind):
+            if stores.exists(kind, id):
+                skipped += 1
+            else:
+                stores.write(kind, id, files.read(kind, id))
+                migrated += 1
+
+            if args.delete:
+                os.remove(files.path(kind, id))
+
+        print(f"{kind}: {migrated} documents migrated, {skipped} already stored")
+finally:
+    stores.close()
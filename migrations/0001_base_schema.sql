@@ -0,0 +1,46 @@
+-- Base schema of the FDIC tables. Tables created by hand before the
+-- migrations are kept as they are.
+
+CREATE TABLE IF NOT EXISTS fdic_admin (
+    cnpj varchar PRIMARY KEY,
+    name varchar
+);
+
+CREATE TABLE IF NOT EXISTS fdic_director (
+    cpf varchar PRIMARY KEY,
+    name varchar,
+    phone varchar,
+    email varchar,
+    address varchar
+);
+
+CREATE TABLE IF NOT EXISTS fdic (
+    cnpj varchar PRIMARY KEY,
+    name varchar,
+    admin_cnpj varchar,
+    admin_dir_cpf varchar,
+    manager_cnpj varchar,
+    manager_dir_cpf varchar,
+    start_date date,
+    status varchar,
+    site varchar
+);
+
+CREATE TABLE IF NOT EXISTS fdic_report (
+    id bigint PRIMARY KEY,
+    cnpj varchar NOT NULL REFERENCES fdic (cnpj),
+    category varchar,
+    type varchar,
+    ref_date date,
+    delivery_date timestamp,
+    status varchar,
+    desc_status varchar,
+    analyzed boolean,
+    status_doc varchar
+);
+
+-- FDICs whose details were not loaded yet
+CREATE INDEX IF NOT EXISTS fdic_not_filled_idx ON fdic (cnpj) WHERE name IS NULL;
+
+-- Time series of the reports of a FDIC
+CREATE INDEX IF NOT EXISTS fdic_report_cnpj_ref_date_idx ON fdic_report (cnpj, ref_date);
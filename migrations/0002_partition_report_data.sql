@@ -0,0 +1,66 @@
+-- Partition fdic_report_data by the reference month of the report. An
+-- existing unpartitioned table is copied into the partitioned one.
+
+DO $$
+BEGIN
+    IF to_regclass('fdic_report_data') IS NOT NULL
+       AND (SELECT relkind FROM pg_class WHERE oid = to_regclass('fdic_report_data')) = 'r' THEN
+        ALTER TABLE fdic_report_data RENAME TO fdic_report_data_unpartitioned;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS fdic_report_data (
+    id bigint NOT NULL,
+    type varchar,
+    category varchar,
+    name varchar,
+    value numeric,
+    ref_date date
+) PARTITION BY RANGE (ref_date);
+
+-- Rows of the months without a partition yet, or of unknown reports
+CREATE TABLE IF NOT EXISTS fdic_report_data_default PARTITION OF fdic_report_data DEFAULT;
+
+-- Data of a report, used to skip the reports already loaded
+CREATE INDEX IF NOT EXISTS fdic_report_data_id_idx ON fdic_report_data (id);
+
+-- Create the partition of the month, moving its rows out of the default
+-- partition. Returns false when the partition already exists.
+CREATE OR REPLACE FUNCTION create_fdic_report_data_partition(month date) RETURNS boolean AS $$
+DECLARE
+    month_start date := date_trunc('month', month)::date;
+    month_end date := (date_trunc('month', month) + interval '1 month')::date;
+    partition_name text := 'fdic_report_data_' || to_char(month, 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN false;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE fdic_report_data INCLUDING DEFAULTS)', partition_name);
+    EXECUTE format('WITH moved AS (DELETE FROM fdic_report_data_default WHERE ref_date >= %L AND ref_date < %L RETURNING *) '
+                   'INSERT INTO %I SELECT * FROM moved', month_start, month_end, partition_name);
+    EXECUTE format('ALTER TABLE fdic_report_data ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   partition_name, month_start, month_end);
+
+    RETURN true;
+END;
+$$ LANGUAGE plpgsql;
+
+-- One partition per month of the known reports
+SELECT create_fdic_report_data_partition(month)
+  FROM (SELECT DISTINCT date_trunc('month', ref_date)::date AS month
+          FROM fdic_report
+         WHERE ref_date IS NOT NULL) AS months;
+
+DO $$
+BEGIN
+    IF to_regclass('fdic_report_data_unpartitioned') IS NOT NULL THEN
+        INSERT INTO fdic_report_data (id, type, category, name, value, ref_date)
+        SELECT rd.id, rd.type, rd.category, rd.name, rd.value, r.ref_date
+          FROM fdic_report_data_unpartitioned rd
+            LEFT OUTER JOIN fdic_report r
+              ON (r.id = rd.id);
+
+        DROP TABLE fdic_report_data_unpartitioned;
+    END IF;
+END $$;
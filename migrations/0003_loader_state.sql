@@ -0,0 +1,27 @@
+-- State tables of the loaders: report discovery watermarks and work ledger
+
+CREATE TABLE IF NOT EXISTS fdic_report_watermark (
+    cnpj varchar PRIMARY KEY,
+    delivery_date timestamp NOT NULL,
+    report_id bigint NOT NULL,
+    updated_at timestamp NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS work_ledger (
+    stage varchar NOT NULL,
+    item varchar NOT NULL,
+    status varchar NOT NULL DEFAULT 'pending',
+    attempts integer NOT NULL DEFAULT 0,
+    last_error text,
+    next_attempt_at timestamp NOT NULL DEFAULT now(),
+    updated_at timestamp NOT NULL DEFAULT now(),
+    PRIMARY KEY (stage, item)
+);
+
+CREATE INDEX IF NOT EXISTS work_ledger_pending_idx
+    ON work_ledger (stage, next_attempt_at)
+ WHERE status IN ('pending', 'failed');
+
+CREATE INDEX IF NOT EXISTS work_ledger_quarantined_idx
+    ON work_ledger (stage)
+ WHERE status = 'quarantined';
@@ -0,0 +1,7 @@
+-- Stages of the work ledger already filled from their data tables. The
+-- stage is seeded once even when new items were queued in it before.
+
+CREATE TABLE IF NOT EXISTS work_stage (
+    stage varchar PRIMARY KEY,
+    bootstrapped_at timestamp NOT NULL DEFAULT now()
+);
@@ -0,0 +1,10 @@
+-- Claims of the work ledger items. A run marks the items it works on as
+-- claimed, with the backend of its connection, so concurrent runs skip
+-- them. The claims of a backend that is gone are given back.
+
+ALTER TABLE work_ledger ADD COLUMN IF NOT EXISTS claimed_at timestamp;
+ALTER TABLE work_ledger ADD COLUMN IF NOT EXISTS claimed_by integer;
+
+CREATE INDEX IF NOT EXISTS work_ledger_claimed_idx
+    ON work_ledger (stage, claimed_at)
+ WHERE status = 'claimed';
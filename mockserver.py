@@ -0,0 +1,312 @@
+import argparse
+import asyncio
+import base64
+import html
+import json
+import random
+import threading
+from datetime import datetime, timedelta
+from aiohttp import web
+
+# Paths of the CVM and fnet endpoints used by the loaders and the scrapers
+FDIC_DETAILS_PATH = '/swb/sistemas/scw/cPublica/CConsolFdo/ResultBuscaDocsFdoFIDC.aspx'
+FDIC_REPORTS_PATH = '/fnet/publico/pesquisarGerenciadorDocumentosDados'
+FDIC_REPORT_DOCUMENT_PATH = '/fnet/publico/exibirDocumento'
+
+# Ids of the spans of the FDIC details page, in the order of the parser
+# fields, and the ones holding the value in a link
+DETAILS_SPAN_IDS = ('lbNmDenomSocial', 'lbNrPfPj', 'lbNmDenomSocialAdm', 'lbNrPfPjAdm', 'lbDirFdo', 'lbNrPfPjDirFdo',
+                    'lbTelDirFdo', 'lbEmailDirFdo', 'lbEndDirFdo', 'lbNmGestFdo', 'lbNrPfPjGest', 'lbNmDirGest',
+                    'lbNrPfPjDirGest', 'lbTelDirGest', 'lbEmailDirGest', 'lbEndDirGest', 'lbDtFunc', 'lbSitDesc',
+                    'lbInfAdc3')
+DETAILS_LINK_IDS = ('lbEmailDirFdo', 'lbEmailDirGest')
+
+# Asset lines and segment categories of the synthetic monthly reports
+REPORT_ASSETS = ('Disponibilidades', 'Carteira', 'Posições detidas em fundos de investimento',
+                 'Outros ativos', 'Valores a receber')
+REPORT_SEGMENTS = {
+    'Industrial': ('Têxtil', 'Alimentos', 'Químico'),
+    'Comercial': ('Varejo', 'Atacado'),
+    'Financeiro': ('Crédito pessoal', 'Crédito consignado', 'Cartão de crédito'),
+    'Setor público': ('Precatórios', 'Créditos tributários')
+}
+
+# Format a float as a BRL amount, e.g. "R$ 1.234.567,89"
+def format_brl(value):
+    text = f"{abs(value):,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+    return f"R$ {'-' if value < 0 else ''}{text}"
+
+# Format a CNPJ of 14 digits with its punctuation
+def format_cnpj(number):
+    digits = f"{number:014d}"
+    return f"{digits[:2]}.{digits[2:5]}.{digits[5:8]}/{digits[8:12]}-{digits[12:]}"
+
+# Fixture pages generated from a seed, for a number of funds with a number
+# of monthly reports each. The same arguments always give the same pages.
+class SyntheticFixtures:
+    def __init__(self, funds=100, reports_per_fund=24, seed=42):
+        self.seed = seed
+        self.reports_per_fund = reports_per_fund
+        self.cnpjs = [format_cnpj(10_000_000_000_000 + index * 7_919) for index in range(funds)]
+        self._fund_index = {cnpj: index for index, cnpj in enumerate(self.cnpjs)}
+
+    def listing(self):
+        links = ''.join(f'<a class="MenuItemP" href="CadPartic.asp?Cpfcgc_Partic={cnpj}">FIDC {index}</a>\n'
+                        for index, cnpj in enumerate(self.cnpjs))
+        return f'<html><body>\n{links}</body></html>'.encode('utf-8')
+
+    def details(self, cnpj):
+        index = self._fund_index.get(cnpj)
+        if index is None:
+            return None
+
+        # Few administrators and managers shared by many funds, like the real ones
+        admin = index % 23
+        manager = index % 41
+        values = (f'FIDC {index}', cnpj,
+                  f'Administradora {admin}', format_cnpj(20_000_000_000_000 + admin), f'Diretor Adm {admin}',
+                  f'{30_000_000_000 + admin:011d}', '(11) 5555-0000', f'adm{admin}@example.com', f'Rua A, {admin}',
+                  f'Gestora {manager}', format_cnpj(40_000_000_000_000 + manager), f'Diretor Gest {manager}',
+                  f'{50_000_000_000 + manager:011d}', '(21) 5555-0000', f'gest{manager}@example.com', f'Rua B, {manager}',
+                  f'{1 + index % 28:02d}/{1 + index % 12:02d}/{2000 + index % 24}', 'EM FUNCIONAMENTO NORMAL',
+                  f'https://fidc{index}.example.com')
+
+        spans = []
+        for span_id, value in zip(DETAILS_SPAN_IDS, values):
+            value = html.escape(value)
+            if span_id in DETAILS_LINK_IDS:
+                value = f'<a href="mailto:{value}">{value}</a>'
+            spans.append(f'<tr><td><span id="{span_id}">{value}</span></td></tr>')
+
+        return f'<html><body><table>{"".join(spans)}</table></body></html>'.encode('utf-8')
+
+    # Reports of the fund in the format of the report search API, the most
+    # recently delivered first
+    def reports(self, cnpj):
+        index = self._fund_index.get(cnpj)
+        if index is None:
+            return []
+
+        reports = []
+        for month in range(self.reports_per_fund):
+            year, month_index = divmod(2024 * 12 + 11 - month, 12)
+            reference = datetime(year, month_index + 1, 1)
+            delivery = reference + timedelta(days=40, minutes=index % 600)
+            reports.append({'id': (index + 1) * 100_000 + month,
+                            'categoriaDocumento': 'Informes Periódicos',
+                            'tipoDocumento': 'Informe Mensal',
+                            'dataReferencia': reference.strftime('%m/%Y'),
+                            'dataEntrega': delivery.strftime('%d/%m/%Y %H:%M'),
+                            'status': 'AC',
+                            'descricaoStatus': 'Ativo com visualização',
+                            'analisado': 'N',
+                            'situacaoDocumento': 'A'})
+
+        return reports
+
+    def document(self, report_id):
+        if report_id // 100_000 - 1 not in range(len(self.cnpjs)) or report_id % 100_000 >= self.reports_per_fund:
+            return None
+
+        rng = random.Random(self.seed * 1_000_003 + report_id)
+
+        def value_row(padding, label):
+            value = format_brl(rng.uniform(-1e5, 1e9) if rng.random() < 0.05 else rng.uniform(0, 1e9))
+            return (f'<tr><td style="padding-left:{padding}px">{html.escape(label)}</td>'
+                    f'<td><span class="dado-valores">{value}</span></td></tr>')
+
+        assets = ''.join(value_row(20, f'{number} - {name}') for number, name in enumerate(REPORT_ASSETS, 1))
+
+        segments = []
+        for letter, (category, names) in zip('abcdefgh', REPORT_SEGMENTS.items()):
+            segments.append(value_row(20, f'{letter}) {category}'))
+            segments += [value_row(40, f'{letter}.{number}) {name}') for number, name in enumerate(names, 1)]
+
+        return (f'<html><body><table><tr><td>Informe Mensal {report_id}</td></tr></table>'
+                f'<table>{assets}</table><table>{"".join(segments)}</table></body></html>').encode('utf-8')
+
+# Fixture pages recorded by the get-html scrapers in the corpus, see
+# CORPUS_DIR and CORPUS_FORMAT
+class CorpusFixtures:
+    def __init__(self):
+        from corpus import read_fdic_reports_by_cnpj
+
+        self._reports = {cnpj: sorted(reports, key=lambda report: report['delivery_date'], reverse=True)
+                         for cnpj, reports in read_fdic_reports_by_cnpj().items()}
+        self.cnpjs = sorted(self._reports)
+
+    def listing(self):
+        links = ''.join(f'<a class="MenuItemP" href="CadPartic.asp?Cpfcgc_Partic={cnpj}">{cnpj}</a>\n'
+                        for cnpj in self.cnpjs)
+        return f'<html><body>\n{links}</body></html>'.encode('utf-8')
+
+    def details(self, cnpj):
+        from corpus import has_fdic_details, read_fdic_details
+
+        return read_fdic_details(cnpj) if has_fdic_details(cnpj) else None
+
+    # Turn the saved report metadata back into the report search API format
+    def reports(self, cnpj):
+        return [{'id': int(report['report_id']),
+                 'categoriaDocumento': report['category'],
+                 'tipoDocumento': report['type'],
+                 'dataReferencia': report['reference_date'].strftime('%m/%Y'),
+                 'dataEntrega': report['delivery_date'].strftime('%d/%m/%Y %H:%M'),
+                 'status': report['status'],
+                 'descricaoStatus': report['desc_status'],
+                 'analisado': 'S' if report['analyzed'] else 'N',
+                 'situacaoDocumento': report['status_doc']}
+                for report in self._reports.get(cnpj, [])]
+
+    def document(self, report_id):
+        from corpus import has_fdic_report_data, read_fdic_report_data
+
+        return read_fdic_report_data(report_id) if has_fdic_report_data(report_id) else None
+
+# Local stand-in of the CVM and fnet sites serving fixture pages. Each site
+# listens on a port of its own, so the per host limits of the clients apply
+# as against the real sites. Every response waits latency seconds (plus up
+# to jitter more), and error_rate of the requests fail with a 503. With
+# max_page_size the report search returns at most that many reports per
+# page, whatever the length requested, like a server capping its pages.
+class MockServer:
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, error_rate=0.0, seed=42, host='127.0.0.1', max_page_size=None):
+        self.fixtures = fixtures
+        self.max_page_size = max_page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.host = host
+        self.requests = {'details': 0, 'reports': 0, 'document': 0, 'errors': 0}
+        self.cvm_url = None
+        self.fnet_url = None
+        self._rng = random.Random(seed)
+        self._loop = None
+        self._thread = None
+        self._runners = []
+
+    # Wait the injected latency, returns a 503 response for injected errors
+    async def delay(self, kind):
+        self.requests[kind] += 1
+        wait = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        if self.error_rate and self._rng.random() < self.error_rate:
+            self.requests['errors'] += 1
+            return web.Response(status=503, text='Service Unavailable')
+
+        return None
+
+    async def details(self, request):
+        error = await self.delay('details')
+        if error is not None:
+            return error
+
+        page = self.fixtures.details(request.query.get('Cpfcgc_Partic', ''))
+        if page is None:
+            raise web.HTTPNotFound()
+
+        return web.Response(body=page, content_type='text/html', charset='utf-8')
+
+    async def reports(self, request):
+        error = await self.delay('reports')
+        if error is not None:
+            return error
+
+        reports = self.fixtures.reports(request.query.get('cnpjFundo', ''))
+        start = int(request.query.get('s', '0'))
+        length = int(request.query.get('l', '200'))
+        if self.max_page_size is not None:
+            length = min(length, self.max_page_size)
+        page = {'draw': int(request.query.get('d', '0')),
+                'recordsTotal': len(reports),
+                'recordsFiltered': len(reports),
+                'data': reports[start:start + length]}
+
+        return web.Response(text=json.dumps(page), content_type='application/json')
+
+    async def document(self, request):
+        error = await self.delay('document')
+        if error is not None:
+            return error
+
+        try:
+            page = self.fixtures.document(int(request.query.get('id', '')))
+        except ValueError:
+            page = None
+        if page is None:
+            raise web.HTTPNotFound()
+
+        return web.Response(body=base64.b64encode(page), content_type='text/plain')
+
+    async def _start_site(self, routes, port):
+        app = web.Application()
+        app.add_routes(routes)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, port)
+        await site.start()
+        self._runners.append(runner)
+
+        return f"http://{self.host}:{runner.addresses[0][1]}"
+
+    async def _start(self, cvm_port, fnet_port):
+        self.cvm_url = await self._start_site([web.get(FDIC_DETAILS_PATH, self.details)], cvm_port)
+        self.fnet_url = await self._start_site([web.get(FDIC_REPORTS_PATH, self.reports),
+                                                web.get(FDIC_REPORT_DOCUMENT_PATH, self.document)], fnet_port)
+
+    # Start the server on an event loop in a background thread. Port 0 picks
+    # a free port, the URLs of the sites are then in cvm_url and fnet_url.
+    def start(self, cvm_port=0, fnet_port=0):
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start(cvm_port, fnet_port))
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+
+        return self
+
+    def stop(self):
+        async def cleanup():
+            for runner in self._runners:
+                await runner.cleanup()
+
+        asyncio.run_coroutine_threadsafe(cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    # Environment variables pointing the loaders and scrapers to the server
+    def environment(self):
+        return {'CVM_BASE_URL': self.cvm_url, 'FNET_BASE_URL': self.fnet_url}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve fixture pages of the CVM and fnet sites')
+    parser.add_argument('--funds', type=int, default=100, help='number of synthetic funds')
+    parser.add_argument('--reports-per-fund', type=int, default=24, help='number of synthetic reports of each fund')
+    parser.add_argument('--corpus', action='store_true', help='serve the pages of the corpus instead of synthetic ones')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random seconds added on top of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of the requests failing with a 503')
+    parser.add_argument('--cvm-port', type=int, default=8081)
+    parser.add_argument('--fnet-port', type=int, default=8082)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    fixtures = CorpusFixtures() if args.corpus else SyntheticFixtures(args.funds, args.reports_per_fund, args.seed)
+    server = MockServer(fixtures, args.latency, args.jitter, args.error_rate, args.seed).start(args.cvm_port, args.fnet_port)
+
+    for name, value in server.environment().items():
+        print(f"{name}={value}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
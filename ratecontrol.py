@@ -0,0 +1,138 @@
+import asyncio
+import random
+import threading
+import time
+
+# AIMD limit of the in-flight requests to one host. Each successful request
+# raises the limit by about one per round of requests, and an overloaded
+# response (429, 5xx, timeout, connection error) or a latency well above the
+# host baseline halves it, at most once per round trip. The limiter can be
+# shared by the event loops of several threads, e.g. a FetchEngine used by
+# several stream_fetch calls: the waiting requests are woken on their loop.
+class AdaptiveLimiter:
+    def __init__(self, initial, min_limit=1, max_limit=64, latency_tolerance=3.0):
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.latency = None
+        self.base_latency = None
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._waiters = []
+
+    # Wait until a request to the host can be sent
+    async def acquire(self):
+        while True:
+            with self._lock:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+
+                loop = asyncio.get_running_loop()
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._lock:
+                    if (loop, waiter) in self._waiters:
+                        self._waiters.remove((loop, waiter))
+                raise
+
+    # Record the outcome of a request and adjust the limit
+    async def release(self, latency, overloaded=False):
+        with self._lock:
+            self.in_flight -= 1
+
+            # Smoothed latency, and a baseline that follows its lows and
+            # only drifts up slowly
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            if self.base_latency is None or self.latency < self.base_latency:
+                self.base_latency = self.latency
+            else:
+                self.base_latency += (self.latency - self.base_latency) * 0.01
+
+            if overloaded or self.latency > self.base_latency * self.latency_tolerance:
+                self._decrease()
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+            waiters, self._waiters = self._waiters, []
+
+        # Wake all the waiting requests, they check the limit again
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(wake_waiter, waiter)
+            except RuntimeError:
+                # The loop of the waiter is closed
+                pass
+
+    def _decrease(self):
+        # A burst of failures of the same round only halves the limit once
+        now = time.monotonic()
+        if now - self._last_decrease < (self.latency or 1.0):
+            return
+
+        self.limit = max(self.min_limit, self.limit / 2)
+        self.decreases += 1
+        self._last_decrease = now
+
+    def stats(self):
+        return {'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'latency': round(self.latency, 3) if self.latency is not None else None,
+                'decreases': self.decreases}
+
+# Wake a request waiting in AdaptiveLimiter.acquire, on the loop of the request
+def wake_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+# Budget of the retries shared by all the hosts. Retries are allowed up to
+# min_retries plus ratio of the requests sent, so an outage does not turn
+# into a retry storm. The budget can be shared by several threads.
+class RetryBudget:
+    def __init__(self, ratio=0.1, min_retries=10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests = 0
+        self.retries = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    # Take a retry from the budget, returns False when it is exhausted
+    def try_spend(self):
+        with self._lock:
+            if self.retries < self.min_retries + self.ratio * self.requests:
+                self.retries += 1
+                return True
+
+            self.denied += 1
+            return False
+
+    def stats(self):
+        return {'requests': self.requests, 'retries': self.retries, 'denied': self.denied}
+
+# Delay before the retry of the given attempt: exponential backoff with full
+# jitter, but never shorter than the Retry-After of the server
+def backoff_delay(attempt, backoff_factor, max_backoff=60.0, retry_after=None):
+    delay = random.uniform(0, min(max_backoff, backoff_factor * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+
+    return delay
+
+# Parse the seconds of a Retry-After header, ignoring the HTTP date form
+def parse_retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+from dotenv import load_dotenv
+from fetchengine import FetchEngine, stream_fetch
+from metrics import METRICS
+
+load_dotenv()
+
+# Live progress of a scheduler run: completed and failed items, throughput
+# and, when the total is known, the remaining time. The line is redrawn on
+# stderr at most every interval seconds so it does not slow the consumer.
+class Progress:
+    def __init__(self, label, total=None, interval=None, output=None):
+        if interval is None:
+            interval = float(os.getenv("PROGRESS_INTERVAL", "1"))
+
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.output = output if output is not None else sys.stderr
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self._last_draw = 0.0
+        self._width = 0
+
+    def update(self, failed=False):
+        self.done += 1
+        if failed:
+            self.failed += 1
+
+        now = time.monotonic()
+        if now - self._last_draw >= self.interval:
+            self._last_draw = now
+            self.draw(now)
+
+    def rate(self, now=None):
+        elapsed = (now or time.monotonic()) - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def draw(self, now=None, end='\r'):
+        rate = self.rate(now)
+        line = f"{self.label}: {self.done}"
+        if self.total:
+            line += f"/{self.total}"
+            if rate > 0:
+                line += f" eta {int((self.total - self.done) / rate)}s"
+        line += f" ({self.failed} failed) {rate:.1f}/s"
+        # Pad the line to clear the end of a longer previous one
+        self._width = max(self._width, len(line))
+        self.output.write(line.ljust(self._width) + end)
+        self.output.flush()
+
+    def finish(self):
+        self.draw(end='\n')
+
+# Run fetch over the items with one long-lived engine, keeping up to window
+# requests in flight until the items run out. Each item is handed to
+# on_success(item, result) or on_error(item, error) as soon as it completes,
+# so a slow request never holds back the others. Returns the progress.
+def run_scheduler(items, fetch, on_success, on_error, label='items', engine=None, window=None, total=None, progress=None):
+    if engine is None:
+        engine = FetchEngine()
+    if progress is None:
+        progress = Progress(label, total)
+
+    for item, result, error in stream_fetch(items, fetch, engine, window=window):
+        failed = error is not None
+        try:
+            if failed:
+                on_error(item, error)
+            else:
+                on_success(item, result)
+        except Exception as e:
+            failed = True
+            on_error(item, e)
+
+        progress.update(failed)
+        METRICS.count('items_failed' if failed else 'items_done')
+
+    progress.finish()
+    return progress
@@ -0,0 +1,159 @@
+import os
+import re
+from dbconnect import connect_db
+
+# Folder of the versioned migrations, named <version>_<name>.sql
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Get the (version, name, path) of the migrations, ordered by version
+def list_migrations(folder=MIGRATIONS_DIR):
+    migrations = []
+    for file_name in os.listdir(folder):
+        match = re.match(r'(\d+)_(.+)\.sql$', file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(folder, file_name)))
+
+    return sorted(migrations)
+
+# Create the table of the applied migrations if it does not exist
+def create_migrations_table(conn):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version integer PRIMARY KEY,
+                name varchar NOT NULL,
+                applied_at timestamp NOT NULL DEFAULT now()
+            )
+        """)
+
+        # Commit the changes to the database
+        conn.commit()
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+# Apply the migrations not applied yet, each one in its own transaction.
+# An advisory lock keeps concurrent runs from applying the same migration.
+# Returns the versions applied.
+def apply_migrations(conn, folder=MIGRATIONS_DIR):
+    create_migrations_table(conn)
+    applied = []
+
+    for version, name, path in list_migrations(folder):
+        try:
+            # Create a cursor object to execute SQL queries
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+            cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+            if cursor.fetchone() is not None:
+                conn.rollback()
+                continue
+
+            with open(path, mode='r', encoding='utf-8') as file:
+                cursor.execute(file.read())
+
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+
+            # Commit the migration with its version
+            conn.commit()
+            applied.append(version)
+
+        except Exception:
+            conn.rollback()
+            raise
+
+        finally:
+            # Close the cursor
+            cursor.close()
+
+    return applied
+
+# Check that all the migrations of the folder are applied, so a loader
+# fails right away instead of on a table or function of a newer schema.
+# The migrations are applied with schema.py.
+def check_schema(conn, folder=MIGRATIONS_DIR):
+    latest = max((version for version, name, path in list_migrations(folder)), default=0)
+
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        current = 0
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT coalesce(max(version), 0) FROM schema_migrations")
+            current = cursor.fetchone()[0]
+
+        # Leave the connection outside of any transaction
+        conn.rollback()
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+    if current < latest:
+        raise RuntimeError(f"The database schema is at version {current}, run schema.py to apply the migrations up to version {latest}")
+
+# Create the fdic_report_data partitions of the report months without one.
+# Run before loading the report data, so the rows do not pile up in the
+# default partition. Returns the number of partitions created.
+def create_report_data_partitions(conn):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT create_fdic_report_data_partition(month)
+              FROM (SELECT DISTINCT date_trunc('month', ref_date)::date AS month
+                      FROM fdic_report
+                     WHERE ref_date IS NOT NULL) AS months
+             WHERE to_regclass('fdic_report_data_' || to_char(month, 'YYYY_MM')) IS NULL
+        """)
+        created = sum(1 for row in cursor.fetchall() if row[0])
+
+        # Commit the changes to the database
+        conn.commit()
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+    return created
+
+# Detach the fdic_report_data partition of the month, e.g. to archive it.
+# The partition is kept as a standalone table.
+def detach_report_data_partition(conn, month):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        partition_name = f"fdic_report_data_{month.year:04d}_{month.month:02d}"
+        cursor.execute(f'ALTER TABLE fdic_report_data DETACH PARTITION "{partition_name}"')
+
+        # Commit the changes to the database
+        conn.commit()
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+    return partition_name
+
+if __name__ == '__main__':
+    # Connect to the database
+    conn = connect_db()
+
+    try:
+        applied = apply_migrations(conn)
+        created = create_report_data_partitions(conn)
+    finally:
+        # Close the database connection
+        conn.close()
+
+    print(f"Applied migrations: {', '.join(str(version) for version in applied) or 'none'}")
+    print(f"Created {created} report data partitions")
@@ -0,0 +1,133 @@
+from dotenv import load_dotenv
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from metrics import METRICS
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Number of parser processes, 0 parses in the loader worker threads
+def get_parse_workers():
+    return int(os.getenv("PARSE_WORKERS", "0"))
+
+# Run parse(item, content) in a parser process and return its duration
+# with the rows, as the metrics of the process pool are not shared
+def timed_parse(parse, item, content):
+    start = time.perf_counter()
+    rows = parse(item, content)
+    return time.perf_counter() - start, rows
+
+# Start method of the parser processes. By the time the pool starts, the
+# loader already runs fetch threads and holds pooled database connections,
+# which a forked child would inherit, so the parsers are started from a
+# clean forkserver process, or spawned where forkserver is not available.
+def get_parser_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+
+    return multiprocessing.get_context('spawn')
+
+# Run the parse and write stages of a loader on the fetched items. The parse
+# stage runs parse(item, content) in a pool of parse_workers processes, so
+# parsing is not limited by the GIL, and the write stage runs
+# write(item, rows) in write_workers threads. At most parse_queue items wait
+# for or are in the parsers, and at most write_queue parsed items wait for
+# the writers; a full stage blocks the previous one. Failures of any stage
+# are reported with on_error(item, error). The parse latency is recorded as
+# parse_metric.
+def run_pipelined(fetched, parse, write, on_error, parse_workers=None, write_workers=4, parse_queue=None, write_queue=None,
+                  parse_metric='parse'):
+    if parse_workers is None or parse_workers <= 0:
+        parse_workers = os.cpu_count() or 1
+    if parse_queue is None:
+        parse_queue = int(os.getenv("PARSE_QUEUE_SIZE", str(parse_workers * 2)))
+    if write_queue is None:
+        write_queue = int(os.getenv("WRITE_QUEUE_SIZE", str(write_workers * 2)))
+
+    parse_slots = threading.BoundedSemaphore(parse_queue)
+    parsed = queue.Queue(maxsize=write_queue)
+
+    # Hand the parsed rows to the writers, called when a parse completes
+    def parse_done(item, future):
+        try:
+            elapsed, rows = future.result()
+            METRICS.observe(parse_metric, elapsed)
+            parsed.put((item, rows))
+            METRICS.gauge('write_queue', parsed.qsize())
+        except Exception as e:
+            on_error(item, e)
+        finally:
+            parse_slots.release()
+
+    def writer():
+        while True:
+            entry = parsed.get()
+            if entry is None:
+                return
+
+            item, rows = entry
+            try:
+                write(item, rows)
+            except Exception as e:
+                on_error(item, e)
+
+    writers = [threading.Thread(target=writer, daemon=True) for _ in range(write_workers)]
+    for thread in writers:
+        thread.start()
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=parse_workers, mp_context=get_parser_context()) as parsers:
+            for item, content, error in fetched:
+                if error is not None:
+                    on_error(item, error)
+                    continue
+
+                # Wait for a free parse slot before taking the next item
+                parse_slots.acquire()
+                future = parsers.submit(timed_parse, parse, item, content)
+                future.add_done_callback(functools.partial(parse_done, item))
+    finally:
+        # Stop the writers once the parsed rows are written
+        for _ in writers:
+            parsed.put(None)
+        for thread in writers:
+            thread.join()
+
+# Run parse(item, content) and write(item, rows) of the fetched items in a
+# pool of workers threads, with at most workers items in the pool. Failures
+# are reported with on_error(item, error).
+def run_threaded(fetched, parse, write, on_error, workers=4, parse_metric='parse'):
+    slots = threading.BoundedSemaphore(workers)
+
+    def process(item, content):
+        try:
+            with METRICS.timer(parse_metric):
+                rows = parse(item, content)
+            write(item, rows)
+        except Exception as e:
+            on_error(item, e)
+        finally:
+            slots.release()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for item, content, error in fetched:
+            if error is not None:
+                on_error(item, error)
+                continue
+
+            # Wait for a free worker before taking the next item
+            slots.acquire()
+            executor.submit(process, item, content)
+
+# Parse and write the fetched items in parser processes when parse_workers
+# is set, and in the writer threads otherwise
+def run_stage(fetched, parse, write, on_error, parse_workers=0, write_workers=4, parse_metric='parse'):
+    if parse_workers > 0:
+        run_pipelined(fetched, parse, write, on_error, parse_workers, write_workers, parse_metric=parse_metric)
+    else:
+        run_threaded(fetched, parse, write, on_error, write_workers, parse_metric)
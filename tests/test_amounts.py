@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from amounts import parse_brl_amount, parse_brl_amounts
+
+class ParseBrlAmountTest(unittest.TestCase):
+    def test_amounts(self):
+        cases = [('R$ 1.234.567,89', 1234567.89),
+                 ('R$ 0,00', 0.0),
+                 ('12,5', 12.5),
+                 ('R$ -1.234,56', -1234.56),
+                 ('-R$ 1.234,56', -1234.56),
+                 ('(1.234,56)', -1234.56),
+                 ('R$ (10,00)', -10.0)]
+
+        for text, amount in cases:
+            with self.subTest(text=text):
+                self.assertEqual(parse_brl_amount(text), amount)
+
+    def test_blank_amounts(self):
+        for text in (None, '', '   ', 'R$', 'R$ ', '-', ' - '):
+            with self.subTest(text=text):
+                self.assertIsNone(parse_brl_amount(text))
+
+    def test_malformed_amount_fails(self):
+        for text in ('R$ abc', '1,2,3', '(1,00'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_brl_amount(text)
+
+    # The column parser must give the same values as the single one
+    def test_column_matches_single_amounts(self):
+        texts = ['R$ 1.234.567,89', None, '', '-R$ 1,00', '(2,50)', 'R$ 3,00']
+
+        self.assertEqual(parse_brl_amounts(texts), [parse_brl_amount(text) for text in texts])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import base64
+import binascii
+import io
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from base64stream import Base64StreamDecoder, decode_base64_chunks
+
+def split_chunks(data, sizes):
+    chunks = []
+    start = 0
+    for size in sizes:
+        chunks.append(data[start:start + size])
+        start += size
+    chunks.append(data[start:])
+
+    return chunks
+
+class Base64StreamDecoderTest(unittest.TestCase):
+    # The quanta of 4 characters cut across the chunks must decode like the
+    # whole content does at once
+    def test_every_chunk_boundary(self):
+        document = bytes(range(256)) * 3 + b'<html>fim</html>'
+        encoded = base64.b64encode(document)
+
+        for chunk_size in range(1, 9):
+            with self.subTest(chunk_size=chunk_size):
+                chunks = [encoded[start:start + chunk_size] for start in range(0, len(encoded), chunk_size)]
+                self.assertEqual(bytes(decode_base64_chunks(chunks)), base64.b64decode(encoded))
+
+    def test_random_chunks_with_line_breaks(self):
+        rng = random.Random(7)
+        for length in (0, 1, 2, 3, 100, 1001):
+            document = bytes(rng.randrange(256) for _ in range(length))
+            encoded = base64.encodebytes(document)
+            chunks = split_chunks(encoded, [rng.randrange(1, 20) for _ in range(len(encoded) // 10)])
+
+            with self.subTest(length=length):
+                self.assertEqual(bytes(decode_base64_chunks(chunks)), base64.b64decode(encoded))
+
+    def test_text_chunks_to_a_file(self):
+        output = io.BytesIO()
+        decode_base64_chunks(['PGh0', 'bWw+', 'Cg=='], output)
+
+        self.assertEqual(output.getvalue(), b'<html>\n')
+
+    def test_truncated_content_fails(self):
+        decoder = Base64StreamDecoder()
+        decoder.feed(b'PGh0bW')
+
+        with self.assertRaises(binascii.Error):
+            decoder.close()
+
+if __name__ == '__main__':
+    unittest.main()
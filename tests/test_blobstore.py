@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blobstore import BlobStore
+
+class BlobStoreReadonlyTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'docs.store')
+        self.index_path = os.path.join(self.path, 'index')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    # A reader opened while the writer is halfway through an index entry
+    # must leave the entry alone
+    def test_readonly_store_ignores_a_torn_index_line_without_truncating(self):
+        with BlobStore(self.path) as writer:
+            writer.put('1', b'first document')
+
+            with open(self.index_path, 'a', encoding='utf-8') as index:
+                index.write('2\t0\t')
+            size = os.path.getsize(self.index_path)
+
+            with BlobStore(self.path, readonly=True) as reader:
+                self.assertEqual(reader.get('1'), b'first document')
+                self.assertNotIn('2', reader)
+
+            self.assertEqual(os.path.getsize(self.index_path), size)
+
+    def test_writer_truncates_a_torn_index_line(self):
+        with BlobStore(self.path) as writer:
+            writer.put('1', b'first document')
+        with open(self.index_path, 'a', encoding='utf-8') as index:
+            index.write('2\t0\t')
+
+        with BlobStore(self.path) as writer:
+            writer.put('3', b'third document')
+
+        with BlobStore(self.path, readonly=True) as reader:
+            self.assertEqual(sorted(reader.keys()), ['1', '3'])
+            self.assertEqual(reader.get('3'), b'third document')
+
+    def test_readonly_store_does_not_write(self):
+        with BlobStore(self.path) as writer:
+            writer.put('1', b'first document')
+        modified = {name: os.path.getmtime(os.path.join(self.path, name)) for name in os.listdir(self.path)}
+
+        with BlobStore(self.path, readonly=True) as reader:
+            with self.assertRaises(RuntimeError):
+                reader.put('2', b'second document')
+
+        self.assertEqual({name: os.path.getmtime(os.path.join(self.path, name)) for name in os.listdir(self.path)},
+                         modified)
+
+    # The reader maps the segment again once the writer appended to it
+    def test_readonly_store_reads_a_grown_segment(self):
+        with BlobStore(self.path) as writer:
+            writer.put('1', b'first document')
+
+            with BlobStore(self.path, readonly=True) as reader:
+                self.assertEqual(reader.get('1'), b'first document')
+                writer.put('2', b'second document')
+
+            with BlobStore(self.path, readonly=True) as reader:
+                self.assertEqual(reader.get('1'), b'first document')
+                self.assertEqual(reader.get('2'), b'second document')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+import dbconnect
+
+# Stand-in of ThreadedConnectionPool handing out the idle connections first
+class FakePool:
+    def __init__(self, idle, fresh):
+        self.idle = list(idle)
+        self.fresh = list(fresh)
+        self.discarded = []
+
+    def getconn(self):
+        return self.idle.pop(0) if self.idle else self.fresh.pop(0)
+
+    def putconn(self, conn, close=False):
+        if close:
+            self.discarded.append(conn)
+        else:
+            self.idle.append(conn)
+
+def make_pool(fake_pool, size):
+    with mock.patch('psycopg2.pool.ThreadedConnectionPool', return_value=fake_pool):
+        return dbconnect.ConnectionPool(size=size)
+
+class ConnectionPoolHealthCheckTest(unittest.TestCase):
+    # After a server restart every idle connection is broken
+    def test_broken_idle_connections_are_all_discarded(self):
+        fake_pool = FakePool(idle=['stale-1', 'stale-2', 'stale-3'], fresh=['fresh'])
+        pool = make_pool(fake_pool, size=3)
+
+        with mock.patch('dbconnect.is_connection_alive', side_effect=lambda conn: conn == 'fresh'):
+            self.assertEqual(pool._getconn(), 'fresh')
+
+        self.assertEqual(fake_pool.discarded, ['stale-1', 'stale-2', 'stale-3'])
+
+    def test_gives_up_when_no_connection_is_healthy(self):
+        fake_pool = FakePool(idle=[], fresh=[f'down-{i}' for i in range(10)])
+        pool = make_pool(fake_pool, size=2)
+
+        with mock.patch('dbconnect.is_connection_alive', return_value=False):
+            with self.assertRaises(psycopg2.OperationalError):
+                pool._getconn()
+
+        self.assertEqual(len(fake_pool.discarded), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dimensions import DimensionCache
+
+class FakeConnection:
+    def cursor(self):
+        return mock.Mock()
+
+class DimensionCacheUpsertTest(unittest.TestCase):
+    # Funds with the administrator and manager swapped must insert them in
+    # the same order, or their transactions can deadlock on the unique index
+    def test_rows_are_inserted_in_key_order(self):
+        cache = DimensionCache('fdic_admin', ('cnpj', 'name'))
+        admin = ('22.222.222/0001-22', 'Admin')
+        manager = ('11.111.111/0001-11', 'Manager')
+
+        inserted_rows = []
+        with mock.patch('dimensions.execute_values') as execute_values:
+            for rows in ([admin, manager], [manager, admin]):
+                cache.upsert(FakeConnection(), rows)
+                inserted_rows.append(execute_values.call_args[0][2])
+
+        self.assertEqual(inserted_rows, [[manager, admin], [manager, admin]])
+
+    def test_cached_and_empty_keys_are_skipped(self):
+        cache = DimensionCache('fdic_admin', ('cnpj', 'name'))
+        cache.add(['11.111.111/0001-11'])
+
+        with mock.patch('dimensions.execute_values') as execute_values:
+            keys = cache.upsert(FakeConnection(), [('11.111.111/0001-11', 'Known'), (None, 'No CNPJ'),
+                                                   ('33.333.333/0001-33', 'New'), ('33.333.333/0001-33', 'Duplicate')])
+
+        self.assertEqual(keys, ['33.333.333/0001-33'])
+        self.assertEqual(execute_values.call_args[0][2], [('33.333.333/0001-33', 'New')])
+
+if __name__ == '__main__':
+    unittest.main()
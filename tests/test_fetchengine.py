@@ -0,0 +1,114 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpclient
+from fetchengine import FetchEngine, fetch_fdic_reports, stream_fetch
+from mockserver import MockServer, SyntheticFixtures
+
+def report_ids(pages):
+    return sorted(report['id'] for page in pages for report in page['data'])
+
+# Report search serving pages of page_size reports, with the page starting
+# at each offset of short_pages cut to that many reports
+class FakeReportsEngine:
+    def __init__(self, total, page_size, short_pages):
+        self.reports = [{'id': report_id} for report_id in range(total)]
+        self.page_size = page_size
+        self.short_pages = short_pages
+
+    async def get(self, url, verify=True):
+        start = int(parse_qs(urlsplit(url).query)['s'][0])
+        length = self.short_pages.get(start, self.page_size)
+        return json.dumps({'recordsTotal': len(self.reports),
+                           'data': self.reports[start:start + length]}).encode('utf-8')
+
+class FetchFdicReportsTest(unittest.TestCase):
+    # A server returning less reports per page than requested must not make
+    # the fan-out skip the offsets between its pages
+    def test_capped_pages_of_the_mock_server(self):
+        fixtures = SyntheticFixtures(funds=1, reports_per_fund=30)
+        server = MockServer(fixtures, max_page_size=7).start()
+        self.addCleanup(server.stop)
+
+        def fdic_reports_url(cnpj, report_start):
+            return httpclient.fdic_reports_url(cnpj, report_start).replace(httpclient.FNET_BASE_URL, server.fnet_url)
+
+        async def fetch():
+            engine = FetchEngine(per_host=4)
+            await engine.open()
+            try:
+                return await fetch_fdic_reports(engine, fixtures.cnpjs[0])
+            finally:
+                await engine.close()
+
+        with mock.patch('fetchengine.fdic_reports_url', fdic_reports_url):
+            pages = asyncio.run(fetch())
+
+        self.assertEqual(report_ids(pages), sorted(report['id'] for report in fixtures.reports(fixtures.cnpjs[0])))
+
+    def test_short_page_is_completed(self):
+        engine = FakeReportsEngine(total=23, page_size=5, short_pages={10: 2})
+        pages = asyncio.run(fetch_fdic_reports(engine, 'cnpj'))
+
+        self.assertEqual(report_ids(pages), list(range(23)))
+
+    # The watermark must not move past the reports the server did not return
+    def test_missing_reports_fail(self):
+        engine = FakeReportsEngine(total=23, page_size=5, short_pages={10: 2, 12: 0})
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(fetch_fdic_reports(engine, 'cnpj'))
+
+class StreamFetchTest(unittest.TestCase):
+    # Each stream_fetch runs its own event loop, the host limiters of the
+    # engine must keep working on the next one
+    def test_engine_is_reused_by_several_runs(self):
+        fixtures = SyntheticFixtures(funds=1, reports_per_fund=30)
+        server = MockServer(fixtures, latency=0.01).start()
+        self.addCleanup(server.stop)
+
+        async def fetch_report_page(engine, report_start):
+            url = httpclient.fdic_reports_url(fixtures.cnpjs[0], report_start)
+            return await engine.get(url.replace(httpclient.FNET_BASE_URL, server.fnet_url))
+
+        engine = FetchEngine(per_host=2)
+        for _ in range(2):
+            errors = [error for _, _, error in stream_fetch(range(30), fetch_report_page, engine) if error is not None]
+            self.assertEqual(errors, [])
+
+    # The stages of the ingest share an engine from threads of their own
+    def test_engine_is_shared_by_concurrent_runs(self):
+        fixtures = SyntheticFixtures(funds=1, reports_per_fund=30)
+        server = MockServer(fixtures, latency=0.01).start()
+        self.addCleanup(server.stop)
+
+        async def fetch_report_page(engine, report_start):
+            url = httpclient.fdic_reports_url(fixtures.cnpjs[0], report_start)
+            return await engine.get(url.replace(httpclient.FNET_BASE_URL, server.fnet_url))
+
+        engine = FetchEngine(per_host=2)
+        results = []
+
+        def run():
+            results.extend(stream_fetch(range(30), fetch_report_page, engine))
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 90)
+        self.assertEqual([error for _, _, error in results if error is not None], [])
+        self.assertEqual(engine.host_limiter(server.fnet_url).in_flight, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stages import get_parser_context, run_pipelined
+
+def parse_page(item, content):
+    if content is None:
+        raise ValueError(f"Empty page {item}")
+
+    return [content.upper(), os.getpid()]
+
+class RunPipelinedTest(unittest.TestCase):
+    # The parsers must not be forked from the loader, which already runs
+    # fetch threads and holds database connections
+    def test_parsers_are_not_forked(self):
+        self.assertNotEqual(get_parser_context().get_start_method(), 'fork')
+
+    def test_pages_are_parsed_in_processes_and_written(self):
+        fetched = [(1, 'a', None), (2, None, None), (3, 'c', None), (4, None, IOError('fetch failed'))]
+        written = {}
+        errors = {}
+        lock = threading.Lock()
+
+        def write(item, rows):
+            with lock:
+                written[item] = rows
+
+        def on_error(item, error):
+            with lock:
+                errors[item] = type(error).__name__
+
+        run_pipelined(fetched, parse_page, write, on_error, parse_workers=2, write_workers=2)
+
+        self.assertEqual({item: rows[0] for item, rows in written.items()}, {1: 'A', 3: 'C'})
+        self.assertNotIn(os.getpid(), [rows[1] for rows in written.values()])
+        self.assertEqual(errors, {2: 'ValueError', 4: 'OSError'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worklog import FDIC_REPORT_DATA_STAGE, fail_work
+
+def failure_update(error):
+    conn = mock.Mock()
+    fail_work(conn, FDIC_REPORT_DATA_STAGE, 42, error, max_attempts=5, retry_delay=300)
+
+    conn.commit.assert_called_once()
+    return conn.cursor.return_value.execute.call_args[0]
+
+class FailWorkTest(unittest.TestCase):
+    # A document missing from the corpus must not use up the attempts of the item
+    def test_missing_corpus_document_is_requeued(self):
+        sql, params = failure_update(FileNotFoundError('fdic-reports-data document not found: 42'))
+
+        self.assertNotIn('attempts', sql)
+        self.assertIn("status = 'pending'", sql)
+        self.assertEqual(params[-2:], (FDIC_REPORT_DATA_STAGE, '42'))
+
+    def test_fetch_failure_counts_an_attempt(self):
+        sql, params = failure_update(ConnectionError('connection reset'))
+
+        self.assertIn('attempts = attempts + 1', sql)
+        self.assertEqual(params[0], 5)
+
+if __name__ == '__main__':
+    unittest.main()
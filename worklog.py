@@ -0,0 +1,261 @@
+import os
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+load_dotenv()
+
+# Stages of the work ledger, one per loader with per-item work
+FDIC_DETAILS_STAGE = 'fdic_details'
+FDIC_REPORT_DATA_STAGE = 'fdic_report_data'
+
+# Add the items to the stage as pending work. Items already in the ledger
+# keep their state, so a done or quarantined item is not queued again. With
+# claim the items are queued as claimed by the connection, for a run that
+# works on them right away. Returns the items queued.
+def enqueue_work(conn, stage, items, batch_size=1000, claim=False):
+    template = "(%s, %s, 'claimed', now(), pg_backend_pid())" if claim else "(%s, %s, 'pending', NULL, NULL)"
+
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        rows = [(stage, str(item)) for item in items]
+        queued = execute_values(cursor, """
+            INSERT INTO work_ledger (stage, item, status, claimed_at, claimed_by) VALUES %s
+            ON CONFLICT DO NOTHING
+            RETURNING item
+        """, rows, template=template, page_size=batch_size, fetch=True)
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+    return [row[0] for row in queued]
+
+# Add the items listed by the query to the stage as pending work
+def seed_work(conn, stage, query):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute(f"""
+            INSERT INTO work_ledger (stage, item)
+            SELECT %s, work.item::varchar FROM ({query}) AS work (item)
+            ON CONFLICT DO NOTHING
+        """, (stage,))
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+# Fill the stage from the query listing its remaining work. This is only
+# done once per stage, recorded in work_stage, after that the items are
+# queued as they are discovered. The items already queued keep their state.
+def bootstrap_work(conn, stage, query):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        # Concurrent runs wait here for the first one to commit
+        cursor.execute("INSERT INTO work_stage (stage) VALUES (%s) ON CONFLICT DO NOTHING RETURNING stage", (stage,))
+        if cursor.fetchone() is not None:
+            seed_work(conn, stage, query)
+
+        # Commit the changes to the database
+        conn.commit()
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+# Claim the items of the stage that are due to be worked on, batch_size at
+# a time (see DB_FETCH_SIZE). Each batch is marked as claimed by the
+# connection and committed before its items are yielded, skipping the rows
+# locked by another run, so concurrent runs never get the same item. The
+# next batch is claimed once the previous one is read, until no item is due
+# or limit items are claimed.
+def claim_work(conn, stage, limit=None, batch_size=None):
+    if batch_size is None:
+        batch_size = int(os.getenv("DB_FETCH_SIZE", "2000"))
+
+    claimed = 0
+    while limit is None or claimed < limit:
+        try:
+            # Create a cursor object to execute SQL queries
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                UPDATE work_ledger w
+                   SET status = 'claimed', claimed_at = now(), claimed_by = pg_backend_pid(), updated_at = now()
+                  FROM (SELECT stage, item
+                          FROM work_ledger
+                         WHERE stage = %s
+                           AND status IN ('pending', 'failed')
+                           AND next_attempt_at <= now()
+                         ORDER BY next_attempt_at
+                         LIMIT %s
+                           FOR UPDATE SKIP LOCKED) AS due
+                 WHERE w.stage = due.stage AND w.item = due.item
+             RETURNING w.item
+            """, (stage, batch_size if limit is None else min(batch_size, limit - claimed)))
+            items = [row[0] for row in cursor.fetchall()]
+
+            # Commit the claims before working on the items
+            conn.commit()
+
+        finally:
+            # Close the cursor
+            cursor.close()
+
+        if not items:
+            return
+
+        claimed += len(items)
+        yield from items
+
+# Give back the claims of the stage left by runs that died: the ones of a
+# backend no longer connected, and the ones older than WORK_CLAIM_TIMEOUT
+# seconds (default 6 hours). Called when a run starts, returns the number
+# of items released.
+def release_stale_claims(conn, stage, timeout=None):
+    if timeout is None:
+        timeout = float(os.getenv("WORK_CLAIM_TIMEOUT", "21600"))
+
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE work_ledger
+               SET status = 'pending', claimed_at = NULL, claimed_by = NULL, updated_at = now()
+             WHERE stage = %s
+               AND status = 'claimed'
+               AND (claimed_by IS NULL
+                    OR claimed_by NOT IN (SELECT pid FROM pg_stat_activity WHERE pid IS NOT NULL)
+                    OR claimed_at < now() - make_interval(secs => %s))
+        """, (stage, timeout))
+        released = cursor.rowcount
+
+        # Commit the changes to the database
+        conn.commit()
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+    return released
+
+# Mark the item of the stage as done
+def complete_work(conn, stage, item):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE work_ledger
+               SET status = 'done', attempts = attempts + 1, last_error = NULL,
+                   claimed_at = NULL, claimed_by = NULL, updated_at = now()
+             WHERE stage = %s AND item = %s
+        """, (stage, str(item)))
+
+        # Commit the changes to the database
+        conn.commit()
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+# Check if the error will not go away by retrying, like a 404 response
+def is_permanent_error(error):
+    status = getattr(error, 'status', None)
+    if status is None:
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+# Check if the error is a document missing from the corpus (DATA_SOURCE=corpus),
+# which says nothing about the item itself
+def is_missing_document(error):
+    return isinstance(error, FileNotFoundError)
+
+# Put the item of the stage back in the queue without counting an attempt,
+# due again after retry_delay seconds so the same run does not claim it again
+def requeue_work(conn, stage, item, error, retry_delay):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE work_ledger
+               SET status = 'pending',
+                   last_error = %s,
+                   next_attempt_at = now() + make_interval(secs => %s),
+                   claimed_at = NULL, claimed_by = NULL, updated_at = now()
+             WHERE stage = %s AND item = %s
+        """, (f"{type(error).__name__}: {error}"[:2000], retry_delay, stage, str(item)))
+
+        # Commit the changes to the database
+        conn.commit()
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+# Record the failure of the item of the stage. The item is retried after an
+# exponential delay, or quarantined when the error is permanent or it ran
+# out of attempts. A document missing from the corpus is not a failure of
+# the item, it is put back in the queue without counting an attempt.
+def fail_work(conn, stage, item, error, max_attempts=None, retry_delay=None):
+    if max_attempts is None:
+        max_attempts = int(os.getenv("WORK_MAX_ATTEMPTS", "5"))
+    if retry_delay is None:
+        retry_delay = float(os.getenv("WORK_RETRY_DELAY", "300"))
+    if is_missing_document(error):
+        requeue_work(conn, stage, item, error, retry_delay)
+        return
+    if is_permanent_error(error):
+        max_attempts = 0
+
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE work_ledger
+               SET attempts = attempts + 1,
+                   status = CASE WHEN attempts + 1 >= %s THEN 'quarantined' ELSE 'failed' END,
+                   last_error = %s,
+                   next_attempt_at = now() + make_interval(secs => %s * power(2, attempts)),
+                   claimed_at = NULL, claimed_by = NULL, updated_at = now()
+             WHERE stage = %s AND item = %s
+        """, (max_attempts, f"{type(error).__name__}: {error}"[:2000], retry_delay, stage, str(item)))
+
+        # Commit the changes to the database
+        conn.commit()
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+# Put the quarantined items of the stage back in the queue
+def release_quarantined_work(conn, stage):
+    try:
+        # Create a cursor object to execute SQL queries
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE work_ledger
+               SET status = 'pending', attempts = 0, next_attempt_at = now(), updated_at = now()
+             WHERE stage = %s AND status = 'quarantined'
+        """, (stage,))
+        released = cursor.rowcount
+
+        # Commit the changes to the database
+        conn.commit()
+
+    finally:
+        # Close the cursor
+        cursor.close()
+
+    return released